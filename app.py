@@ -3,27 +3,40 @@ import aws_cdk as cdk
 import yaml
 
 from backend.component import Valohai
+from backend.component import ValohaiStateful
+from backend.guardrails import synth
+from backend.sizing import apply_sizing
+from backend.sizing import merge
 
 with open("config.yaml", "r") as f:
     config = yaml.load(f, Loader=yaml.FullLoader)
 
-    aws_account_id = str(config["aws_account_id"])
-    aws_region = config["aws_region"]
-
-env = cdk.Environment(account=aws_account_id, region=aws_region)
+# Each environment overrides settings of the shared config
+environments = config.pop("environments", None) or {"Sandbox": {}}
 
 app = cdk.App()
-Valohai(
-    app,
-    "ValohaiSandbox",
-    env=env,
-    aws_account_id=aws_account_id,
-    vpc_id=config["vpc_id"],
-    roi_subnet_id=config["roi_subnet_id"],
-    db_subnet_ids=config["db_subnet_ids"],
-    cache_subnet_ids=config["cache_subnet_ids"],
-    domain=config["domain"],
-    environment_name=config["environment_name"],
-)
+for name, overrides in environments.items():
+    environment_config, sizing_explanations = apply_sizing(
+        merge(config, overrides or {})
+    )
+    env = cdk.Environment(
+        account=str(environment_config["aws_account_id"]),
+        region=environment_config["aws_region"],
+    )
+
+    stateful = ValohaiStateful(
+        app, f"Valohai{name}Stateful", env=env, config=environment_config
+    )
+    for explanation in sizing_explanations:
+        cdk.Annotations.of(stateful).add_info(f"Sizing: {explanation}")
+
+    Valohai(
+        app,
+        f"Valohai{name}",
+        env=env,
+        config=environment_config,
+        stateful=stateful,
+    )
 
-app.synth()
+# The guardrails check the synthesized templates, property overrides included
+synth(app)
@@ -0,0 +1,207 @@
+import aws_cdk as cdk
+import aws_cdk.aws_athena as athena
+import aws_cdk.aws_glue as glue
+import aws_cdk.aws_s3 as s3
+from constructs import Construct
+
+from backend.lb.infrastructure import LoadBalancer
+
+DATABASE = "valohai_logs"
+TABLE = "alb_access_logs"
+
+# Access log fields in order, see
+# https://docs.aws.amazon.com/elasticloadbalancing/latest/application/load-balancer-access-logs.html
+COLUMNS = [
+    ("type", "string"),
+    ("time", "string"),
+    ("elb", "string"),
+    ("client_ip", "string"),
+    ("client_port", "int"),
+    ("target_ip", "string"),
+    ("target_port", "int"),
+    ("request_processing_time", "double"),
+    ("target_processing_time", "double"),
+    ("response_processing_time", "double"),
+    ("elb_status_code", "int"),
+    ("target_status_code", "string"),
+    ("received_bytes", "bigint"),
+    ("sent_bytes", "bigint"),
+    ("request_verb", "string"),
+    ("request_url", "string"),
+    ("request_proto", "string"),
+    ("user_agent", "string"),
+    ("ssl_cipher", "string"),
+    ("ssl_protocol", "string"),
+    ("target_group_arn", "string"),
+    ("trace_id", "string"),
+    ("domain_name", "string"),
+    ("chosen_cert_arn", "string"),
+    ("matched_rule_priority", "string"),
+    ("request_creation_time", "string"),
+    ("actions_executed", "string"),
+    ("redirect_url", "string"),
+    ("lambda_error_reason", "string"),
+    ("target_port_list", "string"),
+    ("target_status_code_list", "string"),
+    ("classification", "string"),
+    ("classification_reason", "string"),
+    ("conn_trace_id", "string"),
+]
+
+LOG_LINE_REGEX = (
+    r"([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*):([0-9]*) ([^ ]*)[:-]([0-9]*) ([-.0-9]*) "
+    r"([-.0-9]*) ([-.0-9]*) (|[-0-9]*) (-|[-0-9]*) ([-0-9]*) ([-0-9]*) "
+    r'"([^ ]*) (.*) (- |[^ ]*)" "([^"]*)" ([A-Z0-9-_]+) ([A-Za-z0-9.-]*) '
+    r'([^ ]*) "([^"]*)" "([^"]*)" "([^"]*)" ([-.0-9]*) ([^ ]*) "([^"]*)" '
+    r'"([^"]*)" "([^ ]*)" "([^\s]+?)" "([^\s]+)" "([^ ]*)" "([^ ]*)" ?([^ ]*)?'
+)
+
+# Execution, project and other IDs vary per request, so collapse them to
+# group requests by endpoint
+PATH = (
+    "regexp_replace(url_extract_path(request_url), "
+    "'/[0-9a-f]{8}-[0-9a-f-]{27}|/[0-9]+', '/:id')"
+)
+# Requests the load balancer didn't send to a target have -1 as timings
+SINCE_YESTERDAY = (
+    "day >= date_format(current_date - interval '1' day, '%Y/%m/%d') "
+    "AND target_processing_time >= 0"
+)
+
+NAMED_QUERIES = {
+    "valohai-latency-by-path": (
+        "p50, p95 and p99 target response time by endpoint over the last day",
+        f"""SELECT {PATH} AS path,
+       count(*) AS requests,
+       approx_percentile(target_processing_time, 0.50) AS p50,
+       approx_percentile(target_processing_time, 0.95) AS p95,
+       approx_percentile(target_processing_time, 0.99) AS p99
+FROM {DATABASE}.{TABLE}
+WHERE {SINCE_YESTERDAY}
+GROUP BY 1
+ORDER BY p99 DESC
+LIMIT 50""",
+    ),
+    "valohai-slowest-targets": (
+        "Roi targets by p99 response time and 5xx count over the last day",
+        f"""SELECT target_ip,
+       count(*) AS requests,
+       avg(target_processing_time) AS average,
+       approx_percentile(target_processing_time, 0.99) AS p99,
+       count_if(target_status_code LIKE '5%') AS errors_5xx
+FROM {DATABASE}.{TABLE}
+WHERE {SINCE_YESTERDAY}
+GROUP BY target_ip
+ORDER BY p99 DESC""",
+    ),
+    "valohai-request-rate-heatmap": (
+        "Requests per minute by endpoint over the last day",
+        f"""SELECT date_trunc('minute', from_iso8601_timestamp(time)) AS minute,
+       {PATH} AS path,
+       count(*) AS requests
+FROM {DATABASE}.{TABLE}
+WHERE {SINCE_YESTERDAY}
+GROUP BY 1, 2
+ORDER BY 1, 3 DESC""",
+    ),
+}
+
+
+class AccessLogs(Construct):
+    def __init__(
+        self,
+        scope: Construct,
+        id_: str,
+        *,
+        load_balancer: LoadBalancer,
+        bucket: s3.IBucket,
+        prefix: str = "roi-lb",
+        retention_days: int = 30,
+    ):
+        super().__init__(scope, id_)
+
+        stack = cdk.Stack.of(self)
+        load_balancer.load_balancer.log_access_logs(bucket, prefix)
+
+        glue_database = glue.CfnDatabase(
+            self,
+            "valohai-logs-database",
+            catalog_id=stack.account,
+            database_input=glue.CfnDatabase.DatabaseInputProperty(name=DATABASE),
+        )
+
+        # Partition projection computes the daily partitions from the query, so
+        # there are no crawlers or MSCK REPAIR runs to keep up to date
+        location = (
+            f"s3://{bucket.bucket_name}/{prefix}/AWSLogs/{stack.account}"
+            f"/elasticloadbalancing/{stack.region}"
+        )
+        table = glue.CfnTable(
+            self,
+            "valohai-logs-alb-table",
+            catalog_id=stack.account,
+            database_name=DATABASE,
+            table_input=glue.CfnTable.TableInputProperty(
+                name=TABLE,
+                table_type="EXTERNAL_TABLE",
+                parameters={
+                    "projection.enabled": "true",
+                    "projection.day.type": "date",
+                    "projection.day.range": f"NOW-{retention_days}DAYS,NOW",
+                    "projection.day.format": "yyyy/MM/dd",
+                    "projection.day.interval": "1",
+                    "projection.day.interval.unit": "DAYS",
+                    "storage.location.template": f"{location}/${{day}}",
+                },
+                partition_keys=[
+                    glue.CfnTable.ColumnProperty(name="day", type="string")
+                ],
+                storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
+                    columns=[
+                        glue.CfnTable.ColumnProperty(name=name, type=type_)
+                        for name, type_ in COLUMNS
+                    ],
+                    location=location,
+                    input_format="org.apache.hadoop.mapred.TextInputFormat",
+                    output_format="org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat",
+                    serde_info=glue.CfnTable.SerdeInfoProperty(
+                        serialization_library="org.apache.hadoop.hive.serde2.RegexSerDe",
+                        parameters={
+                            "serialization.format": "1",
+                            "input.regex": LOG_LINE_REGEX,
+                        },
+                    ),
+                ),
+            ),
+        )
+        table.add_dependency(glue_database)
+
+        work_group = athena.CfnWorkGroup(
+            self,
+            "valohai-logs-workgroup",
+            name="valohai-logs",
+            description="Valohai load balancer access log analysis",
+            recursive_delete_option=True,
+            work_group_configuration=athena.CfnWorkGroup.WorkGroupConfigurationProperty(
+                enforce_work_group_configuration=True,
+                result_configuration=athena.CfnWorkGroup.ResultConfigurationProperty(
+                    output_location=f"s3://{bucket.bucket_name}/athena-results/",
+                    encryption_configuration=athena.CfnWorkGroup.EncryptionConfigurationProperty(
+                        encryption_option="SSE_S3"
+                    ),
+                ),
+            ),
+        )
+
+        for name, (description, query) in NAMED_QUERIES.items():
+            named_query = athena.CfnNamedQuery(
+                self,
+                name,
+                name=name,
+                description=description,
+                database=DATABASE,
+                query_string=query,
+                work_group=work_group.name,
+            )
+            named_query.add_dependency(work_group)
+            named_query.add_dependency(table)
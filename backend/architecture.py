@@ -0,0 +1,42 @@
+"""
+CPU architecture switch for the Roi, database and Redis tiers.
+
+With architecture: arm64 in config.yaml, the x86 instance families these
+tiers use are swapped for their Graviton counterparts, so the same sizes
+from config.yaml or sizing profiles apply on both architectures.
+"""
+ARCHITECTURES = ["x86_64", "arm64"]
+
+GRAVITON_FAMILIES = {
+    "c5": "c7g",
+    "c6i": "c7g",
+    "m5": "m7g",
+    "m5a": "m7g",
+    "m6i": "m7g",
+    "r5": "r7g",
+    "r6i": "r7g",
+    "t3": "t4g",
+    "cache.m5": "cache.m7g",
+    "cache.r5": "cache.r7g",
+    "cache.t3": "cache.t4g",
+}
+
+
+def is_graviton(instance_type: str) -> bool:
+    family = instance_type.rsplit(".", 1)[0].split(".")[-1]
+    return family[-1] == "g" or family[-2:] == "gd"
+
+
+def instance_type_for(instance_type: str, architecture: str) -> str:
+    """Return the instance type to use on the architecture."""
+    if architecture not in ARCHITECTURES:
+        raise ValueError(
+            f"Unknown architecture {architecture}, use one of {', '.join(ARCHITECTURES)}"
+        )
+    if architecture == "x86_64" or is_graviton(instance_type):
+        return instance_type
+
+    family, size = instance_type.rsplit(".", 1)
+    if family not in GRAVITON_FAMILIES:
+        raise ValueError(f"No Graviton instance family for {instance_type}")
+    return f"{GRAVITON_FAMILIES[family]}.{size}"
@@ -0,0 +1,182 @@
+from typing import List, Optional
+
+import aws_cdk as cdk
+import aws_cdk.aws_certificatemanager as acm
+import aws_cdk.aws_cloudfront as cloudfront
+import aws_cdk.aws_cloudfront_origins as origins
+import aws_cdk.aws_s3 as s3
+from constructs import Construct
+
+from backend.lb.infrastructure import LoadBalancer
+
+PRICE_CLASSES = {
+    "PriceClass_100": cloudfront.PriceClass.PRICE_CLASS_100,
+    "PriceClass_200": cloudfront.PriceClass.PRICE_CLASS_200,
+    "PriceClass_All": cloudfront.PriceClass.PRICE_CLASS_ALL,
+}
+
+
+class Cdn(Construct):
+    def __init__(
+        self,
+        scope: Construct,
+        id_: str,
+        *,
+        load_balancer: LoadBalancer,
+        bucket: s3.Bucket,
+        static_paths: Optional[List[str]] = None,
+        artifact_paths: Optional[List[str]] = None,
+        artifact_public_key: Optional[str] = None,
+        origin_domain_name: Optional[str] = None,
+        domain_names: Optional[List[str]] = None,
+        certificate_arn: Optional[str] = None,
+        price_class: str = "PriceClass_All",
+    ):
+        super().__init__(scope, id_)
+
+        static_paths = ["/static/*"] if static_paths is None else static_paths
+        artifact_paths = artifact_paths or []
+
+        # Artifacts are private, so CloudFront must only serve them on signed URLs
+        if artifact_paths and not artifact_public_key:
+            raise ValueError(
+                "CDN artifact_paths require artifact_public_key for signed URLs"
+            )
+
+        # With a certificate, the ALB redirects plain HTTP to HTTPS, and its
+        # certificate only matches the installation domain, not the ALB DNS name
+        if load_balancer.has_https and not origin_domain_name:
+            raise ValueError(
+                "CDN origin_domain_name is required when the load balancer uses HTTPS"
+            )
+
+        if origin_domain_name:
+            alb_origin: cloudfront.IOrigin = origins.HttpOrigin(
+                origin_domain_name,
+                protocol_policy=cloudfront.OriginProtocolPolicy.HTTPS_ONLY,
+                read_timeout=cdk.Duration.seconds(60),
+                keepalive_timeout=cdk.Duration.seconds(60),
+            )
+        else:
+            alb_origin = origins.LoadBalancerV2Origin(
+                load_balancer.load_balancer,
+                protocol_policy=cloudfront.OriginProtocolPolicy.HTTP_ONLY,
+                read_timeout=cdk.Duration.seconds(60),
+                keepalive_timeout=cdk.Duration.seconds(60),
+            )
+
+        static_cache_policy = cloudfront.CachePolicy(
+            self,
+            "valohai-cdn-static-cache",
+            cache_policy_name="valohai-cdn-static",
+            comment="Versioned UI assets served by Roi",
+            default_ttl=cdk.Duration.days(1),
+            max_ttl=cdk.Duration.days(365),
+            min_ttl=cdk.Duration.seconds(0),
+            query_string_behavior=cloudfront.CacheQueryStringBehavior.all(),
+            cookie_behavior=cloudfront.CacheCookieBehavior.none(),
+            header_behavior=cloudfront.CacheHeaderBehavior.none(),
+            enable_accept_encoding_gzip=True,
+            enable_accept_encoding_brotli=True,
+        )
+
+        static_behavior = cloudfront.BehaviorOptions(
+            origin=alb_origin,
+            cache_policy=static_cache_policy,
+            compress=True,
+            viewer_protocol_policy=cloudfront.ViewerProtocolPolicy.REDIRECT_TO_HTTPS,
+        )
+        additional_behaviors = {path: static_behavior for path in static_paths}
+
+        bucket_origin = origins.HttpOrigin(bucket.bucket_regional_domain_name)
+        if artifact_paths:
+            public_key = cloudfront.PublicKey(
+                self,
+                "valohai-cdn-artifact-key",
+                encoded_key=artifact_public_key or "",
+                comment="Verifies signed artifact download URLs",
+            )
+            key_group = cloudfront.KeyGroup(
+                self, "valohai-cdn-artifact-key-group", items=[public_key]
+            )
+            artifact_cache_policy = cloudfront.CachePolicy(
+                self,
+                "valohai-cdn-artifact-cache",
+                cache_policy_name="valohai-cdn-artifacts",
+                comment="Immutable execution outputs and artifacts",
+                default_ttl=cdk.Duration.days(7),
+                max_ttl=cdk.Duration.days(365),
+                min_ttl=cdk.Duration.seconds(0),
+                query_string_behavior=cloudfront.CacheQueryStringBehavior.none(),
+                cookie_behavior=cloudfront.CacheCookieBehavior.none(),
+                header_behavior=cloudfront.CacheHeaderBehavior.none(),
+                enable_accept_encoding_gzip=True,
+                enable_accept_encoding_brotli=True,
+            )
+            artifact_behavior = cloudfront.BehaviorOptions(
+                origin=bucket_origin,
+                cache_policy=artifact_cache_policy,
+                allowed_methods=cloudfront.AllowedMethods.ALLOW_GET_HEAD,
+                compress=True,
+                trusted_key_groups=[key_group],
+                viewer_protocol_policy=cloudfront.ViewerProtocolPolicy.HTTPS_ONLY,
+            )
+            for path in artifact_paths:
+                additional_behaviors[path] = artifact_behavior
+
+        self.distribution = cloudfront.Distribution(
+            self,
+            "valohai-cdn",
+            comment="Valohai static assets and artifact downloads",
+            default_behavior=cloudfront.BehaviorOptions(
+                origin=alb_origin,
+                cache_policy=cloudfront.CachePolicy.CACHING_DISABLED,
+                origin_request_policy=cloudfront.OriginRequestPolicy.ALL_VIEWER,
+                allowed_methods=cloudfront.AllowedMethods.ALLOW_ALL,
+                viewer_protocol_policy=cloudfront.ViewerProtocolPolicy.REDIRECT_TO_HTTPS,
+            ),
+            additional_behaviors=additional_behaviors,
+            domain_names=domain_names,
+            certificate=(
+                acm.Certificate.from_certificate_arn(
+                    self, "valohai-cdn-certificate", certificate_arn
+                )
+                if certificate_arn
+                else None
+            ),
+            http_version=cloudfront.HttpVersion.HTTP2_AND_3,
+            price_class=PRICE_CLASSES[price_class],
+        )
+
+        if artifact_paths:
+            self._use_origin_access_control()
+
+    def _use_origin_access_control(self) -> None:
+        """
+        This CDK version only supports origin access identities for S3 origins,
+        so the bucket origin is switched to origin access control on the L1.
+        The bucket policy that lets it read is in the stateful stack, see
+        Bucket.allow_cloudfront_reads.
+        """
+        origin_access_control = cloudfront.CfnOriginAccessControl(
+            self,
+            "valohai-cdn-oac",
+            origin_access_control_config=cloudfront.CfnOriginAccessControl.OriginAccessControlConfigProperty(
+                name="valohai-cdn-data",
+                origin_access_control_origin_type="s3",
+                signing_behavior="always",
+                signing_protocol="sigv4",
+            ),
+        )
+
+        cfn_distribution = self.distribution.node.default_child
+        assert isinstance(cfn_distribution, cloudfront.CfnDistribution)
+        origin_index = 1  # The load balancer origin is always the first one
+        prefix = f"DistributionConfig.Origins.{origin_index}"
+        cfn_distribution.add_property_deletion_override(f"{prefix}.CustomOriginConfig")
+        cfn_distribution.add_property_override(
+            f"{prefix}.S3OriginConfig.OriginAccessIdentity", ""
+        )
+        cfn_distribution.add_property_override(
+            f"{prefix}.OriginAccessControlId", origin_access_control.attr_id
+        )
@@ -1,64 +1,152 @@
-from typing import Any
+from typing import Any, Dict, List, Optional
 
+from aws_cdk import Aspects
 from aws_cdk import Stack
 from aws_cdk import Tags
 from aws_cdk import aws_ec2 as ec2
 from aws_cdk import aws_elasticloadbalancingv2_targets as targets
 from constructs import Construct
 
+from backend.accesslogs.infrastructure import AccessLogs
+from backend.cdn.infrastructure import Cdn
 from backend.compute.infrastructure import RoiInstance
+from backend.ecr.infrastructure import ImageCache
+from backend.endpoints.infrastructure import Endpoints
+from backend.fsx.infrastructure import SharedStorage
+from backend.guardrails import PerformanceGuardrails
 from backend.iam.infrastructure import IAM
+from backend.imagebuilder.infrastructure import WorkerImage
+from backend.interruptions.infrastructure import Interruptions
 from backend.lb.infrastructure import LoadBalancer
+from backend.monitoring.infrastructure import Monitoring
 from backend.postgres.infrastructure import Database
 from backend.redis.infrastructure import Queue
 from backend.s3.infrastructure import Bucket
+from backend.s3.infrastructure import LogsBucket
+from backend.workers.infrastructure import Workers
 
 
-class Valohai(Stack):
+def offline_vpc(
+    scope: Construct,
+    vpc_id: str,
+    *,
+    public_subnet_ids: List[str],
+    private_subnet_ids: List[str],
+    vpc_cidr_block: str,
+    subnets: Dict[str, Dict[str, str]],
+) -> ec2.IVpc:
+    """
+    Build the VPC from config instead of a context lookup, so the stack can
+    be synthesized without AWS credentials or a matching cdk.context.json.
+    """
+    availability_zones = sorted(
+        {subnet["availability_zone"] for subnet in subnets.values()}
+    )
+
+    # Vpc.from_vpc_attributes assigns the nth subnet to the nth AZ (mod the
+    # AZ count), so interleave the subnets of each AZ
+    def by_zone(subnet_ids: List[str]) -> List[str]:
+        per_zone = [
+            [
+                subnet_id
+                for subnet_id in dict.fromkeys(subnet_ids)
+                if subnets[subnet_id]["availability_zone"] == zone
+            ]
+            for zone in availability_zones
+        ]
+        if len({len(zone_subnets) for zone_subnets in per_zone}) != 1:
+            raise ValueError(
+                "Offline synth needs the same number of subnets in every AZ"
+            )
+        return [subnet_id for group in zip(*per_zone) for subnet_id in group]
+
+    public_ids = by_zone(public_subnet_ids)
+    private_ids = by_zone(private_subnet_ids)
+
+    return ec2.Vpc.from_vpc_attributes(
+        scope,
+        "VPC",
+        vpc_id=vpc_id,
+        vpc_cidr_block=vpc_cidr_block,
+        availability_zones=availability_zones,
+        public_subnet_ids=public_ids,
+        public_subnet_route_table_ids=[
+            subnets[subnet_id]["route_table_id"] for subnet_id in public_ids
+        ],
+        private_subnet_ids=private_ids,
+        private_subnet_route_table_ids=[
+            subnets[subnet_id]["route_table_id"] for subnet_id in private_ids
+        ],
+    )
+
+
+def valohai_vpc(scope: Construct, config: Dict[str, Any]) -> ec2.IVpc:
+    offline = config.get("offline")
+    if offline is None:
+        return ec2.Vpc.from_lookup(scope, "VPC", vpc_id=config["vpc_id"])
+
+    return offline_vpc(
+        scope,
+        config["vpc_id"],
+        public_subnet_ids=config["lb_subnet_ids"],
+        private_subnet_ids=[
+            config["roi_subnet_id"],
+            *config["db_subnet_ids"],
+            *config["cache_subnet_ids"],
+            *config["worker_subnet_ids"],
+        ],
+        vpc_cidr_block=offline["vpc_cidr_block"],
+        subnets=offline["subnets"],
+    )
+
+
+def subnet_selection(vpc: ec2.IVpc, subnet_ids: List[str]) -> ec2.SubnetSelection:
+    return ec2.SubnetSelection(
+        subnets=vpc.select_subnets(
+            subnet_filters=[ec2.SubnetFilter.by_ids(subnet_ids)],
+        ).subnets
+    )
+
+
+class ValohaiStateful(Stack):
+    """
+    Slow-changing resources that hold data: the database, Redis, the data
+    bucket and the security groups the data stores allow access from.
+    """
+
     def __init__(
         self,
         scope: Construct,
         id_: str,
-        aws_account_id: str,
-        vpc_id: str,
-        roi_subnet_id: str,
-        db_subnet_ids: str,
-        cache_subnet_ids: str,
-        domain: str,
-        environment_name: str,
+        *,
+        config: Dict[str, Any],
         **kwargs: Any,
     ):
         super().__init__(scope, id_, **kwargs)
 
         Tags.of(self).add("valohai", "1")
+        Aspects.of(self).add(PerformanceGuardrails(**(config.get("guardrails") or {})))
 
-        vpc = ec2.Vpc.from_lookup(self, "VPC", vpc_id=vpc_id)
-        roi_subnets = ec2.SubnetSelection(
-            subnets=vpc.select_subnets(
-                subnet_filters=[ec2.SubnetFilter.by_ids([roi_subnet_id])],
-            ).subnets
-        )
-
-        db_subnets = ec2.SubnetSelection(
-            subnets=vpc.select_subnets(
-                subnet_filters=[ec2.SubnetFilter.by_ids(db_subnet_ids)]
-            ).subnets
-        )
-
-        bucket_name = f"valohai-data-{aws_account_id}"
+        vpc = valohai_vpc(self, config)
+        bucket_name = f"valohai-data-{config['aws_account_id']}"
+        architecture = config.get("architecture", "x86_64")
 
         self.bucket = Bucket(self, "valohai-data", bucket_name=bucket_name)
+        artifact_paths = (config.get("cdn") or {}).get("artifact_paths")
+        if artifact_paths:
+            self.bucket.allow_cloudfront_reads(artifact_paths)
 
-        iam = IAM(
-            self,
-            "valohai-iam",
-            aws_account_id=aws_account_id,
-            s3_bucket_name=bucket_name,
-        )
-
-        load_balancer = LoadBalancer(self, "valohai-loadbalancer", vpc=vpc)
+        access_logs = config.get("access_logs")
+        self.logs_bucket: Optional[LogsBucket] = None
+        if access_logs is not None:
+            self.logs_bucket = LogsBucket(
+                self,
+                "valohai-logs",
+                bucket_name=f"valohai-logs-{config['aws_account_id']}",
+                expiration_days=access_logs.get("retention_days", 30),
+            )
 
-        sg_workers = ec2.SecurityGroup(
+        self.sg_workers = ec2.SecurityGroup(
             self,
             "valohai-sg-workers",
             security_group_name="valohai-sg-workers",
@@ -67,7 +155,7 @@ class Valohai(Stack):
             allow_all_outbound=True,
         )
 
-        sg_master = ec2.SecurityGroup(
+        self.sg_master = ec2.SecurityGroup(
             self,
             "valohai-sg-master",
             security_group_name="valohai-sg-master",
@@ -76,45 +164,267 @@ class Valohai(Stack):
             allow_all_outbound=True,
         )
 
-        sg_master.add_ingress_rule(
-            peer=ec2.Peer.security_group_id(
-                load_balancer.sg_loadbalancer.security_group_id
-            ),
-            connection=ec2.Port.tcp(8000),
-            description="Allow access from LB",
-        )
-
-        sg_master.add_ingress_rule(
+        self.sg_master.add_ingress_rule(
             ec2.Peer.ipv4("0.0.0.0/0"), ec2.Port.tcp(22), "Allow SSH access from user"
         )
 
+        fsx = config.get("fsx")
+        if fsx is not None:
+            fsx_options = {
+                key: value for key, value in fsx.items() if key != "subnet_id"
+            }
+            fsx_subnet_id = fsx.get("subnet_id", config["worker_subnet_ids"][0])
+            self.shared_storage = SharedStorage(
+                self,
+                "valohai-fsx",
+                vpc=vpc,
+                subnet=vpc.select_subnets(
+                    subnet_filters=[ec2.SubnetFilter.by_ids([fsx_subnet_id])]
+                ).subnets[0],
+                sg_workers=self.sg_workers,
+                s3_bucket_name=bucket_name,
+                **fsx_options,
+            )
+
         self.database = Database(
             self,
             "valohai-roi-database",
             vpc=vpc,
-            subnets=db_subnets,
-            sg_master=sg_master,
+            subnets=subnet_selection(vpc, config["db_subnet_ids"]),
+            sg_master=self.sg_master,
+            architecture=architecture,
+            **(config.get("database") or {}),
         )
 
         self.redis = Queue(
             self,
             "valohai-queue",
             vpc=vpc,
-            subnet_ids=cache_subnet_ids,
-            sg_master=sg_master,
-            sg_workers=sg_workers,
+            subnet_ids=config["cache_subnet_ids"],
+            sg_master=self.sg_master,
+            sg_workers=self.sg_workers,
+            architecture=architecture,
+            **(config.get("redis") or {}),
+        )
+
+
+class Valohai(Stack):
+    """
+    The Valohai application: IAM, the load balancer, Roi and the worker fleet.
+    Everything here can be replaced without touching the stateful stack.
+    """
+
+    def __init__(
+        self,
+        scope: Construct,
+        id_: str,
+        *,
+        config: Dict[str, Any],
+        stateful: ValohaiStateful,
+        **kwargs: Any,
+    ):
+        super().__init__(scope, id_, **kwargs)
+
+        Tags.of(self).add("valohai", "1")
+        Aspects.of(self).add(PerformanceGuardrails(**(config.get("guardrails") or {})))
+
+        self.bucket = stateful.bucket
+        self.database = stateful.database
+        self.redis = stateful.redis
+        vpc = valohai_vpc(self, config)
+
+        # Import the security groups so rules added to them from here are
+        # created in this stack, and the stateful stack never depends on it
+        sg_master = ec2.SecurityGroup.from_security_group_id(
+            self,
+            "valohai-sg-master",
+            stateful.sg_master.security_group_id,
+            allow_all_outbound=True,
+        )
+        sg_workers = ec2.SecurityGroup.from_security_group_id(
+            self,
+            "valohai-sg-workers",
+            stateful.sg_workers.security_group_id,
+            allow_all_outbound=True,
+        )
+        aws_account_id = str(config["aws_account_id"])
+        bucket_name = f"valohai-data-{aws_account_id}"
+
+        iam = IAM(
+            self,
+            "valohai-iam",
+            aws_account_id=aws_account_id,
+            s3_bucket_name=bucket_name,
+        )
+
+        load_balancer = LoadBalancer(
+            self,
+            "valohai-loadbalancer",
+            vpc=vpc,
+            certificate_arn=config.get("certificate_arn"),
+            **(config.get("load_balancer") or {}),
         )
 
+        sg_master.add_ingress_rule(
+            peer=ec2.Peer.security_group_id(
+                load_balancer.sg_loadbalancer.security_group_id
+            ),
+            connection=ec2.Port.tcp(8000),
+            description="Allow access from LB",
+        )
+
+        access_logs = config.get("access_logs")
+        if access_logs is not None:
+            assert stateful.logs_bucket is not None
+            self.access_logs = AccessLogs(
+                self,
+                "valohai-access-logs",
+                load_balancer=load_balancer,
+                bucket=stateful.logs_bucket.bucket,
+                **access_logs,
+            )
+
+        worker_image = config.get("worker_image")
+        if worker_image is not None:
+            self.worker_image = WorkerImage(
+                self,
+                "valohai-worker-image",
+                subnet_id=config["worker_subnet_ids"][0],
+                security_group=sg_workers,
+                **worker_image,
+            )
+
+        vpc_endpoints = config.get("vpc_endpoints")
+        if vpc_endpoints is not None:
+            self.endpoints = Endpoints(
+                self,
+                "valohai-endpoints",
+                vpc=vpc,
+                subnet_ids=[config["roi_subnet_id"], *config["worker_subnet_ids"]],
+                s3_bucket_name=bucket_name,
+                **vpc_endpoints,
+            )
+
+        ecr_cache = config.get("ecr_cache")
+        roi_image_registry = None
+        if ecr_cache is not None:
+            self.image_cache = ImageCache(
+                self,
+                "valohai-ecr-cache",
+                role_master=iam.role_master,
+                role_worker=iam.role_worker,
+                **ecr_cache,
+            )
+            # Roi is on Docker Hub, which the cache only serves with credentials
+            if "docker-hub" in self.image_cache.prefixes:
+                roi_image_registry = self.image_cache.registry
+
+        self.workers = Workers(
+            self,
+            "valohai-workers",
+            vpc=vpc,
+            subnets=subnet_selection(vpc, config["worker_subnet_ids"]),
+            security_group=sg_workers,
+            iam_role=iam.role_worker,
+            queues=config.get("worker_queues") or [],
+            ami_parameter=(
+                self.worker_image.ami_parameter_name
+                if worker_image is not None
+                else None
+            ),
+        )
+        if worker_image is not None:
+            # Workers launch from the AMI the first build publishes
+            self.workers.node.add_dependency(self.worker_image.image)
+
+        interruptions = config.get("interruptions")
+        if interruptions is not None:
+            self.interruptions = Interruptions(
+                self,
+                "valohai-interruptions",
+                role_master=iam.role_master,
+                auto_scaling_groups=self.workers.auto_scaling_groups,
+                **interruptions,
+            )
+
+        offline = config.get("offline")
+        roi = config.get("roi") or {}
         compute = RoiInstance(
             self,
             "valohai-ec2",
             vpc=vpc,
-            subnets=roi_subnets,
+            subnets=subnet_selection(vpc, [config["roi_subnet_id"]]),
             security_group=sg_master,
             iam_role=iam.role_master,
-            domain=domain,
-            environment_name=environment_name,
-        )
-        load_balancer.listener.add_targets(
-            "Target", port=8000, targets=[targets.InstanceTarget(compute.roi_instance)]
+            domain=config["domain"],
+            environment_name=config["environment_name"],
+            instance_type=roi.get("instance_type", "m5a.xlarge"),
+            architecture=config.get("architecture", "x86_64"),
+            autoscaling_options=roi.get("autoscaling"),
+            root_volume=roi.get("root_volume"),
+            docker_volume=roi.get("docker_volume"),
+            background_workers=roi.get("background_workers"),
+            database_proxy=self.database.proxy is not None,
+            image_registry=roi_image_registry,
+            machine_image_id=offline.get("roi_ami_id") if offline else None,
         )
+
+        # Background workers reach the data stores through imported security
+        # groups, so the rules are created in this stack
+        if compute.sg_background_workers:
+            peer = ec2.Peer.security_group_id(
+                compute.sg_background_workers.security_group_id
+            )
+            ec2.SecurityGroup.from_security_group_id(
+                self,
+                "valohai-sg-database",
+                self.database.sg_database.security_group_id,
+            ).add_ingress_rule(
+                peer, ec2.Port.tcp(5432), "Allow access from Roi background workers"
+            )
+            if self.database.sg_proxy:
+                ec2.SecurityGroup.from_security_group_id(
+                    self,
+                    "valohai-sg-db-proxy",
+                    self.database.sg_proxy.security_group_id,
+                ).add_ingress_rule(
+                    peer,
+                    ec2.Port.tcp(5432),
+                    "Allow access from Roi background workers",
+                )
+            ec2.SecurityGroup.from_security_group_id(
+                self,
+                "valohai-sg-queue",
+                self.redis.sg_redis_queue.security_group_id,
+            ).add_ingress_rule(
+                peer, ec2.Port.tcp(6379), "Allow access from Roi background workers"
+            )
+
+        if compute.roi_group:
+            load_balancer.add_targets([compute.roi_group])
+            compute.add_scaling_policies()
+        else:
+            assert compute.roi_instance is not None
+            load_balancer.add_targets([targets.InstanceTarget(compute.roi_instance)])
+
+        cdn = config.get("cdn")
+        if cdn is not None:
+            self.cdn = Cdn(
+                self,
+                "valohai-cdn",
+                load_balancer=load_balancer,
+                bucket=self.bucket.bucket,
+                **cdn,
+            )
+
+        monitoring = config.get("monitoring")
+        if monitoring is not None:
+            self.monitoring = Monitoring(
+                self,
+                "valohai-monitoring",
+                redis=self.redis,
+                database=self.database,
+                load_balancer=load_balancer,
+                compute=compute,
+                **monitoring,
+            )
@@ -1,9 +1,113 @@
+import json
+from typing import Any, Dict, List, Optional
+
+import aws_cdk as cdk
+import aws_cdk.aws_autoscaling as autoscaling
+import aws_cdk.aws_cloudwatch as cloudwatch
 import aws_cdk.aws_ec2 as ec2
 import aws_cdk.aws_iam as iam
 import aws_cdk.aws_secretsmanager as secretsmanager
 import aws_cdk.aws_ssm as ssm
 from constructs import Construct
 
+from backend.architecture import instance_type_for
+
+# What the Roi bootstrap fetches at boot and how it fills in /etc/roi.config
+ROI_BOOTSTRAP_PLAN = {
+    "parameters": {
+        "redis_url": "valohai-redis-url",
+        "db_url": "valohai-db-url",
+        "domain": "valohai-domain",
+        "env_name": "valohai-env-name",
+    },
+    "secrets": {
+        "repo_private_key": "valohai-secret-repo",
+        "secret_key": "valohai-secret-secret",
+        "jwt_key": "valohai-secret-jwt",
+        "db_credentials": "valohai-secret-dbpassword",
+    },
+    "config": {
+        "URL_BASE": "{domain}",
+        "AWS_REGION": "{aws_region}",
+        "AWS_S3_BUCKET_NAME": "valohai-data-{aws_account}",
+        "AWS_S3_MULTIPART_UPLOAD_IAM_ROLE": "arn:aws:iam::{aws_account}:role/valohai-role-multipart",
+        "CELERY_BROKER": "redis://{redis_url}:6379",
+        "DATABASE_URL": "psql://roi:{db_credentials[password]}@{db_url}:5432/roidb",
+        "PLATFORM_LONG_NAME": "{env_name}",
+        "REPO_PRIVATE_KEY_SECRET": "{repo_private_key}",
+        "SECRET_KEY": "{secret_key}",
+        "STATS_JWT_KEY": "{jwt_key}",
+    },
+}
+
+
+VOLUME_TYPES = {
+    "gp3": ec2.EbsDeviceVolumeType.GP3,
+    "io2": ec2.EbsDeviceVolumeType.IO2,
+}
+# Celery queues the background worker tier consumes and scales on
+BACKGROUND_WORKER_QUEUES = ["celery"]
+BACKGROUND_WORKER_COMMAND = "celery --app=roi worker --loglevel=info"
+QUEUE_DEPTH_NAMESPACE = "Valohai/Roi"
+
+ROOT_DEVICE_NAME = "/dev/sda1"
+DOCKER_DEVICE_NAME = "/dev/sdf"
+
+
+def roi_volume(
+    size: int,
+    volume_type: str = "gp3",
+    iops: Optional[int] = None,
+    throughput: Optional[int] = None,
+) -> ec2.BlockDeviceVolume:
+    # gp2 and magnetic volumes run out of burst credits during image builds
+    if volume_type not in VOLUME_TYPES:
+        raise ValueError(f"Roi volumes must be gp3 or io2, not {volume_type}")
+    if volume_type == "io2" and not iops:
+        raise ValueError("Roi io2 volumes need iops")
+    if throughput and volume_type != "gp3":
+        raise ValueError("Roi volume throughput can only be set on gp3 volumes")
+    return ec2.BlockDeviceVolume.ebs(
+        size,
+        volume_type=VOLUME_TYPES[volume_type],
+        iops=iops,
+        encrypted=True,
+        delete_on_termination=True,
+    )
+
+
+def set_volume_throughput(
+    launch_template: ec2.LaunchTemplate, volumes: Dict[str, Dict[str, Any]]
+) -> None:
+    # This CDK version can't set gp3 throughput on block devices
+    cfn_launch_template = launch_template.node.default_child
+    assert isinstance(cfn_launch_template, ec2.CfnLaunchTemplate)
+    for index, volume in enumerate(volumes.values()):
+        if volume.get("throughput"):
+            cfn_launch_template.add_property_override(
+                f"LaunchTemplateData.BlockDeviceMappings.{index}.Ebs.Throughput",
+                volume["throughput"],
+            )
+
+
+def roi_user_data(plan: Dict[str, Any]) -> str:
+    with open("backend/compute/roi_bootstrap.py", encoding="UTF-8") as bootstrap_file:
+        bootstrap = bootstrap_file.read()
+
+    return "\n".join(
+        [
+            "#!/bin/bash",
+            "mkdir -p /etc/valohai",
+            "cat > /etc/valohai/bootstrap.json <<'VALOHAI_EOF'",
+            json.dumps(plan, indent=2),
+            "VALOHAI_EOF",
+            "cat > /usr/local/bin/valohai-bootstrap <<'VALOHAI_EOF'",
+            bootstrap,
+            "VALOHAI_EOF",
+            "python3 /usr/local/bin/valohai-bootstrap /etc/valohai/bootstrap.json",
+        ]
+    )
+
 
 class RoiInstance(Construct):
     def __init__(
@@ -11,12 +115,21 @@ class RoiInstance(Construct):
         scope: Construct,
         id_: str,
         *,
-        vpc: ec2.Vpc,
+        vpc: ec2.IVpc,
         subnets: ec2.SubnetSelection,
-        security_group: ec2.SecurityGroup,
+        security_group: ec2.ISecurityGroup,
         iam_role: iam.Role,
         domain: str,
         environment_name: str,
+        instance_type: str = "m5a.xlarge",
+        architecture: str = "x86_64",
+        autoscaling_options: Optional[Dict[str, Any]] = None,
+        machine_image_id: Optional[str] = None,
+        root_volume: Optional[Dict[str, Any]] = None,
+        docker_volume: Optional[Dict[str, Any]] = None,
+        background_workers: Optional[Dict[str, Any]] = None,
+        database_proxy: bool = False,
+        image_registry: Optional[str] = None,
     ):
         super().__init__(scope, id_)
 
@@ -80,32 +193,275 @@ class RoiInstance(Construct):
             string_value=environment_name,
         )
 
-        # Find the latest Valohai Roi image
-        valohai_roi_image = ec2.LookupMachineImage(
-            name="valohai-roi-*", owners=["635691382966"], windows=False
+        instance_type = instance_type_for(instance_type, architecture)
+
+        # Find the latest Valohai Roi image for the architecture, unless one is
+        # pinned for offline synth. The lookup fails synth if there is none.
+        valohai_roi_image: ec2.IMachineImage
+        if machine_image_id:
+            valohai_roi_image = ec2.MachineImage.generic_linux(
+                {cdk.Stack.of(self).region: machine_image_id}
+            )
+        else:
+            valohai_roi_image = ec2.LookupMachineImage(
+                name="valohai-roi-*",
+                owners=["635691382966"],
+                windows=False,
+                filters={"architecture": [architecture]},
+            )
+
+        root_volume = {"size": 32, **(root_volume or {})}
+        docker_volume = {"size": 100, **(docker_volume or {})}
+        volumes = {ROOT_DEVICE_NAME: root_volume, DOCKER_DEVICE_NAME: docker_volume}
+        block_devices = [
+            ec2.BlockDevice(device_name=device_name, volume=roi_volume(**volume))
+            for device_name, volume in volumes.items()
+        ]
+        parameters = dict(ROI_BOOTSTRAP_PLAN["parameters"])
+        if database_proxy:
+            parameters["db_url"] = "valohai-db-proxy-url"
+        bootstrap_plan: Dict[str, Any] = {
+            **ROI_BOOTSTRAP_PLAN,
+            "parameters": parameters,
+            "docker_volume": {
+                "device": DOCKER_DEVICE_NAME,
+                "mount_point": "/var/lib/docker",
+            },
+        }
+        if image_registry:
+            bootstrap_plan["image_registry"] = image_registry
+        if autoscaling_options is not None:
+            # Every Roi instance runs the scaling and image build services
+            # unless the background workers take them over
+            if background_workers is None:
+                raise ValueError(
+                    "roi.autoscaling needs roi.background_workers, otherwise "
+                    "every Roi instance runs the scaling and image build services"
+                )
+            # Instances of the group boot together, so one of them runs the
+            # migrations for each Roi image and the rest wait for it
+            bootstrap_plan["migrate"] = "once"
+        user_data = ec2.UserData.custom(roi_user_data(bootstrap_plan))
+
+        self.roi_instance: Optional[ec2.Instance] = None
+        self.roi_group: Optional[autoscaling.AutoScalingGroup] = None
+        self.autoscaling_options = autoscaling_options
+
+        if autoscaling_options is None:
+            # AWS::EC2::Instance can't set gp3 throughput, so the volumes and
+            # the IMDSv2 requirement come from a launch template instead
+            launch_template = ec2.LaunchTemplate(
+                self,
+                "valohai-roi-volumes",
+                block_devices=block_devices,
+                require_imdsv2=True,
+            )
+            self.roi_instance = ec2.Instance(
+                self,
+                "valohai_roi",
+                instance_name="valohai-roi",
+                machine_image=valohai_roi_image,
+                instance_type=ec2.InstanceType(instance_type),
+                key_name=master_key_pair.key_name,
+                vpc=vpc,
+                vpc_subnets=subnets,
+                security_group=security_group,
+                role=iam_role,
+                user_data=user_data,
+            )
+            cfn_instance = self.roi_instance.node.default_child
+            assert isinstance(cfn_instance, ec2.CfnInstance)
+            cfn_instance.launch_template = (
+                ec2.CfnInstance.LaunchTemplateSpecificationProperty(
+                    launch_template_id=launch_template.launch_template_id,
+                    version=launch_template.latest_version_number,
+                )
+            )
+        else:
+            iam_role.add_to_principal_policy(
+                iam.PolicyStatement(
+                    sid="RoiMigrationLock",
+                    actions=[
+                        "ssm:GetParameter",
+                        "ssm:PutParameter",
+                        "ssm:DeleteParameter",
+                    ],
+                    resources=[
+                        cdk.Stack.of(self).format_arn(
+                            service="ssm",
+                            resource="parameter",
+                            resource_name="valohai-roi-migrations-*",
+                        )
+                    ],
+                )
+            )
+            launch_template = ec2.LaunchTemplate(
+                self,
+                "valohai-roi-lt",
+                launch_template_name="valohai-roi",
+                machine_image=valohai_roi_image,
+                instance_type=ec2.InstanceType(instance_type),
+                key_name=master_key_pair.key_name,
+                security_group=security_group,
+                role=iam_role,
+                block_devices=block_devices,
+                require_imdsv2=True,
+                user_data=user_data,
+            )
+            self.roi_group = autoscaling.AutoScalingGroup(
+                self,
+                "valohai-roi-asg",
+                auto_scaling_group_name="valohai-roi",
+                vpc=vpc,
+                vpc_subnets=subnets,
+                launch_template=launch_template,
+                min_capacity=autoscaling_options.get("min_size", 1),
+                max_capacity=autoscaling_options.get("max_size", 4),
+                desired_capacity=autoscaling_options.get("desired_size"),
+                health_check=autoscaling.HealthCheck.elb(
+                    grace=cdk.Duration.minutes(10)
+                ),
+                default_instance_warmup=cdk.Duration.minutes(5),
+            )
+
+        set_volume_throughput(launch_template, volumes)
+
+        self.sg_background_workers: Optional[ec2.SecurityGroup] = None
+        self.worker_group: Optional[autoscaling.AutoScalingGroup] = None
+        if background_workers is not None:
+            self._background_workers(
+                vpc=vpc,
+                subnets=subnets,
+                machine_image=valohai_roi_image,
+                key_name=master_key_pair.key_name,
+                iam_role=iam_role,
+                block_devices=block_devices,
+                volumes=volumes,
+                bootstrap_plan=bootstrap_plan,
+                instance_type=instance_type_for(
+                    background_workers.get("instance_type", "m5a.xlarge"), architecture
+                ),
+                options=background_workers,
+            )
+
+    def _background_workers(
+        self,
+        *,
+        vpc: ec2.IVpc,
+        subnets: ec2.SubnetSelection,
+        machine_image: ec2.IMachineImage,
+        key_name: str,
+        iam_role: iam.Role,
+        block_devices: List[ec2.BlockDevice],
+        volumes: Dict[str, Dict[str, Any]],
+        bootstrap_plan: Dict[str, Any],
+        instance_type: str,
+        options: Dict[str, Any],
+    ) -> None:
+        """
+        Celery tasks, image builds and scaling services on their own instances,
+        so the Roi instances behind the load balancer only serve web traffic.
+        """
+        self.sg_background_workers = ec2.SecurityGroup(
+            self,
+            "valohai-sg-roi-workers",
+            security_group_name="valohai-sg-roi-workers",
+            description="Valohai Roi background workers",
+            vpc=vpc,
+            allow_all_outbound=True,
         )
 
-        with open(
-            "backend/compute/roi_user_data.sh", encoding="UTF-8"
-        ) as user_data_file:
-            user_data = user_data_file.read()
+        # The workers publish the queue depth the group scales on, so an empty
+        # group would never scale out
+        min_size = options.get("min_size", 1)
+        if min_size < 1:
+            raise ValueError(
+                "roi.background_workers.min_size must be at least 1, the workers "
+                "publish the queue depth the group scales on"
+            )
+
+        queues = options.get("queues", BACKGROUND_WORKER_QUEUES)
+        worker_plan = {
+            **bootstrap_plan,
+            "command": options.get("command", BACKGROUND_WORKER_COMMAND),
+            "migrate": False,
+            "queue_depth": {"queues": queues, "namespace": QUEUE_DEPTH_NAMESPACE},
+        }
+        launch_template = ec2.LaunchTemplate(
+            self,
+            "valohai-roi-workers-lt",
+            launch_template_name="valohai-roi-workers",
+            machine_image=machine_image,
+            instance_type=ec2.InstanceType(instance_type),
+            key_name=key_name,
+            security_group=self.sg_background_workers,
+            role=iam_role,
+            block_devices=block_devices,
+            require_imdsv2=True,
+            user_data=ec2.UserData.custom(roi_user_data(worker_plan)),
+        )
+        set_volume_throughput(launch_template, volumes)
 
-        self.roi_instance = ec2.Instance(
+        self.worker_group = autoscaling.AutoScalingGroup(
             self,
-            "valohai_roi",
-            instance_name="valohai-roi",
-            machine_image=valohai_roi_image,
-            instance_type=ec2.InstanceType("m5a.xlarge"),
-            key_name=master_key_pair.key_name,
+            "valohai-roi-workers-asg",
+            auto_scaling_group_name="valohai-roi-workers",
             vpc=vpc,
             vpc_subnets=subnets,
-            security_group=security_group,
-            role=iam_role,
-            block_devices=[
-                ec2.BlockDevice(
-                    device_name="/dev/sda1", volume=ec2.BlockDeviceVolume.ebs(32)
-                )
+            launch_template=launch_template,
+            min_capacity=min_size,
+            max_capacity=options.get("max_size", 4),
+            desired_capacity=options.get("desired_size"),
+            default_instance_warmup=cdk.Duration.minutes(5),
+        )
+
+        # Every worker publishes the same depth, so take the maximum
+        queue_depth = cloudwatch.Metric(
+            namespace=QUEUE_DEPTH_NAMESPACE,
+            metric_name="CeleryQueueDepth",
+            statistic="Maximum",
+            period=cdk.Duration.minutes(1),
+        )
+        target = options.get("queue_depth_target", 20)
+        self.worker_group.scale_on_metric(
+            "valohai-roi-workers-queue-depth",
+            metric=queue_depth,
+            scaling_steps=[
+                autoscaling.ScalingInterval(lower=target, change=1),
+                autoscaling.ScalingInterval(lower=target * 5, change=3),
             ],
-            require_imdsv2=True,
-            user_data=ec2.UserData.custom(user_data),
+            adjustment_type=autoscaling.AdjustmentType.CHANGE_IN_CAPACITY,
+            cooldown=cdk.Duration.minutes(5),
+        )
+        # Queues empty out between tasks, so only scale in once they've stayed
+        # empty for a while
+        self.worker_group.scale_on_metric(
+            "valohai-roi-workers-idle",
+            metric=queue_depth,
+            scaling_steps=[
+                autoscaling.ScalingInterval(upper=0, change=-1),
+                autoscaling.ScalingInterval(lower=1, change=0),
+            ],
+            adjustment_type=autoscaling.AdjustmentType.CHANGE_IN_CAPACITY,
+            evaluation_periods=options.get("scale_in_minutes", 15),
+            cooldown=cdk.Duration.minutes(5),
+        )
+
+    def add_scaling_policies(self) -> None:
+        """
+        Target tracking on request count needs the group to be registered with
+        an ALB target group first, so this is called after add_targets.
+        """
+        if self.roi_group is None or self.autoscaling_options is None:
+            return
+
+        self.roi_group.scale_on_request_count(
+            "valohai-roi-requests",
+            target_requests_per_minute=self.autoscaling_options.get(
+                "requests_per_target", 1000
+            ),
+        )
+        self.roi_group.scale_on_cpu_utilization(
+            "valohai-roi-cpu",
+            target_utilization_percent=self.autoscaling_options.get("cpu_target", 60),
         )
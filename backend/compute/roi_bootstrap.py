@@ -0,0 +1,498 @@
+"""
+Boot-time configuration for the Valohai Roi instance.
+
+RoiInstance embeds this file in the instance user data together with a JSON
+plan describing which SSM parameters and secrets to fetch and how to render
+them into /etc/roi.config. It only uses the Python standard library and the
+AWS CLI that ship with the Roi AMI.
+"""
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+AwsCall = Callable[..., Any]
+
+IMDS_URL = "http://169.254.169.254/latest"
+ROI_CONFIG_PATH = "/etc/roi.config"
+ROI_SERVICE_PATH = "/etc/systemd/system/roi.service"
+ROI_IMAGE = "valohai/roi:latest"
+METRIC_NAMESPACE = "Valohai/Bootstrap"
+QUEUE_DEPTH_CONFIG_PATH = "/etc/valohai/queue-depth.json"
+QUEUE_DEPTH_UNIT = "valohai-queue-depth"
+MIGRATION_PARAMETER = "valohai-roi-migrations-{image_id}"
+# Short image ID as docker prints it, SSM parameter names can't contain colons
+IMAGE_ID_LENGTH = 12
+# Nitro instances expose EBS volumes as NVMe devices with the volume ID,
+# without the dash, as the serial number
+EBS_DEVICE_LINK = "/dev/disk/by-id/nvme-Amazon_Elastic_Block_Store_{serial}"
+
+
+def aws(*args: str) -> Any:
+    output = subprocess.run(
+        ["aws", *args, "--output", "json"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output) if output.strip() else None
+
+
+def run(*args: str) -> None:
+    subprocess.run(args, check=True)
+
+
+def attached_volume(aws_call: AwsCall, instance_id: str, device_name: str) -> str:
+    """Return the ID of the EBS volume attached to the instance as device_name."""
+    described = aws_call("ec2", "describe-instances", "--instance-ids", instance_id)
+    instance = described["Reservations"][0]["Instances"][0]
+    for mapping in instance["BlockDeviceMappings"]:
+        if mapping["DeviceName"] == device_name:
+            return str(mapping["Ebs"]["VolumeId"])
+    raise RuntimeError(f"No EBS volume is attached as {device_name}")
+
+
+def find_device(
+    aws_call: AwsCall,
+    instance_id: str,
+    device_name: str,
+    timeout: float = 60,
+    interval: float = 1,
+) -> str:
+    """
+    Find the block device attached as device_name. On Nitro instances EBS
+    volumes show up as NVMe devices under a different name, next to any
+    instance store disks, so match the volume by its NVMe serial number.
+    """
+    if os.path.exists(device_name):
+        return os.path.realpath(device_name)
+    volume_id = attached_volume(aws_call, instance_id, device_name)
+    link = EBS_DEVICE_LINK.format(serial=volume_id.replace("-", ""))
+    # udev creates the link shortly after the device appears
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(link):
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"No device for {volume_id} attached as {device_name}")
+        time.sleep(interval)
+    return os.path.realpath(link)
+
+
+def mount_docker_volume(
+    aws_call: AwsCall, instance_id: str, device_name: str, mount_point: str
+) -> None:
+    device = find_device(aws_call, instance_id, device_name)
+
+    run("systemctl", "stop", "roi", "docker.socket", "docker")
+    # Format a new volume and move the images that ship with the AMI onto it
+    if subprocess.run(["blkid", device], capture_output=True).returncode != 0:
+        run("mkfs.ext4", "-q", "-L", "docker", device)
+        run("mkdir", "-p", "/mnt/docker")
+        run("mount", device, "/mnt/docker")
+        run("cp", "-a", f"{mount_point}/.", "/mnt/docker/")
+        run("umount", "/mnt/docker")
+
+    with open("/etc/fstab", "a", encoding="UTF-8") as fstab:
+        fstab.write(f"LABEL=docker {mount_point} ext4 defaults,noatime,nofail 0 2\n")
+    run("mount", mount_point)
+    run("systemctl", "start", "docker")
+
+
+def instance_identity() -> Dict[str, Any]:
+    token_request = urllib.request.Request(
+        f"{IMDS_URL}/api/token",
+        method="PUT",
+        headers={"X-aws-ec2-metadata-token-ttl-seconds": "21600"},
+    )
+    with urllib.request.urlopen(token_request, timeout=5) as response:
+        token = response.read().decode()
+    identity_request = urllib.request.Request(
+        f"{IMDS_URL}/dynamic/instance-identity/document",
+        headers={"X-aws-ec2-metadata-token": token},
+    )
+    with urllib.request.urlopen(identity_request, timeout=5) as response:
+        identity: Dict[str, Any] = json.loads(response.read())
+    return identity
+
+
+def fetch_parameters(aws_call: AwsCall, names: Dict[str, str]) -> Dict[str, str]:
+    """Fetch all SSM parameters with a single GetParameters call."""
+    if not names:
+        return {}
+    response = aws_call(
+        "ssm",
+        "get-parameters",
+        "--with-decryption",
+        "--names",
+        *sorted(set(names.values())),
+    )
+    if response["InvalidParameters"]:
+        raise RuntimeError(f"Missing SSM parameters: {response['InvalidParameters']}")
+    values = {p["Name"]: p["Value"] for p in response["Parameters"]}
+    return {key: values[name] for key, name in names.items()}
+
+
+def fetch_secrets(aws_call: AwsCall, secret_ids: Dict[str, str]) -> Dict[str, Any]:
+    """Fetch all secrets concurrently. JSON secrets are returned as dicts."""
+
+    def fetch(secret_id: str) -> Any:
+        secret = aws_call(
+            "secretsmanager", "get-secret-value", "--secret-id", secret_id
+        )["SecretString"]
+        return json.loads(secret) if secret.startswith("{") else secret
+
+    if not secret_ids:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(secret_ids)) as pool:
+        futures = {key: pool.submit(fetch, sid) for key, sid in secret_ids.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+
+def fetch_values(
+    aws_call: AwsCall, plan: Dict[str, Any], identity: Dict[str, Any]
+) -> Dict[str, Any]:
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        parameters = pool.submit(fetch_parameters, aws_call, plan["parameters"])
+        secrets = pool.submit(fetch_secrets, aws_call, plan["secrets"])
+        values = {**parameters.result(), **secrets.result()}
+    values["aws_region"] = identity["region"]
+    values["aws_account"] = identity["accountId"]
+    return values
+
+
+def parameter_value(aws_call: AwsCall, name: str) -> Optional[str]:
+    try:
+        response = aws_call("ssm", "get-parameter", "--name", name)
+    except subprocess.CalledProcessError as error:
+        if "ParameterNotFound" in (error.stderr or ""):
+            return None
+        raise
+    value: str = response["Parameter"]["Value"]
+    return value
+
+
+def cached_image(registry: str) -> str:
+    """Return the Roi image in the Docker Hub prefix of an ECR pull-through cache."""
+    return f"{registry}/docker-hub/{ROI_IMAGE}"
+
+
+def pull_cached_image(region: str, image: str) -> None:
+    """
+    Log in to the ECR registry of image and pull it, so the Roi service finds
+    it locally and doesn't need the short-lived ECR credentials itself.
+    """
+    registry = image.split("/", 1)[0]
+    password = subprocess.run(
+        ["aws", "ecr", "get-login-password", "--region", region],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    subprocess.run(
+        ["docker", "login", "--username", "AWS", "--password-stdin", registry],
+        input=password,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    run("docker", "pull", image)
+
+
+def image_id(image: str) -> str:
+    """
+    Return the short ID of the image a tag points to, pulling it first if the
+    Docker volume doesn't have it yet.
+    """
+
+    def inspect() -> str:
+        return subprocess.run(
+            ["docker", "image", "inspect", "--format", "{{.Id}}", image],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+
+    try:
+        digest = inspect()
+    except subprocess.CalledProcessError:
+        run("docker", "pull", image)
+        digest = inspect()
+    return digest.split(":")[-1][:IMAGE_ID_LENGTH]
+
+
+def migrate_once(
+    aws_call: AwsCall,
+    name: str,
+    migrate: Callable[[], None],
+    timeout: float = 900,
+    interval: float = 10,
+) -> bool:
+    """
+    Run the migrations on one instance of the group. Creating the parameter
+    only succeeds on one instance, which migrates while the others wait so
+    they don't serve requests against the old schema. A failed leader deletes
+    the parameter so the next instance tries again.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        state = parameter_value(aws_call, name)
+        if state == "done":
+            return False
+        if state is None:
+            try:
+                aws_call(
+                    "ssm",
+                    "put-parameter",
+                    "--name",
+                    name,
+                    "--type",
+                    "String",
+                    "--value",
+                    "running",
+                )
+            except subprocess.CalledProcessError as error:
+                if "ParameterAlreadyExists" not in (error.stderr or ""):
+                    raise
+            else:
+                try:
+                    migrate()
+                except BaseException:
+                    aws_call("ssm", "delete-parameter", "--name", name)
+                    raise
+                aws_call(
+                    "ssm",
+                    "put-parameter",
+                    "--name",
+                    name,
+                    "--type",
+                    "String",
+                    "--value",
+                    "done",
+                    "--overwrite",
+                )
+                return True
+        time.sleep(interval)
+    raise RuntimeError(f"Timed out waiting for the migrations in {name}")
+
+
+def render_roi_config(
+    current: str, templates: Dict[str, str], values: Dict[str, Any]
+) -> str:
+    settings = {key: template.format(**values) for key, template in templates.items()}
+    lines = []
+    for line in current.splitlines():
+        key = line.split("=", 1)[0]
+        if key in settings:
+            line = f"{key}={settings.pop(key)}"
+        lines.append(line)
+    lines.extend(f"{key}={value}" for key, value in settings.items())
+    return "\n".join(lines) + "\n"
+
+
+def queue_depth(host: str, queues: List[str], port: int = 6379) -> int:
+    """Sum the lengths of the Celery queue lists with plain RESP commands."""
+    with socket.create_connection((host, port), timeout=5) as connection:
+        replies = connection.makefile("rb")
+        depth = 0
+        for queue in queues:
+            connection.sendall(f"LLEN {queue}\r\n".encode())
+            reply = replies.readline().decode().strip()
+            if not reply.startswith(":"):
+                raise RuntimeError(f"Unexpected Redis reply to LLEN {queue}: {reply}")
+            depth += int(reply[1:])
+    return depth
+
+
+def publish_queue_depth(config_path: str) -> None:
+    with open(config_path, encoding="UTF-8") as config_file:
+        config = json.load(config_file)
+    depth = queue_depth(config["host"], config["queues"])
+    aws(
+        "cloudwatch",
+        "put-metric-data",
+        "--region",
+        config["region"],
+        "--namespace",
+        config["namespace"],
+        "--metric-name",
+        "CeleryQueueDepth",
+        "--unit",
+        "Count",
+        "--value",
+        str(depth),
+    )
+
+
+def install_queue_depth_timer(config: Dict[str, Any]) -> None:
+    """Publish the Celery queue depth every minute for worker tier scaling."""
+    with open(QUEUE_DEPTH_CONFIG_PATH, "w", encoding="UTF-8") as config_file:
+        json.dump(config, config_file)
+    units = {
+        "service": (
+            "[Service]\nType=oneshot\n"
+            f"ExecStart=/usr/bin/python3 {os.path.realpath(__file__)} "
+            f"--queue-depth {QUEUE_DEPTH_CONFIG_PATH}\n"
+        ),
+        "timer": (
+            "[Timer]\nOnBootSec=60\nOnUnitActiveSec=60\n\n"
+            "[Install]\nWantedBy=timers.target\n"
+        ),
+    }
+    for suffix, unit in units.items():
+        path = f"/etc/systemd/system/{QUEUE_DEPTH_UNIT}.{suffix}"
+        with open(path, "w", encoding="UTF-8") as unit_file:
+            unit_file.write(unit)
+    run("systemctl", "daemon-reload")
+    run("systemctl", "enable", "--now", f"{QUEUE_DEPTH_UNIT}.timer")
+
+
+class Timings:
+    def __init__(self) -> None:
+        self.phases: Dict[str, float] = {}
+        self.started = time.monotonic()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(time.monotonic() - started, 3)
+
+    def report(self, aws_call: AwsCall) -> None:
+        self.phases["total"] = round(time.monotonic() - self.started, 3)
+        print(f"valohai-bootstrap timings {json.dumps(self.phases)}", flush=True)
+        metric_data: List[Dict[str, Any]] = [
+            {
+                "MetricName": "PhaseDuration",
+                "Dimensions": [{"Name": "Phase", "Value": phase}],
+                "Value": seconds,
+                "Unit": "Seconds",
+            }
+            for phase, seconds in self.phases.items()
+        ]
+        try:
+            aws_call(
+                "cloudwatch",
+                "put-metric-data",
+                "--namespace",
+                METRIC_NAMESPACE,
+                "--metric-data",
+                json.dumps(metric_data),
+            )
+        except subprocess.CalledProcessError as error:
+            print(f"Could not publish bootstrap timings: {error}", file=sys.stderr)
+
+
+def main(plan_path: str) -> None:
+    with open(plan_path, encoding="UTF-8") as plan_file:
+        plan = json.load(plan_file)
+
+    timings = Timings()
+
+    with timings.phase("identity"):
+        identity = instance_identity()
+
+    def aws_call(*args: str) -> Any:
+        return aws(*args, "--region", identity["region"])
+
+    with timings.phase("fetch"):
+        values = fetch_values(aws_call, plan, identity)
+
+    if "docker_volume" in plan:
+        with timings.phase("storage"):
+            mount_docker_volume(
+                aws_call,
+                identity["instanceId"],
+                plan["docker_volume"]["device"],
+                plan["docker_volume"]["mount_point"],
+            )
+
+    # Pull Roi through the ECR cache when the plan names one, instead of from
+    # Docker Hub
+    image = ROI_IMAGE
+    if plan.get("image_registry"):
+        image = cached_image(plan["image_registry"])
+        with timings.phase("pull"):
+            pull_cached_image(identity["region"], image)
+
+    with timings.phase("configure"):
+        run("systemctl", "stop", "roi")
+        with open(ROI_SERVICE_PATH, encoding="UTF-8") as service_file:
+            service = service_file.read()
+        if "--net=host" not in service:
+            service = re.sub(
+                r"^(.*docker run.*)$", r"\1\n    --net=host \\", service, flags=re.M
+            )
+        if image not in service:
+            service = service.replace(ROI_IMAGE, image)
+        # The background worker tier runs another command in the same image
+        if plan.get("command"):
+            service = re.sub(
+                rf"^(.*{re.escape(image)}).*$",
+                rf"\1 {plan['command']}",
+                service,
+                flags=re.M,
+            )
+        with open(ROI_SERVICE_PATH, "w", encoding="UTF-8") as service_file:
+            service_file.write(service)
+        run("systemctl", "daemon-reload")
+
+        with open(ROI_CONFIG_PATH, encoding="UTF-8") as config_file:
+            roi_config = config_file.read()
+        with open(ROI_CONFIG_PATH, "w", encoding="UTF-8") as config_file:
+            config_file.write(render_roi_config(roi_config, plan["config"], values))
+
+    def migrate() -> None:
+        run(
+            "docker",
+            "run",
+            "--rm",
+            "--net=host",
+            f"--env-file={ROI_CONFIG_PATH}",
+            image,
+            "sh",
+            "-c",
+            "python manage.py migrate && python manage.py roi_init --mode dev",
+        )
+
+    # Migrations and initial data run before the app starts serving. An auto
+    # scaling group runs them once per Roi image, whichever AMI the instances
+    # boot from, background workers leave them to the web tier.
+    if plan.get("migrate", True):
+        with timings.phase("migrate"):
+            if plan.get("migrate") == "once":
+                migrate_once(
+                    aws_call,
+                    MIGRATION_PARAMETER.format(image_id=image_id(image)),
+                    migrate,
+                )
+            else:
+                migrate()
+
+    with timings.phase("start"):
+        run("systemctl", "start", "roi")
+        run("snap", "start", "amazon-ssm-agent")
+        if "queue_depth" in plan:
+            install_queue_depth_timer(
+                {
+                    **plan["queue_depth"],
+                    "host": values["redis_url"],
+                    "region": identity["region"],
+                }
+            )
+
+    timings.report(aws_call)
+
+
+if __name__ == "__main__":
+    if sys.argv[1] == "--queue-depth":
+        publish_queue_depth(sys.argv[2])
+    else:
+        main(sys.argv[1])
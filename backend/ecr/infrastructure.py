@@ -0,0 +1,139 @@
+import json
+from typing import Dict, Optional
+
+import aws_cdk as cdk
+import aws_cdk.aws_ecr as ecr
+import aws_cdk.aws_iam as iam
+import aws_cdk.aws_ssm as ssm
+from constructs import Construct
+
+# Repository prefix and upstream of each cached registry. Docker Hub and GHCR
+# need credentials in a Secrets Manager secret named ecr-pullthroughcache/...
+UPSTREAM_REGISTRIES = {
+    "ecr-public": ("public.ecr.aws", "ecr-public"),
+    "docker-hub": ("registry-1.docker.io", "docker-hub"),
+    "ghcr": ("ghcr.io", "github-container-registry"),
+}
+
+
+class ImageCache(Construct):
+    def __init__(
+        self,
+        scope: Construct,
+        id_: str,
+        *,
+        role_master: iam.Role,
+        role_worker: iam.Role,
+        docker_hub_credential_arn: Optional[str] = None,
+        ghcr_credential_arn: Optional[str] = None,
+        keep_images: int = 10,
+    ):
+        super().__init__(scope, id_)
+
+        stack = cdk.Stack.of(self)
+        self.registry = f"{stack.account}.dkr.ecr.{stack.region}.{stack.url_suffix}"
+
+        credentials: Dict[str, Optional[str]] = {
+            "ecr-public": None,
+            "docker-hub": docker_hub_credential_arn,
+            "ghcr": ghcr_credential_arn,
+        }
+        self.prefixes = [
+            prefix
+            for prefix, credential_arn in credentials.items()
+            if prefix == "ecr-public" or credential_arn
+        ]
+
+        for prefix in self.prefixes:
+            upstream_url, upstream_registry = UPSTREAM_REGISTRIES[prefix]
+            rule = ecr.CfnPullThroughCacheRule(
+                self,
+                f"valohai-ecr-cache-{prefix}",
+                ecr_repository_prefix=prefix,
+                upstream_registry_url=upstream_url,
+            )
+            # This CDK version doesn't know about authenticated upstreams
+            rule.add_property_override("UpstreamRegistry", upstream_registry)
+            if credentials[prefix]:
+                rule.add_property_override("CredentialArn", credentials[prefix])
+
+            # Cached repositories are created on the first pull, so their
+            # lifecycle policy comes from a repository creation template
+            cdk.CfnResource(
+                self,
+                f"valohai-ecr-cache-{prefix}-template",
+                type="AWS::ECR::RepositoryCreationTemplate",
+                properties={
+                    "Prefix": prefix,
+                    "AppliedFor": ["PULL_THROUGH_CACHE"],
+                    "Description": f"Valohai pull-through cache for {upstream_url}",
+                    "LifecyclePolicy": json.dumps(
+                        {
+                            "rules": [
+                                {
+                                    "rulePriority": 1,
+                                    "description": "Expire untagged images",
+                                    "selection": {
+                                        "tagStatus": "untagged",
+                                        "countType": "sinceImagePushed",
+                                        "countUnit": "days",
+                                        "countNumber": 1,
+                                    },
+                                    "action": {"type": "expire"},
+                                },
+                                {
+                                    "rulePriority": 2,
+                                    "description": f"Keep the {keep_images} newest images",
+                                    "selection": {
+                                        "tagStatus": "any",
+                                        "countType": "imageCountMoreThan",
+                                        "countNumber": keep_images,
+                                    },
+                                    "action": {"type": "expire"},
+                                },
+                            ]
+                        }
+                    ),
+                },
+            )
+
+        # The first pull of an image creates the repository and imports it
+        pull_policy = iam.ManagedPolicy(
+            self,
+            "valohai-policy-ecr-cache",
+            managed_policy_name="valohai-policy-ecr-cache",
+            statements=[
+                iam.PolicyStatement(
+                    actions=["ecr:GetAuthorizationToken"],
+                    resources=["*"],
+                ),
+                iam.PolicyStatement(
+                    actions=[
+                        "ecr:BatchCheckLayerAvailability",
+                        "ecr:BatchGetImage",
+                        "ecr:GetDownloadUrlForLayer",
+                        "ecr:BatchImportUpstreamImage",
+                        "ecr:CreateRepository",
+                    ],
+                    resources=[
+                        stack.format_arn(
+                            service="ecr",
+                            resource="repository",
+                            resource_name=f"{prefix}/*",
+                        )
+                        for prefix in self.prefixes
+                    ],
+                ),
+            ],
+        )
+        role_master.add_managed_policy(pull_policy)
+        role_worker.add_managed_policy(pull_policy)
+
+        ssm.StringParameter(
+            self,
+            "valohai-ecr-cache-registry",
+            allowed_pattern=".*",
+            description="The ECR registry that caches public container images",
+            parameter_name="valohai-ecr-cache-registry",
+            string_value=self.registry,
+        )
@@ -0,0 +1,123 @@
+from typing import Dict, List, Optional
+
+import aws_cdk as cdk
+import aws_cdk.aws_ec2 as ec2
+import aws_cdk.aws_iam as iam
+from constructs import Construct
+
+INTERFACE_SERVICES = {
+    "ecr.api": ec2.InterfaceVpcEndpointAwsService.ECR,
+    "ecr.dkr": ec2.InterfaceVpcEndpointAwsService.ECR_DOCKER,
+    "secretsmanager": ec2.InterfaceVpcEndpointAwsService.SECRETS_MANAGER,
+    "ssm": ec2.InterfaceVpcEndpointAwsService.SSM,
+    "sts": ec2.InterfaceVpcEndpointAwsService.STS,
+}
+
+# Buckets AWS services in the subnets need when the S3 endpoint is restricted:
+# ECR image layers, the Image Builder and AWSTOE components, and the SSM agent
+# and its documents
+SERVICE_BUCKETS = [
+    "prod-{region}-starport-layer-bucket",
+    "ec2imagebuilder-*",
+    "aws-ssm-{region}",
+    "amazon-ssm-{region}",
+    "amazon-ssm-packages-{region}",
+    "{region}-birdwatcher-prod",
+    "aws-ssm-distributor-file-{region}",
+    "aws-ssm-document-attachments-{region}",
+    "patch-baseline-snapshot-{region}",
+]
+
+
+class Endpoints(Construct):
+    """
+    VPC endpoints for AWS services in a VPC that other workloads may share.
+    The endpoints only keep the traffic off the NAT: they admit the whole VPC
+    and leave access control to IAM, unless s3_allowed_buckets restricts the
+    S3 endpoint.
+    """
+
+    def __init__(
+        self,
+        scope: Construct,
+        id_: str,
+        *,
+        vpc: ec2.IVpc,
+        subnet_ids: List[str],
+        s3_bucket_name: str,
+        interface_services: Optional[List[str]] = None,
+        private_dns: bool = True,
+        s3_allowed_buckets: Optional[List[str]] = None,
+    ):
+        super().__init__(scope, id_)
+
+        stack = cdk.Stack.of(self)
+
+        # S3 gateway endpoint on the route tables of the Roi and worker subnets
+        self.s3_endpoint = ec2.GatewayVpcEndpoint(
+            self,
+            "valohai-endpoint-s3",
+            vpc=vpc,
+            service=ec2.GatewayVpcEndpointAwsService.S3,
+            subnets=[
+                ec2.SubnetSelection(
+                    subnets=vpc.select_subnets(
+                        subnet_filters=[ec2.SubnetFilter.by_ids(subnet_ids)]
+                    ).subnets
+                )
+            ],
+        )
+        # Opt-in, the route tables may be shared with other workloads, which
+        # lose access to every bucket that isn't listed
+        if s3_allowed_buckets is not None:
+            s3_buckets = [
+                s3_bucket_name,
+                *(bucket.format(region=stack.region) for bucket in SERVICE_BUCKETS),
+                *s3_allowed_buckets,
+            ]
+            self.s3_endpoint.add_to_policy(
+                iam.PolicyStatement(
+                    principals=[iam.AnyPrincipal()],
+                    actions=["s3:*"],
+                    resources=[
+                        arn
+                        for bucket in s3_buckets
+                        for arn in (
+                            f"arn:aws:s3:::{bucket}",
+                            f"arn:aws:s3:::{bucket}/*",
+                        )
+                    ],
+                )
+            )
+
+        sg_endpoints = ec2.SecurityGroup(
+            self,
+            "valohai-sg-endpoints",
+            security_group_name="valohai-sg-endpoints",
+            description="Interface VPC endpoints used by Valohai",
+            vpc=vpc,
+            allow_all_outbound=True,
+        )
+
+        # Interface endpoints take at most one subnet per availability zone
+        interface_subnets = ec2.SubnetSelection(
+            subnets=vpc.select_subnets(
+                subnet_filters=[ec2.SubnetFilter.by_ids(subnet_ids)],
+                one_per_az=True,
+            ).subnets
+        )
+
+        self.interface_endpoints: Dict[str, ec2.InterfaceVpcEndpoint] = {}
+        for name in interface_services or list(INTERFACE_SERVICES):
+            self.interface_endpoints[name] = ec2.InterfaceVpcEndpoint(
+                self,
+                f"valohai-endpoint-{name}",
+                vpc=vpc,
+                service=INTERFACE_SERVICES[name],
+                subnets=interface_subnets,
+                security_groups=[sg_endpoints],
+                private_dns_enabled=private_dns,
+                # With private DNS every client in the VPC resolves the
+                # service to the endpoint, so admit the whole VPC on 443
+                open=True,
+            )
@@ -0,0 +1,116 @@
+from typing import Optional
+
+import aws_cdk.aws_ec2 as ec2
+import aws_cdk.aws_fsx as fsx
+import aws_cdk.aws_ssm as ssm
+from constructs import Construct
+
+DEPLOYMENT_TYPES = {
+    "SCRATCH_2": fsx.LustreDeploymentType.SCRATCH_2,
+    "PERSISTENT_2": fsx.LustreDeploymentType.PERSISTENT_2,
+}
+
+# MB/s per TiB of storage
+PERSISTENT_2_THROUGHPUTS = [125, 250, 500, 1000]
+
+# S3 events that are synced both ways by a data repository association
+SYNCED_EVENTS = ["NEW", "CHANGED", "DELETED"]
+
+
+class SharedStorage(Construct):
+    def __init__(
+        self,
+        scope: Construct,
+        id_: str,
+        *,
+        vpc: ec2.IVpc,
+        subnet: ec2.ISubnet,
+        sg_workers: ec2.ISecurityGroup,
+        s3_bucket_name: str,
+        deployment_type: str = "SCRATCH_2",
+        storage_capacity: int = 1200,
+        per_unit_storage_throughput: Optional[int] = None,
+        s3_prefix: str = "",
+    ):
+        super().__init__(scope, id_)
+
+        data_repository_path = f"s3://{s3_bucket_name}/{s3_prefix}".rstrip("/")
+        is_scratch = deployment_type == "SCRATCH_2"
+
+        if deployment_type not in DEPLOYMENT_TYPES:
+            raise ValueError(
+                f"Unknown FSx deployment_type {deployment_type}, "
+                f"use one of {', '.join(DEPLOYMENT_TYPES)}"
+            )
+        if is_scratch:
+            if per_unit_storage_throughput is not None:
+                raise ValueError(
+                    "FSx per_unit_storage_throughput is only supported on PERSISTENT_2"
+                )
+        elif per_unit_storage_throughput not in PERSISTENT_2_THROUGHPUTS:
+            raise ValueError(
+                f"FSx PERSISTENT_2 needs per_unit_storage_throughput, one of "
+                f"{', '.join(map(str, PERSISTENT_2_THROUGHPUTS))}"
+            )
+
+        # Scratch file systems link the bucket directly and only auto-import.
+        # Persistent 2 links it with a data repository association instead,
+        # which also exports new and changed files back to S3 automatically.
+        lustre_configuration = fsx.LustreConfiguration(
+            deployment_type=DEPLOYMENT_TYPES[deployment_type],
+            per_unit_storage_throughput=per_unit_storage_throughput,
+            import_path=data_repository_path if is_scratch else None,
+            export_path=data_repository_path if is_scratch else None,
+            auto_import_policy=(
+                fsx.LustreAutoImportPolicy.NEW_CHANGED_DELETED if is_scratch else None
+            ),
+            data_compression_type=fsx.LustreDataCompressionType.LZ4,
+        )
+
+        self.file_system = fsx.LustreFileSystem(
+            self,
+            "valohai-fsx",
+            vpc=vpc,
+            vpc_subnet=subnet,
+            storage_capacity_gib=storage_capacity,
+            lustre_configuration=lustre_configuration,
+        )
+        self.file_system.connections.allow_default_port_from(
+            sg_workers, "Allow access from workers"
+        )
+
+        if not is_scratch:
+            fsx.CfnDataRepositoryAssociation(
+                self,
+                "valohai-fsx-data",
+                file_system_id=self.file_system.file_system_id,
+                file_system_path="/",
+                data_repository_path=data_repository_path,
+                batch_import_meta_data_on_create=True,
+                s3=fsx.CfnDataRepositoryAssociation.S3Property(
+                    auto_import_policy=fsx.CfnDataRepositoryAssociation.AutoImportPolicyProperty(
+                        events=SYNCED_EVENTS
+                    ),
+                    auto_export_policy=fsx.CfnDataRepositoryAssociation.AutoExportPolicyProperty(
+                        events=SYNCED_EVENTS
+                    ),
+                ),
+            )
+
+        ssm.StringParameter(
+            self,
+            "valohai-fsx-dns-name",
+            allowed_pattern=".*",
+            description="The DNS name for mounting the Valohai FSx for Lustre file system",
+            parameter_name="valohai-fsx-dns-name",
+            string_value=self.file_system.dns_name,
+        )
+
+        ssm.StringParameter(
+            self,
+            "valohai-fsx-mount-name",
+            allowed_pattern=".*",
+            description="The mount name of the Valohai FSx for Lustre file system",
+            parameter_name="valohai-fsx-mount-name",
+            string_value=self.file_system.mount_name,
+        )
@@ -0,0 +1,239 @@
+"""
+Performance guardrails checked on every synth.
+
+PerformanceGuardrails checks the synthesized templates, property overrides
+included, and reports configurations known to be slow or under-provisioned
+as annotations on the offending resource. It is also a CDK Aspect, which
+records the resource behind every logical ID. Each rule is an error (fails
+cdk synth and deploy), a warning (fails with --strict) or off, and can be
+suppressed for construct paths with the guardrails section of config.yaml.
+"""
+import re
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import aws_cdk as cdk
+import aws_cdk.cx_api as cx_api
+import jsii
+from constructs import IConstruct
+
+RULES = {
+    "gp2-volume": "gp2 volumes have lower baseline IOPS and throughput than gp3",
+    "default-parameter-group": "default parameter groups aren't tuned for Valohai",
+    "single-node-redis": "a single Redis node stops job dispatch and logs on failure",
+    "burstable-instance": "burstable instances get throttled once CPU credits run out",
+    "http1-listener": "clients can't use HTTP/2 through this load balancer",
+}
+DEFAULT_SEVERITIES = {
+    "gp2-volume": "error",
+    "default-parameter-group": "error",
+    "single-node-redis": "warning",
+    "burstable-instance": "warning",
+    "http1-listener": "warning",
+}
+SEVERITIES = ["error", "warning", "off"]
+
+Properties = Dict[str, Any]
+Check = Callable[[Properties], Iterator[str]]
+
+
+def is_burstable(instance_type: Any) -> bool:
+    if not isinstance(instance_type, str):
+        return False
+    # Strip the db. or cache. prefix and the size, t3 and t4g but not trn1
+    family = instance_type.rsplit(".", 1)[0].split(".")[-1]
+    return re.match(r"^t\d", family) is not None
+
+
+def gp2_block_devices(block_device_mappings: Optional[List[Properties]]) -> bool:
+    # EBS volumes default to gp2, instance store and NoDevice mappings have no Ebs
+    return any(
+        (mapping["Ebs"] or {}).get("VolumeType", "gp2") == "gp2"
+        for mapping in block_device_mappings or []
+        if "Ebs" in mapping
+    )
+
+
+def check_volume(properties: Properties) -> Iterator[str]:
+    # EBS volumes default to gp2
+    if properties.get("VolumeType", "gp2") == "gp2":
+        yield "gp2-volume"
+
+
+def check_instance(properties: Properties) -> Iterator[str]:
+    if gp2_block_devices(properties.get("BlockDeviceMappings")):
+        yield "gp2-volume"
+    if is_burstable(properties.get("InstanceType")):
+        yield "burstable-instance"
+
+
+def check_launch_template(properties: Properties) -> Iterator[str]:
+    yield from check_instance(properties.get("LaunchTemplateData") or {})
+
+
+def check_image_recipe(properties: Properties) -> Iterator[str]:
+    if gp2_block_devices(properties.get("BlockDeviceMappings")):
+        yield "gp2-volume"
+
+
+def check_db_instance(properties: Properties) -> Iterator[str]:
+    # Aurora instances take storage and parameters from their cluster
+    if not properties.get("DBClusterIdentifier"):
+        if properties.get("StorageType", "gp2") == "gp2":
+            yield "gp2-volume"
+        if not properties.get("DBParameterGroupName"):
+            yield "default-parameter-group"
+    if is_burstable(properties.get("DBInstanceClass")):
+        yield "burstable-instance"
+
+
+def check_db_cluster(properties: Properties) -> Iterator[str]:
+    if not properties.get("DBClusterParameterGroupName"):
+        yield "default-parameter-group"
+
+
+def check_cache_cluster(properties: Properties) -> Iterator[str]:
+    if properties.get("Engine") == "redis":
+        yield "single-node-redis"
+    if not properties.get("CacheParameterGroupName"):
+        yield "default-parameter-group"
+    if is_burstable(properties.get("CacheNodeType")):
+        yield "burstable-instance"
+
+
+def check_replication_group(properties: Properties) -> Iterator[str]:
+    nodes = properties.get("NumCacheClusters") or (
+        properties.get("ReplicasPerNodeGroup", 0) + 1
+    )
+    if nodes < 2:
+        yield "single-node-redis"
+    if not properties.get("CacheParameterGroupName"):
+        yield "default-parameter-group"
+    if is_burstable(properties.get("CacheNodeType")):
+        yield "burstable-instance"
+
+
+def check_load_balancer(properties: Properties) -> Iterator[str]:
+    attributes = {
+        attribute.get("Key"): attribute.get("Value")
+        for attribute in properties.get("LoadBalancerAttributes") or []
+    }
+    if attributes.get("routing.http2.enabled") == "false":
+        yield "http1-listener"
+
+
+def check_listener(properties: Properties) -> Iterator[str]:
+    # Browsers only speak HTTP/2 over TLS, so plain HTTP is fine for redirects
+    actions = properties.get("DefaultActions") or []
+    redirects = all(action.get("Type") == "redirect" for action in actions)
+    if properties.get("Protocol") == "HTTP" and not redirects:
+        yield "http1-listener"
+
+
+CHECKS: Dict[str, Check] = {
+    "AWS::EC2::Volume": check_volume,
+    "AWS::EC2::Instance": check_instance,
+    "AWS::EC2::LaunchTemplate": check_launch_template,
+    "AWS::ImageBuilder::ImageRecipe": check_image_recipe,
+    "AWS::RDS::DBInstance": check_db_instance,
+    "AWS::RDS::DBCluster": check_db_cluster,
+    "AWS::ElastiCache::CacheCluster": check_cache_cluster,
+    "AWS::ElastiCache::ReplicationGroup": check_replication_group,
+    "AWS::ElasticLoadBalancingV2::LoadBalancer": check_load_balancer,
+    "AWS::ElasticLoadBalancingV2::Listener": check_listener,
+}
+
+
+@jsii.implements(cdk.IAspect)
+class PerformanceGuardrails:
+    def __init__(
+        self,
+        *,
+        rules: Optional[Dict[str, str]] = None,
+        suppressions: Optional[Dict[str, List[str]]] = None,
+    ):
+        unknown = (set(rules or {}) | set(suppressions or {})) - set(RULES)
+        if unknown:
+            raise ValueError(f"Unknown guardrail rules: {sorted(unknown)}")
+        for rule, severity in (rules or {}).items():
+            if severity not in SEVERITIES:
+                raise ValueError(
+                    f"Unknown severity {severity} for guardrail {rule}, "
+                    f"use one of {', '.join(SEVERITIES)}"
+                )
+
+        self.severities = {**DEFAULT_SEVERITIES, **(rules or {})}
+        self.suppressions = suppressions or {}
+        # Resource of every logical ID by stack name
+        self.resources: Dict[str, Dict[str, cdk.CfnResource]] = {}
+
+    def violations(
+        self, stack: cdk.Stack, template: Dict[str, Any]
+    ) -> List[Tuple[str, cdk.CfnResource]]:
+        """
+        Return the rules the resources of a synthesized template violate, with
+        the resource.
+        """
+        resources = self.resources.get(stack.stack_name, {})
+        violations: List[Tuple[str, cdk.CfnResource]] = []
+        for logical_id, resource in (template.get("Resources") or {}).items():
+            check = CHECKS.get(resource["Type"])
+            construct = resources.get(logical_id)
+            if check is None or construct is None:
+                continue
+            violations.extend(
+                (rule, construct)
+                for rule in check(resource.get("Properties") or {})
+                if self.severities[rule] != "off"
+                if not self.is_suppressed(rule, stack_path(construct))
+            )
+        return violations
+
+    def is_suppressed(self, rule: str, path: str) -> bool:
+        return any(
+            path.startswith(prefix) for prefix in self.suppressions.get(rule, [])
+        )
+
+    def annotate(self, stack: cdk.Stack, template: Dict[str, Any]) -> None:
+        """Add an error or warning annotation for every violation in a template."""
+        for rule, construct in self.violations(stack, template):
+            message = (
+                f"[{rule}] {RULES[rule]}. Suppress it with "
+                f"guardrails.suppressions.{rule}: [{stack_path(construct)}]"
+            )
+            if self.severities[rule] == "error":
+                cdk.Annotations.of(construct).add_error(message)
+            else:
+                cdk.Annotations.of(construct).add_warning(message)
+
+    def visit(self, node: IConstruct) -> None:
+        if not isinstance(node, cdk.CfnResource):
+            return
+
+        stack = cdk.Stack.of(node)
+        logical_id = stack.resolve(node.logical_id)
+        self.resources.setdefault(stack.stack_name, {})[logical_id] = node
+
+
+def stack_path(construct: IConstruct) -> str:
+    # Paths are relative to the stack, so suppressions apply to every
+    # environment
+    return construct.node.path.split("/", 1)[-1]
+
+
+def synth(app: cdk.App) -> cx_api.CloudAssembly:
+    """
+    Synthesize the app and annotate the guardrail violations of every stack.
+
+    The checks need the synthesized templates, so the app is synthesized again
+    to write the annotations into the cloud assembly, where the CDK CLI reports
+    them like any other error or warning.
+    """
+    assembly = app.synth()
+    for stack in app.node.children:
+        if not isinstance(stack, cdk.Stack):
+            continue
+        template = assembly.get_stack_by_name(stack.stack_name).template
+        for aspect in cdk.Aspects.of(stack).all:
+            if isinstance(aspect, PerformanceGuardrails):
+                aspect.annotate(stack, template)
+    return app.synth(force=True)
@@ -29,6 +29,17 @@ class IAM(Construct):
                     "Effect": "Allow",
                     "Sid": "2",
                 },
+                {
+                    "Action": "ssm:GetParameter",
+                    "Resource": [
+                        f"arn:aws:ssm:*:{aws_account_id}:parameter/valohai-redis-url",
+                        f"arn:aws:ssm:*:{aws_account_id}:parameter/valohai-redis-logs-url",
+                        f"arn:aws:ssm:*:{aws_account_id}:parameter/valohai-fsx-*",
+                        f"arn:aws:ssm:*:{aws_account_id}:parameter/valohai-ecr-*",
+                    ],
+                    "Effect": "Allow",
+                    "Sid": "3",
+                },
             ],
         }
 
@@ -50,7 +61,7 @@ class IAM(Construct):
         )
         self.role_worker.add_managed_policy(worker_policy)
 
-        role_worker_instance_profile = iam.CfnInstanceProfile(
+        iam.CfnInstanceProfile(
             self,
             "ValohaiWorkerInstanceProfile",
             roles=[self.role_worker.role_name],
@@ -144,6 +155,17 @@ class IAM(Construct):
                         "StringEquals": {"secretsmanager:ResourceTag/valohai": "1"}
                     },
                 },
+                {
+                    "Sid": "PublishBootstrapMetrics",
+                    "Effect": "Allow",
+                    "Action": "cloudwatch:PutMetricData",
+                    "Resource": "*",
+                    "Condition": {
+                        "StringEquals": {
+                            "cloudwatch:namespace": ["Valohai/Bootstrap", "Valohai/Roi"]
+                        }
+                    },
+                },
                 {
                     "Effect": "Allow",
                     "Action": "s3:*",
@@ -203,7 +225,6 @@ class IAM(Construct):
             assumed_by=iam.ServicePrincipal("ec2.amazonaws.com"),
         )
         self.role_master.add_managed_policy(master_policy)
-        
 
         # S3 Access
         multipart_policy_document_json = {
@@ -247,19 +268,11 @@ class IAM(Construct):
         )
         role_multipart.add_managed_policy(multipart_policy)
 
-        multipart_role_assume_policy_json = {
-            "Version": "2012-10-17",
-            "Statement": [
-                {
-                    "Effect": "Allow",
-                    "Principal": {
-                        "AWS": f"arn:aws:iam::{aws_account_id}:role/valohai-role-master"
-                    },
-                    "Action": "sts:AssumeRole",
-                }
-            ],
-        }
-
-        role_multipart.assumeRolePolicy = iam.PolicyDocument.from_json(
-            multipart_role_assume_policy_json
+        # Roi assumes this role to sign multipart uploads for large outputs
+        assert role_multipart.assume_role_policy is not None
+        role_multipart.assume_role_policy.add_statements(
+            iam.PolicyStatement(
+                actions=["sts:AssumeRole"],
+                principals=[iam.ArnPrincipal(self.role_master.role_arn)],
+            )
         )
@@ -0,0 +1,258 @@
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+
+import aws_cdk as cdk
+import aws_cdk.aws_ec2 as ec2
+import aws_cdk.aws_iam as iam
+import aws_cdk.aws_imagebuilder as imagebuilder
+from constructs import Construct
+
+# Latest Ubuntu 22.04 image managed by Image Builder, resolved at build time
+PARENT_IMAGE = "arn:aws:imagebuilder:{region}:aws:image/ubuntu-server-22-lts-x86/x.x.x"
+
+WORKER_AMI_PARAMETER = "valohai-worker-ami-id"
+
+# No NVIDIA runtime here, GPU queues keep using their own AMIs. Parallel layer
+# downloads speed up the pulls the AMI doesn't cover, and capped json logs keep
+# long executions from filling the root volume.
+DOCKER_DAEMON_CONFIG = {
+    "storage-driver": "overlay2",
+    "max-concurrent-downloads": 10,
+    "max-concurrent-uploads": 10,
+    "live-restore": True,
+    "log-driver": "json-file",
+    "log-opts": {"max-size": "100m", "max-file": "3"},
+}
+
+
+def content_version(data: str) -> str:
+    """
+    Image Builder components and recipes are immutable, so derive their
+    version from the content and let a change replace them.
+    """
+    return f"1.0.{int(hashlib.sha256(data.encode()).hexdigest()[:6], 16)}"
+
+
+def worker_component_document(agent_installer_url: str, images: List[str]) -> str:
+    daemon_config = json.dumps(DOCKER_DAEMON_CONFIG)
+    pull_commands = [f"docker pull {image}" for image in images]
+    return json.dumps(
+        {
+            "name": "valohai-worker",
+            "schemaVersion": 1.0,
+            "phases": [
+                {
+                    "name": "build",
+                    "steps": [
+                        {
+                            "name": "InstallDocker",
+                            "action": "ExecuteBash",
+                            "inputs": {
+                                "commands": [
+                                    "apt-get update",
+                                    "DEBIAN_FRONTEND=noninteractive apt-get install -y docker.io awscli",
+                                    "mkdir -p /etc/docker",
+                                    f"echo '{daemon_config}' > /etc/docker/daemon.json",
+                                    "systemctl enable docker",
+                                    "systemctl restart docker",
+                                ]
+                            },
+                        },
+                        {
+                            "name": "InstallAgent",
+                            "action": "ExecuteBash",
+                            "inputs": {
+                                "commands": [
+                                    f"curl -fsSL {agent_installer_url} -o /tmp/install-peon.sh",
+                                    "bash /tmp/install-peon.sh",
+                                    "rm /tmp/install-peon.sh",
+                                ]
+                            },
+                        },
+                        {
+                            "name": "PullImages",
+                            "action": "ExecuteBash",
+                            "inputs": {"commands": pull_commands or ["true"]},
+                        },
+                        {
+                            # Unattended upgrades hold the apt lock and compete
+                            # for CPU during the first minutes after boot
+                            "name": "DisableBootUpgrades",
+                            "action": "ExecuteBash",
+                            "inputs": {
+                                "commands": [
+                                    "systemctl disable apt-daily.timer apt-daily-upgrade.timer",
+                                    "DEBIAN_FRONTEND=noninteractive apt-get remove -y unattended-upgrades",
+                                ]
+                            },
+                        },
+                    ],
+                },
+                {
+                    "name": "test",
+                    "steps": [
+                        {
+                            "name": "CheckImages",
+                            "action": "ExecuteBash",
+                            "inputs": {
+                                "commands": [
+                                    "systemctl is-enabled docker",
+                                    *[
+                                        f"docker image inspect {image}"
+                                        for image in images
+                                    ],
+                                ]
+                            },
+                        }
+                    ],
+                },
+            ],
+        }
+    )
+
+
+class WorkerImage(Construct):
+    def __init__(
+        self,
+        scope: Construct,
+        id_: str,
+        *,
+        subnet_id: str,
+        security_group: ec2.ISecurityGroup,
+        agent_installer_url: str,
+        images: Optional[List[str]] = None,
+        volume_size: int = 100,
+        build_instance_type: str = "m5.large",
+        schedule: str = "cron(0 3 ? * sun *)",
+    ):
+        super().__init__(scope, id_)
+
+        region = cdk.Stack.of(self).region
+        images = images or []
+
+        self.role = iam.Role(
+            self,
+            "valohai-role-imagebuilder",
+            role_name="valohai-role-imagebuilder",
+            assumed_by=iam.ServicePrincipal("ec2.amazonaws.com"),
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name(
+                    "AmazonSSMManagedInstanceCore"
+                ),
+                iam.ManagedPolicy.from_aws_managed_policy_name(
+                    "EC2InstanceProfileForImageBuilder"
+                ),
+            ],
+        )
+        instance_profile = iam.CfnInstanceProfile(
+            self,
+            "valohai-imagebuilder-profile",
+            instance_profile_name="valohai-imagebuilder-profile",
+            roles=[self.role.role_name],
+        )
+
+        component_data = worker_component_document(agent_installer_url, images)
+        component = imagebuilder.CfnComponent(
+            self,
+            "valohai-worker-component",
+            name="valohai-worker",
+            platform="Linux",
+            version=content_version(component_data),
+            data=component_data,
+        )
+
+        recipe_version = content_version(f"{component_data}{volume_size}")
+        recipe = imagebuilder.CfnImageRecipe(
+            self,
+            "valohai-worker-recipe",
+            name="valohai-worker",
+            version=recipe_version,
+            parent_image=PARENT_IMAGE.format(region=region),
+            components=[
+                imagebuilder.CfnImageRecipe.ComponentConfigurationProperty(
+                    component_arn=component.attr_arn
+                )
+            ],
+            block_device_mappings=[
+                imagebuilder.CfnImageRecipe.InstanceBlockDeviceMappingProperty(
+                    device_name="/dev/sda1",
+                    ebs=imagebuilder.CfnImageRecipe.EbsInstanceBlockDeviceSpecificationProperty(
+                        volume_size=volume_size,
+                        volume_type="gp3",
+                        encrypted=True,
+                        delete_on_termination=True,
+                    ),
+                )
+            ],
+        )
+
+        infrastructure = imagebuilder.CfnInfrastructureConfiguration(
+            self,
+            "valohai-worker-infrastructure",
+            name="valohai-worker",
+            instance_profile_name=instance_profile.ref,
+            instance_types=[build_instance_type],
+            subnet_id=subnet_id,
+            security_group_ids=[security_group.security_group_id],
+            terminate_instance_on_failure=True,
+            instance_metadata_options=imagebuilder.CfnInfrastructureConfiguration.InstanceMetadataOptionsProperty(
+                http_tokens="required"
+            ),
+        )
+        infrastructure.add_dependency(instance_profile)
+
+        ami_tags: Dict[str, Any] = {"Valohai": "1", "Name": "valohai-worker"}
+        distribution = imagebuilder.CfnDistributionConfiguration(
+            self,
+            "valohai-worker-distribution",
+            name="valohai-worker",
+            distributions=[
+                imagebuilder.CfnDistributionConfiguration.DistributionProperty(
+                    region=region,
+                    ami_distribution_configuration={
+                        "Name": "valohai-worker-{{imagebuilder:buildDate}}",
+                        "AmiTags": ami_tags,
+                    },
+                )
+            ],
+        )
+        # This CDK version doesn't know about publishing the AMI ID to SSM
+        distribution.add_property_override(
+            "Distributions.0.SsmParameterConfigurations",
+            [{"ParameterName": WORKER_AMI_PARAMETER, "DataType": "aws:ec2:image"}],
+        )
+
+        # Rebuild on schedule even without a new Ubuntu release, so the
+        # pre-pulled images stay current
+        self.pipeline = imagebuilder.CfnImagePipeline(
+            self,
+            "valohai-worker-pipeline",
+            name="valohai-worker",
+            image_recipe_arn=recipe.attr_arn,
+            infrastructure_configuration_arn=infrastructure.attr_arn,
+            distribution_configuration_arn=distribution.attr_arn,
+            schedule=imagebuilder.CfnImagePipeline.ScheduleProperty(
+                schedule_expression=schedule,
+                pipeline_execution_start_condition="EXPRESSION_MATCH_ONLY",
+            ),
+            image_tests_configuration=imagebuilder.CfnImagePipeline.ImageTestsConfigurationProperty(
+                image_tests_enabled=True, timeout_minutes=60
+            ),
+        )
+
+        # Build an image during the deploy as well, so the AMI parameter exists
+        # before the first worker launches. A recipe change replaces it and
+        # builds the new recipe right away.
+        self.image = imagebuilder.CfnImage(
+            self,
+            "valohai-worker-image",
+            image_recipe_arn=recipe.attr_arn,
+            infrastructure_configuration_arn=infrastructure.attr_arn,
+            distribution_configuration_arn=distribution.attr_arn,
+            image_tests_configuration=imagebuilder.CfnImage.ImageTestsConfigurationProperty(
+                image_tests_enabled=True, timeout_minutes=60
+            ),
+        )
+
+        self.ami_parameter_name = WORKER_AMI_PARAMETER
@@ -0,0 +1,98 @@
+from typing import Dict, Optional
+
+import aws_cdk as cdk
+import aws_cdk.aws_autoscaling as autoscaling
+import aws_cdk.aws_events as events
+import aws_cdk.aws_events_targets as events_targets
+import aws_cdk.aws_iam as iam
+import aws_cdk.aws_sqs as sqs
+import aws_cdk.aws_ssm as ssm
+from constructs import Construct
+
+# EventBridge detail types routed to Roi. Spot events don't carry instance tags,
+# so Roi matches their instance IDs against its own Valohai-tagged workers.
+INTERRUPTION_EVENTS = {
+    "spot-interruption": ("aws.ec2", "EC2 Spot Instance Interruption Warning"),
+    "rebalance": ("aws.ec2", "EC2 Instance Rebalance Recommendation"),
+}
+
+
+class Interruptions(Construct):
+    def __init__(
+        self,
+        scope: Construct,
+        id_: str,
+        *,
+        role_master: iam.Role,
+        auto_scaling_groups: Optional[Dict[str, autoscaling.AutoScalingGroup]] = None,
+        drain_timeout: Optional[int] = None,
+    ):
+        super().__init__(scope, id_)
+
+        # An interruption notice is worthless once the instance is gone
+        self.queue = sqs.Queue(
+            self,
+            "valohai-interruptions",
+            queue_name="valohai-interruptions",
+            retention_period=cdk.Duration.hours(1),
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            enforce_ssl=True,
+        )
+
+        for name, (source, detail_type) in INTERRUPTION_EVENTS.items():
+            events.Rule(
+                self,
+                f"valohai-interruptions-{name}",
+                rule_name=f"valohai-interruptions-{name}",
+                event_pattern=events.EventPattern(
+                    source=[source], detail_type=[detail_type]
+                ),
+                targets=[events_targets.SqsQueue(self.queue)],
+            )
+
+        self.queue.grant_consume_messages(role_master)
+
+        if drain_timeout is not None:
+            # Hold terminating CDK-managed workers so Roi can drain them. Every
+            # scale-in waits until Roi completes the action or it times out.
+            for queue_name, auto_scaling_group in (auto_scaling_groups or {}).items():
+                auto_scaling_group.add_lifecycle_hook(
+                    "valohai-drain",
+                    lifecycle_hook_name=f"valohai-drain-{queue_name}",
+                    lifecycle_transition=autoscaling.LifecycleTransition.INSTANCE_TERMINATING,
+                    heartbeat_timeout=cdk.Duration.seconds(drain_timeout),
+                    default_result=autoscaling.DefaultResult.CONTINUE,
+                )
+
+            events.Rule(
+                self,
+                "valohai-interruptions-terminate-lifecycle",
+                rule_name="valohai-interruptions-terminate-lifecycle",
+                event_pattern=events.EventPattern(
+                    source=["aws.autoscaling"],
+                    detail_type=["EC2 Instance-terminate Lifecycle Action"],
+                    detail={"AutoScalingGroupName": [{"prefix": "valohai-workers-"}]},
+                ),
+                targets=[events_targets.SqsQueue(self.queue)],
+            )
+
+            role_master.add_to_principal_policy(
+                iam.PolicyStatement(
+                    sid="DrainValohaiWorkers",
+                    actions=[
+                        "autoscaling:CompleteLifecycleAction",
+                        "autoscaling:RecordLifecycleActionHeartbeat",
+                    ],
+                    resources=["*"],
+                    conditions={"StringEquals": {"aws:ResourceTag/Valohai": "1"}},
+                )
+            )
+
+        ssm.StringParameter(
+            self,
+            "valohai-interruptions-queue-url",
+            allowed_pattern=".*",
+            description="The SQS queue with spot interruption and termination events",
+            parameter_name="valohai-interruptions-queue-url",
+            string_value=self.queue.queue_url,
+        )
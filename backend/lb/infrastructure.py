@@ -1,12 +1,44 @@
+from typing import Optional, Sequence
+
+import aws_cdk as cdk
 import aws_cdk.aws_ec2 as ec2
 import aws_cdk.aws_elasticloadbalancingv2 as elbv2
 from constructs import Construct
 
+LOAD_BALANCING_ALGORITHMS = {
+    "round_robin": elbv2.TargetGroupLoadBalancingAlgorithmType.ROUND_ROBIN,
+    "least_outstanding_requests": elbv2.TargetGroupLoadBalancingAlgorithmType.LEAST_OUTSTANDING_REQUESTS,
+}
+
 
 class LoadBalancer(Construct):
-    def __init__(self, scope: Construct, id_: str, *, vpc: ec2.Vpc):
+    def __init__(
+        self,
+        scope: Construct,
+        id_: str,
+        *,
+        vpc: ec2.IVpc,
+        certificate_arn: Optional[str] = None,
+        algorithm: str = "least_outstanding_requests",
+        slow_start: Optional[int] = None,
+        health_check_path: Optional[str] = None,
+        deregistration_delay: Optional[int] = None,
+        idle_timeout: int = 300,
+    ):
         super().__init__(scope, id_)
 
+        # ALB doesn't support slow start together with least outstanding requests
+        if slow_start and algorithm == "least_outstanding_requests":
+            raise ValueError(
+                "Load balancer slow_start requires the round_robin algorithm"
+            )
+
+        self.algorithm = LOAD_BALANCING_ALGORITHMS[algorithm]
+        self.slow_start = slow_start
+        self.health_check_path = health_check_path
+        self.deregistration_delay = deregistration_delay
+        self.has_https = bool(certificate_arn)
+
         self.sg_loadbalancer = ec2.SecurityGroup(
             self,
             "valohai-sg-loadbalancer",
@@ -16,14 +48,57 @@ class LoadBalancer(Construct):
         )
         self.sg_loadbalancer.add_ingress_rule(ec2.Peer.any_ipv4(), ec2.Port.tcp(80))
 
-        load_balancer = elbv2.ApplicationLoadBalancer(
+        self.load_balancer = elbv2.ApplicationLoadBalancer(
             self,
             "valohai-roi-lb",
             load_balancer_name="valohai-roi-lb",
             vpc=vpc,
             internet_facing=True,
             security_group=self.sg_loadbalancer,
+            http2_enabled=True,
+            idle_timeout=cdk.Duration.seconds(idle_timeout),
         )
 
-        self.listener = load_balancer.add_listener("Listener", port=80)
+        if certificate_arn:
+            self.sg_loadbalancer.add_ingress_rule(
+                ec2.Peer.any_ipv4(), ec2.Port.tcp(443)
+            )
+            self.listener = self.load_balancer.add_listener(
+                "HttpsListener",
+                port=443,
+                certificates=[elbv2.ListenerCertificate.from_arn(certificate_arn)],
+                ssl_policy=elbv2.SslPolicy.RECOMMENDED_TLS,
+            )
+            self.load_balancer.add_redirect(source_port=80, target_port=443)
+        else:
+            self.listener = self.load_balancer.add_listener("Listener", port=80)
+
         self.listener.connections.allow_default_port_from_any_ipv4("Open to the world")
+
+    def add_targets(
+        self, targets: Sequence[elbv2.IApplicationLoadBalancerTarget]
+    ) -> elbv2.ApplicationTargetGroup:
+        health_check = None
+        if self.health_check_path:
+            health_check = elbv2.HealthCheck(
+                path=self.health_check_path,
+                interval=cdk.Duration.seconds(15),
+                healthy_threshold_count=2,
+                unhealthy_threshold_count=3,
+            )
+
+        return self.listener.add_targets(
+            "Target",
+            port=8000,
+            targets=targets,
+            load_balancing_algorithm_type=self.algorithm,
+            slow_start=(
+                cdk.Duration.seconds(self.slow_start) if self.slow_start else None
+            ),
+            health_check=health_check,
+            deregistration_delay=(
+                cdk.Duration.seconds(self.deregistration_delay)
+                if self.deregistration_delay is not None
+                else None
+            ),
+        )
@@ -0,0 +1,311 @@
+from typing import Dict, List, Optional, Union
+
+import aws_cdk as cdk
+import aws_cdk.aws_cloudwatch as cloudwatch
+import aws_cdk.aws_cloudwatch_actions as cloudwatch_actions
+import aws_cdk.aws_elasticloadbalancingv2 as elbv2
+import aws_cdk.aws_rds as rds
+import aws_cdk.aws_sns as sns
+from constructs import Construct
+
+from backend.compute.infrastructure import RoiInstance
+from backend.lb.infrastructure import LoadBalancer
+from backend.postgres.infrastructure import Database
+from backend.redis.infrastructure import Queue
+
+# Alarm thresholds. Percentages for CPU and memory, seconds for latencies and
+# GiB for free storage. db_connections defaults to 80% of max_connections.
+DEFAULT_THRESHOLDS: Dict[str, float] = {
+    "redis_cpu": 80,
+    "redis_memory": 80,
+    "redis_evictions": 0,
+    "redis_connections": 10000,
+    "db_cpu": 80,
+    "db_iops": 2700,  # 90% of the gp3 baseline
+    "db_read_latency": 0.02,
+    "db_write_latency": 0.02,
+    "db_free_storage": 5,
+    "alb_p99": 2,
+    "alb_5xx": 10,
+    "roi_cpu": 80,
+}
+
+PERIOD = cdk.Duration.minutes(1)
+
+
+class Monitoring(Construct):
+    def __init__(
+        self,
+        scope: Construct,
+        id_: str,
+        *,
+        redis: Queue,
+        database: Database,
+        load_balancer: LoadBalancer,
+        compute: RoiInstance,
+        thresholds: Optional[Dict[str, float]] = None,
+        alarm_topic_arn: Optional[str] = None,
+    ):
+        super().__init__(scope, id_)
+
+        unknown = set(thresholds or {}) - set(DEFAULT_THRESHOLDS) - {"db_connections"}
+        if unknown:
+            raise ValueError(f"Unknown monitoring thresholds: {sorted(unknown)}")
+
+        self.thresholds = {
+            **DEFAULT_THRESHOLDS,
+            "db_connections": database.max_connections * 0.8,
+            **(thresholds or {}),
+        }
+        self.alarm_action = (
+            cloudwatch_actions.SnsAction(
+                sns.Topic.from_topic_arn(self, "valohai-alarm-topic", alarm_topic_arn)
+            )
+            if alarm_topic_arn
+            else None
+        )
+        self.alarms: List[cloudwatch.Alarm] = []
+
+        self.dashboard = cloudwatch.Dashboard(
+            self, "valohai-dashboard", dashboard_name="valohai-performance"
+        )
+        self.dashboard.add_widgets(
+            cloudwatch.TextWidget(markdown="# Redis", width=24, height=1)
+        )
+        self.dashboard.add_widgets(
+            *self._redis_widgets(
+                redis.cache_cluster_ids, redis.broker_cache_cluster_ids
+            )
+        )
+        self.dashboard.add_widgets(
+            cloudwatch.TextWidget(markdown="# RDS PostgreSQL", width=24, height=1)
+        )
+        self.dashboard.add_widgets(*self._database_widgets(database))
+        self.dashboard.add_widgets(
+            cloudwatch.TextWidget(
+                markdown="# Load balancer and Roi", width=24, height=1
+            )
+        )
+        self.dashboard.add_widgets(
+            *self._load_balancer_widgets(load_balancer),
+            *self._roi_widgets(compute),
+        )
+        self.dashboard.add_widgets(
+            cloudwatch.AlarmStatusWidget(
+                title="Alarms",
+                alarms=self.alarms,
+                width=24,
+                height=4,
+            )
+        )
+
+    def _alarm(
+        self,
+        name: str,
+        metric: cloudwatch.IMetric,
+        threshold_key: str,
+        *,
+        comparison_operator: cloudwatch.ComparisonOperator = (
+            cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD
+        ),
+        evaluation_periods: int = 5,
+        threshold_scale: float = 1,
+    ) -> cloudwatch.Alarm:
+        alarm = cloudwatch.Alarm(
+            self,
+            name,
+            alarm_name=name,
+            metric=metric,
+            threshold=self.thresholds[threshold_key] * threshold_scale,
+            comparison_operator=comparison_operator,
+            evaluation_periods=evaluation_periods,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+        )
+        if self.alarm_action:
+            alarm.add_alarm_action(self.alarm_action)
+            alarm.add_ok_action(self.alarm_action)
+        self.alarms.append(alarm)
+        return alarm
+
+    def _redis_widgets(
+        self, cache_cluster_ids: List[str], broker_cache_cluster_ids: List[str]
+    ) -> List[cloudwatch.IWidget]:
+        def metric(name: str, node: str, statistic: str) -> cloudwatch.Metric:
+            return cloudwatch.Metric(
+                namespace="AWS/ElastiCache",
+                metric_name=name,
+                dimensions_map={"CacheClusterId": node},
+                statistic=statistic,
+                period=PERIOD,
+                label=node,
+            )
+
+        graphs = {
+            "redis_cpu": ("EngineCPUUtilization", "Average", "Engine CPU (%)"),
+            "redis_memory": ("DatabaseMemoryUsagePercentage", "Maximum", "Memory (%)"),
+            "redis_evictions": ("Evictions", "Sum", "Evictions"),
+            "redis_connections": ("CurrConnections", "Maximum", "Connections"),
+        }
+        widgets: List[cloudwatch.IWidget] = []
+        for key, (metric_name, statistic, title) in graphs.items():
+            metrics = [
+                metric(metric_name, node, statistic) for node in cache_cluster_ids
+            ]
+            for node, node_metric in zip(cache_cluster_ids, metrics):
+                # The log store evicts old logs by design (volatile-lru)
+                if key == "redis_evictions" and node not in broker_cache_cluster_ids:
+                    continue
+                self._alarm(
+                    f"valohai-{key.replace('_', '-')}-{node}",
+                    node_metric,
+                    key,
+                    # Any eviction means lost queue data, so alarm right away
+                    evaluation_periods=1 if key == "redis_evictions" else 5,
+                )
+            widgets.append(cloudwatch.GraphWidget(title=title, left=metrics, width=6))
+        return widgets
+
+    def _database_widgets(self, database: Database) -> List[cloudwatch.IWidget]:
+        # Aurora publishes the same metrics per cluster, except free storage
+        # because its storage grows on its own
+        db: Union[rds.DatabaseInstance, rds.DatabaseCluster]
+        if database.cluster:
+            db = database.cluster
+            free_storage = None
+        else:
+            assert database.rds_instance is not None
+            db = database.rds_instance
+            free_storage = db.metric_free_storage_space(
+                statistic="Minimum", period=PERIOD
+            )
+
+        cpu = db.metric_cpu_utilization(period=PERIOD)
+        read_iops = db.metric(
+            "ReadIOPS", statistic="Average", period=PERIOD, label="Read"
+        )
+        write_iops = db.metric(
+            "WriteIOPS", statistic="Average", period=PERIOD, label="Write"
+        )
+        read_latency = db.metric(
+            "ReadLatency", statistic="Average", period=PERIOD, label="Read"
+        )
+        write_latency = db.metric(
+            "WriteLatency", statistic="Average", period=PERIOD, label="Write"
+        )
+        connections = db.metric_database_connections(statistic="Maximum", period=PERIOD)
+        total_iops = cloudwatch.MathExpression(
+            expression="read + write",
+            using_metrics={"read": read_iops, "write": write_iops},
+            label="Total",
+            period=PERIOD,
+        )
+
+        self._alarm("valohai-db-cpu", cpu, "db_cpu")
+        self._alarm("valohai-db-iops", total_iops, "db_iops")
+        self._alarm("valohai-db-read-latency", read_latency, "db_read_latency")
+        self._alarm("valohai-db-write-latency", write_latency, "db_write_latency")
+        self._alarm("valohai-db-connections", connections, "db_connections")
+        widgets: List[cloudwatch.IWidget] = [
+            cloudwatch.GraphWidget(title="CPU (%)", left=[cpu], width=4),
+            cloudwatch.GraphWidget(
+                title="IOPS", left=[read_iops, write_iops, total_iops], width=5
+            ),
+            cloudwatch.GraphWidget(
+                title="Latency (s)", left=[read_latency, write_latency], width=5
+            ),
+            cloudwatch.GraphWidget(
+                title="Connections",
+                left=[connections],
+                left_annotations=[
+                    cloudwatch.HorizontalAnnotation(
+                        value=database.max_connections, label="max_connections"
+                    )
+                ],
+                width=5,
+            ),
+        ]
+        if free_storage:
+            self._alarm(
+                "valohai-db-free-storage",
+                free_storage,
+                "db_free_storage",
+                comparison_operator=cloudwatch.ComparisonOperator.LESS_THAN_THRESHOLD,
+                threshold_scale=1024**3,
+            )
+            widgets.append(
+                cloudwatch.GraphWidget(
+                    title="Free storage (bytes)", left=[free_storage], width=5
+                )
+            )
+        return widgets
+
+    def _load_balancer_widgets(
+        self, load_balancer: LoadBalancer
+    ) -> List[cloudwatch.IWidget]:
+        alb = load_balancer.load_balancer
+
+        response_times = [
+            alb.metrics.target_response_time(
+                statistic=statistic, period=PERIOD, label=statistic
+            )
+            for statistic in ("p50", "p95", "p99")
+        ]
+        errors = cloudwatch.MathExpression(
+            expression="FILL(target, 0) + FILL(elb, 0)",
+            using_metrics={
+                "target": alb.metrics.http_code_target(
+                    elbv2.HttpCodeTarget.TARGET_5XX_COUNT, period=PERIOD
+                ),
+                "elb": alb.metrics.http_code_elb(
+                    elbv2.HttpCodeElb.ELB_5XX_COUNT, period=PERIOD
+                ),
+            },
+            label="5xx",
+            period=PERIOD,
+        )
+        requests = alb.metrics.request_count(period=PERIOD)
+
+        self._alarm("valohai-alb-p99", response_times[-1], "alb_p99")
+        self._alarm("valohai-alb-5xx", errors, "alb_5xx", evaluation_periods=3)
+
+        return [
+            cloudwatch.GraphWidget(
+                title="Target response time (s)", left=response_times, width=6
+            ),
+            cloudwatch.GraphWidget(
+                title="Requests and 5xx", left=[requests], right=[errors], width=6
+            ),
+        ]
+
+    def _roi_widgets(self, compute: RoiInstance) -> List[cloudwatch.IWidget]:
+        if compute.roi_group:
+            dimensions = {
+                "AutoScalingGroupName": compute.roi_group.auto_scaling_group_name
+            }
+        else:
+            assert compute.roi_instance is not None
+            dimensions = {"InstanceId": compute.roi_instance.instance_id}
+
+        cpu = cloudwatch.Metric(
+            namespace="AWS/EC2",
+            metric_name="CPUUtilization",
+            dimensions_map=dimensions,
+            statistic="Average",
+            period=PERIOD,
+        )
+        bootstrap = cloudwatch.Metric(
+            namespace="Valohai/Bootstrap",
+            metric_name="PhaseDuration",
+            dimensions_map={"Phase": "total"},
+            statistic="Maximum",
+            period=cdk.Duration.hours(1),
+        )
+
+        self._alarm("valohai-roi-cpu", cpu, "roi_cpu")
+
+        return [
+            cloudwatch.GraphWidget(title="Roi CPU (%)", left=[cpu], width=6),
+            cloudwatch.GraphWidget(
+                title="Roi boot time (s)", left=[bootstrap], width=6
+            ),
+        ]
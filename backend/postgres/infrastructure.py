@@ -1,10 +1,128 @@
+from typing import Any, Dict, Optional, Tuple
+
 import aws_cdk as cdk
+import aws_cdk.aws_applicationautoscaling as appscaling
 import aws_cdk.aws_ec2 as ec2
 import aws_cdk.aws_rds as rds
 import aws_cdk.aws_secretsmanager as secretsmanager
 import aws_cdk.aws_ssm as ssm
 from constructs import Construct
 
+from backend.architecture import instance_type_for
+from backend.architecture import is_graviton
+
+# vCPUs per instance size, and memory (GiB) per vCPU for each instance family class
+VCPUS_PER_SIZE = {
+    "large": 2,
+    "xlarge": 4,
+    "2xlarge": 8,
+    "4xlarge": 16,
+    "8xlarge": 32,
+    "12xlarge": 48,
+    "16xlarge": 64,
+    "24xlarge": 96,
+}
+MEMORY_PER_VCPU = {"c": 2, "m": 4, "r": 8, "x": 16}
+# Burstable classes don't follow a fixed memory/vCPU ratio
+BURSTABLE_MEMORY = {"micro": 1, "small": 2, "medium": 4, "large": 8, "xlarge": 16}
+
+# RDS only allows provisioning gp3 IOPS and throughput from this volume size up
+GP3_PROVISIONED_MIN_STORAGE = 400
+
+# Graviton3 (m7g/r7g) DB instances need at least this PostgreSQL 14 release
+GRAVITON_POSTGRES_VERSION = "14.7"
+
+# Aurora PostgreSQL release with Serverless v2 and Graviton3 support
+AURORA_POSTGRES_VERSION = "14.9"
+AURORA_INSTANCE_FAMILIES = ("r", "t", "x")
+# Aurora sizes memory settings from the instance class and has no checkpoints
+# or WAL size of its own, so only planner and autovacuum settings carry over
+AURORA_PARAMETERS = [
+    "random_page_cost",
+    "autovacuum_max_workers",
+    "autovacuum_vacuum_scale_factor",
+    "autovacuum_analyze_scale_factor",
+    "autovacuum_vacuum_cost_limit",
+]
+# Aurora PostgreSQL default: LEAST({DBInstanceClassMemory/9531392}, 5000)
+AURORA_BYTES_PER_CONNECTION = 9531392
+# Memory per Aurora capacity unit
+ACU_MEMORY_MIB = 2048
+READER_SCALING_METRICS = {
+    "cpu": appscaling.PredefinedMetric.RDS_READER_AVERAGE_CPU_UTILIZATION,
+    "connections": appscaling.PredefinedMetric.RDS_READER_AVERAGE_DATABASE_CONNECTIONS,
+}
+
+
+def instance_memory_mib(instance_type: str) -> int:
+    family, size = instance_type.split(".")
+    if family.startswith("t"):
+        return BURSTABLE_MEMORY[size] * 1024
+    return VCPUS_PER_SIZE[size] * MEMORY_PER_VCPU[family[0]] * 1024
+
+
+def postgres_parameters(instance_type: str) -> Dict[str, str]:
+    """
+    Derive PostgreSQL settings for the instance class. Memory settings use the
+    units RDS expects: 8 kB pages for buffer/cache sizes and kB for work memory.
+    """
+    memory_kb = instance_memory_mib(instance_type) * 1024
+    max_connections = min(1000, max(100, memory_kb // (1024 * 1024) * 25))
+
+    return {
+        "shared_buffers": str(memory_kb // 4 // 8),
+        "effective_cache_size": str(memory_kb * 3 // 4 // 8),
+        "work_mem": str(max(4096, memory_kb // 4 // max_connections)),
+        "maintenance_work_mem": str(min(2 * 1024 * 1024, memory_kb // 16)),
+        "max_connections": str(max_connections),
+        "random_page_cost": "1.1",
+        "checkpoint_timeout": "900",
+        "checkpoint_completion_target": "0.9",
+        "max_wal_size": "4096",
+        "autovacuum_max_workers": "4",
+        "autovacuum_vacuum_scale_factor": "0.05",
+        "autovacuum_analyze_scale_factor": "0.02",
+        "autovacuum_vacuum_cost_limit": "2000",
+    }
+
+
+def validate_postgres_settings(
+    instance_type: str,
+    parameters: Dict[str, str],
+    allocated_storage: int,
+    max_allocated_storage: Optional[int],
+    iops: Optional[int],
+    storage_throughput: Optional[int],
+) -> None:
+    memory_kb = instance_memory_mib(instance_type) * 1024
+
+    if int(parameters["shared_buffers"]) * 8 > memory_kb * 0.4:
+        raise ValueError(
+            f"shared_buffers is more than 40% of the memory of {instance_type}"
+        )
+    if int(parameters["effective_cache_size"]) * 8 > memory_kb:
+        raise ValueError(
+            f"effective_cache_size is larger than the memory of {instance_type}"
+        )
+    if int(parameters["max_connections"]) * int(parameters["work_mem"]) > memory_kb:
+        raise ValueError(
+            f"max_connections * work_mem is larger than the memory of {instance_type}"
+        )
+
+    if (iops or storage_throughput) and allocated_storage < GP3_PROVISIONED_MIN_STORAGE:
+        raise ValueError(
+            f"gp3 IOPS and throughput can only be set with allocated_storage "
+            f"of {GP3_PROVISIONED_MIN_STORAGE} GB or more"
+        )
+    if iops and not 12000 <= iops <= 64000:
+        raise ValueError("gp3 iops must be between 12000 and 64000")
+    if storage_throughput and not 500 <= storage_throughput <= 4000:
+        raise ValueError("gp3 storage_throughput must be between 500 and 4000 MiB/s")
+    if iops and storage_throughput and storage_throughput > iops / 4:
+        raise ValueError("gp3 storage_throughput can be at most iops / 4 MiB/s")
+    if max_allocated_storage and max_allocated_storage <= allocated_storage:
+        raise ValueError("max_allocated_storage must be larger than allocated_storage")
+
 
 class Database(Construct):
     def __init__(
@@ -12,24 +130,40 @@ class Database(Construct):
         scope: Construct,
         id_: str,
         *,
-        vpc: ec2.Vpc,
+        vpc: ec2.IVpc,
         subnets: ec2.SubnetSelection,
-        sg_master: ec2.SecurityGroup
+        sg_master: ec2.ISecurityGroup,
+        instance_type: str = "m5.xlarge",
+        architecture: str = "x86_64",
+        engine_version: Optional[str] = None,
+        allocated_storage: int = 20,
+        max_allocated_storage: Optional[int] = None,
+        iops: Optional[int] = None,
+        storage_throughput: Optional[int] = None,
+        parameters: Optional[Dict[str, str]] = None,
+        performance_insights: bool = True,
+        monitoring_interval: int = 60,
+        aurora: Optional[Dict[str, Any]] = None,
+        proxy: Optional[Dict[str, Any]] = None,
     ):
         super().__init__(scope, id_)
 
-        engine = rds.DatabaseInstanceEngine.postgres(
-            version=rds.PostgresEngineVersion.VER_14_3
-        )
+        instance_type = instance_type_for(instance_type, architecture)
+        if engine_version is None and aurora is not None:
+            engine_version = AURORA_POSTGRES_VERSION
+        elif engine_version is None:
+            engine_version = (
+                GRAVITON_POSTGRES_VERSION if is_graviton(instance_type) else "14.3"
+            )
 
-        sg_database = ec2.SecurityGroup(
+        self.sg_database = ec2.SecurityGroup(
             self,
             "valohai-sg-database",
             security_group_name="valohai-sg-database",
             vpc=vpc,
             allow_all_outbound=True,
         )
-        sg_database.add_ingress_rule(
+        self.sg_database.add_ingress_rule(
             ec2.Peer.security_group_id(sg_master.security_group_id),
             ec2.Port.tcp(5432),
             "Allow access from Valohai App (Roi)",
@@ -60,37 +194,345 @@ class Database(Construct):
 
         cluster_credentials = rds.Credentials.from_secret(db_password, "roi")
 
-        self.rds_instance = rds.DatabaseInstance(
+        self.rds_instance: Optional[rds.DatabaseInstance] = None
+        self.cluster: Optional[rds.DatabaseCluster] = None
+
+        if aurora is not None:
+            writer_endpoint, reader_endpoint = self._aurora_cluster(
+                vpc=vpc,
+                subnet_group=db_subnet_group,
+                credentials=cluster_credentials,
+                instance_type=instance_type,
+                engine_version=engine_version,
+                parameters=parameters or {},
+                performance_insights=performance_insights,
+                monitoring_interval=monitoring_interval,
+                options=aurora,
+            )
+        else:
+            engine = rds.DatabaseInstanceEngine.postgres(
+                version=rds.PostgresEngineVersion.of(
+                    engine_version, engine_version.split(".")[0]
+                )
+            )
+            db_parameters = {**postgres_parameters(instance_type), **(parameters or {})}
+            validate_postgres_settings(
+                instance_type,
+                db_parameters,
+                allocated_storage,
+                max_allocated_storage,
+                iops,
+                storage_throughput,
+            )
+            self.max_connections = int(db_parameters["max_connections"])
+
+            parameter_group = rds.ParameterGroup(
+                self,
+                "valohai-roidb-parameters",
+                engine=engine,
+                description=f"Valohai Roi Database parameters for {instance_type}",
+                parameters=db_parameters,
+            )
+
+            self.rds_instance = rds.DatabaseInstance(
+                self,
+                "roidb",
+                engine=engine,
+                instance_type=ec2.InstanceType(instance_type),
+                allocated_storage=allocated_storage,
+                max_allocated_storage=max_allocated_storage,
+                storage_type=rds.StorageType.GP3,
+                iops=iops,
+                storage_throughput=storage_throughput,
+                storage_encrypted=True,
+                multi_az=True,
+                publicly_accessible=False,
+                port=5432,
+                auto_minor_version_upgrade=True,
+                iam_authentication=True,
+                cloudwatch_logs_exports=["postgresql", "upgrade"],
+                copy_tags_to_snapshot=True,
+                parameter_group=parameter_group,
+                enable_performance_insights=performance_insights,
+                monitoring_interval=(
+                    cdk.Duration.seconds(monitoring_interval)
+                    if monitoring_interval
+                    else None
+                ),
+                database_name="roidb",
+                credentials=cluster_credentials,
+                vpc=vpc,
+                security_groups=[self.sg_database],
+                subnet_group=db_subnet_group,
+                preferred_maintenance_window="Mon:00:00-Mon:03:00",
+                preferred_backup_window="03:00-06:00",
+                backup_retention=cdk.Duration.days(5),
+                deletion_protection=True,
+            )
+            writer_endpoint = self.rds_instance.db_instance_endpoint_address
+            reader_endpoint = writer_endpoint
+
+        ssm.StringParameter(
+            self,
+            "valohai-db-url",
+            allowed_pattern=".*",
+            description="The URL for the Valohai Database",
+            parameter_name="valohai-db-url",
+            string_value=writer_endpoint,
+        )
+
+        # Read-only queries can go to Aurora readers. Without Aurora this is
+        # the primary, so Roi can always use both parameters.
+        ssm.StringParameter(
+            self,
+            "valohai-db-reader-url",
+            allowed_pattern=".*",
+            description="The read-only URL for the Valohai Database",
+            parameter_name="valohai-db-reader-url",
+            string_value=reader_endpoint,
+        )
+
+        self.proxy: Optional[rds.DatabaseProxy] = None
+        self.sg_proxy: Optional[ec2.SecurityGroup] = None
+        if proxy is not None:
+            self._proxy(
+                vpc=vpc,
+                subnets=subnets,
+                sg_master=sg_master,
+                secret=db_password,
+                options=proxy,
+            )
+
+    def _aurora_cluster(
+        self,
+        *,
+        vpc: ec2.IVpc,
+        subnet_group: rds.SubnetGroup,
+        credentials: rds.Credentials,
+        instance_type: str,
+        engine_version: str,
+        parameters: Dict[str, str],
+        performance_insights: bool,
+        monitoring_interval: int,
+        options: Dict[str, Any],
+    ) -> Tuple[str, str]:
+        """
+        Aurora PostgreSQL cluster with a writer and readers, either provisioned
+        or Serverless v2. Readers scale on CPU or connections when max_readers
+        is above readers.
+        """
+        engine = rds.DatabaseClusterEngine.aurora_postgres(
+            version=rds.AuroraPostgresEngineVersion.of(
+                engine_version, engine_version.split(".")[0]
+            )
+        )
+        min_capacity = options.get("min_capacity")
+        max_capacity = options.get("max_capacity")
+        if min_capacity is not None and max_capacity is None:
+            raise ValueError("aurora min_capacity needs max_capacity for Serverless v2")
+        readers = options.get("readers", 1)
+        max_readers = options.get("max_readers", readers)
+        if max_readers < readers:
+            raise ValueError("aurora max_readers must be at least readers")
+
+        if max_capacity is not None:
+            memory_mib = max_capacity * ACU_MEMORY_MIB
+
+            def cluster_instance(
+                id_: str, first_reader: bool = False
+            ) -> rds.IClusterInstance:
+                return rds.ClusterInstance.serverless_v2(
+                    id_,
+                    # The first reader is the failover target, keep it warm
+                    scale_with_writer=first_reader,
+                    enable_performance_insights=performance_insights,
+                    publicly_accessible=False,
+                )
+
+        else:
+            if instance_type.split(".")[0][0] not in AURORA_INSTANCE_FAMILIES:
+                raise ValueError(
+                    f"Aurora doesn't support {instance_type}, set "
+                    f"database.instance_type to an r, t or x instance class or "
+                    f"use Serverless v2 (max_capacity)"
+                )
+            memory_mib = instance_memory_mib(instance_type)
+
+            def cluster_instance(
+                id_: str, first_reader: bool = False
+            ) -> rds.IClusterInstance:
+                return rds.ClusterInstance.provisioned(
+                    id_,
+                    instance_type=ec2.InstanceType(instance_type),
+                    promotion_tier=1 if first_reader else 2,
+                    enable_performance_insights=performance_insights,
+                    publicly_accessible=False,
+                )
+
+        default_max_connections = min(
+            5000, memory_mib * 1024 * 1024 // AURORA_BYTES_PER_CONNECTION
+        )
+        db_parameters = {
+            **{
+                key: postgres_parameters(instance_type)[key]
+                for key in AURORA_PARAMETERS
+            },
+            "max_connections": str(default_max_connections),
+            **parameters,
+        }
+        self.max_connections = int(db_parameters["max_connections"])
+
+        parameter_group = rds.ParameterGroup(
             self,
-            "roidb",
+            "valohai-roidb-cluster-parameters",
             engine=engine,
-            instance_type=ec2.InstanceType("m5.xlarge"),
-            allocated_storage=20,
+            description="Valohai Roi Aurora cluster parameters",
+            parameters=db_parameters,
+        )
+
+        self.cluster = rds.DatabaseCluster(
+            self,
+            "roidb-cluster",
+            engine=engine,
+            writer=cluster_instance("writer"),
+            readers=[
+                cluster_instance(f"reader{index + 1}", first_reader=index == 0)
+                for index in range(readers)
+            ],
+            serverless_v2_min_capacity=min_capacity,
+            serverless_v2_max_capacity=max_capacity,
             storage_encrypted=True,
-            multi_az=True,
-            publicly_accessible=False,
             port=5432,
-            auto_minor_version_upgrade=True,
             iam_authentication=True,
-            cloudwatch_logs_exports=["postgresql", "upgrade"],
+            cloudwatch_logs_exports=["postgresql"],
             copy_tags_to_snapshot=True,
-            parameter_group=None,
-            database_name="roidb",
-            credentials=cluster_credentials,
+            parameter_group=parameter_group,
+            monitoring_interval=(
+                cdk.Duration.seconds(monitoring_interval)
+                if monitoring_interval
+                else None
+            ),
+            default_database_name="roidb",
+            credentials=credentials,
             vpc=vpc,
-            security_groups=[sg_database],
-            subnet_group=db_subnet_group,
+            security_groups=[self.sg_database],
+            subnet_group=subnet_group,
             preferred_maintenance_window="Mon:00:00-Mon:03:00",
-            preferred_backup_window="03:00-06:00",
-            backup_retention=cdk.Duration.days(5),
+            backup=rds.BackupProps(
+                retention=cdk.Duration.days(5), preferred_window="03:00-06:00"
+            ),
             deletion_protection=True,
         )
 
+        if max_readers > readers:
+            metric = options.get("reader_scaling_metric", "cpu")
+            if metric not in READER_SCALING_METRICS:
+                raise ValueError(
+                    f"Unknown aurora reader_scaling_metric {metric}, "
+                    f"use one of {', '.join(READER_SCALING_METRICS)}"
+                )
+            default_target = 70 if metric == "cpu" else self.max_connections * 0.7
+            reader_scaling = appscaling.ScalableTarget(
+                self,
+                "valohai-roidb-readers",
+                service_namespace=appscaling.ServiceNamespace.RDS,
+                scalable_dimension="rds:cluster:ReadReplicaCount",
+                resource_id=f"cluster:{self.cluster.cluster_identifier}",
+                min_capacity=readers,
+                max_capacity=max_readers,
+            )
+            reader_scaling.scale_to_track_metric(
+                "valohai-roidb-reader-scaling",
+                predefined_metric=READER_SCALING_METRICS[metric],
+                target_value=options.get("reader_scaling_target", default_target),
+                scale_in_cooldown=cdk.Duration.minutes(10),
+                scale_out_cooldown=cdk.Duration.minutes(3),
+            )
+
+        return (
+            self.cluster.cluster_endpoint.hostname,
+            self.cluster.cluster_read_endpoint.hostname,
+        )
+
+    def _proxy(
+        self,
+        *,
+        vpc: ec2.IVpc,
+        subnets: ec2.SubnetSelection,
+        sg_master: ec2.ISecurityGroup,
+        secret: secretsmanager.Secret,
+        options: Dict[str, Any],
+    ) -> None:
+        """
+        RDS Proxy pooling the connections of all Roi processes and instances,
+        so restarts and scale-outs don't exhaust max_connections.
+        """
+        self.sg_proxy = ec2.SecurityGroup(
+            self,
+            "valohai-sg-db-proxy",
+            security_group_name="valohai-sg-db-proxy",
+            vpc=vpc,
+            allow_all_outbound=True,
+        )
+        self.sg_proxy.add_ingress_rule(
+            ec2.Peer.security_group_id(sg_master.security_group_id),
+            ec2.Port.tcp(5432),
+            "Allow access from Valohai App (Roi)",
+        )
+
+        # The proxy target opens the database security group to the proxy
+        if self.cluster:
+            proxy_target = rds.ProxyTarget.from_cluster(self.cluster)
+        else:
+            assert self.rds_instance is not None
+            proxy_target = rds.ProxyTarget.from_instance(self.rds_instance)
+
+        self.proxy = rds.DatabaseProxy(
+            self,
+            "valohai-db-proxy",
+            db_proxy_name="valohai-db-proxy",
+            proxy_target=proxy_target,
+            secrets=[secret],
+            vpc=vpc,
+            vpc_subnets=subnets,
+            security_groups=[self.sg_proxy],
+            borrow_timeout=cdk.Duration.seconds(options.get("borrow_timeout", 120)),
+            # Leave room for direct admin and migration connections
+            max_connections_percent=options.get("max_connections_percent", 90),
+            max_idle_connections_percent=options.get(
+                "max_idle_connections_percent", 50
+            ),
+            # Roi negotiates TLS when the server offers it
+            require_tls=False,
+        )
+        reader_endpoint = self.proxy.endpoint
+
+        if self.cluster:
+            # Aurora readers get their own read-only proxy endpoint
+            read_only = rds.CfnDBProxyEndpoint(
+                self,
+                "valohai-db-proxy-reader",
+                db_proxy_endpoint_name="valohai-db-proxy-reader",
+                db_proxy_name=self.proxy.db_proxy_name,
+                vpc_subnet_ids=[subnet.subnet_id for subnet in subnets.subnets or []],
+                vpc_security_group_ids=[self.sg_proxy.security_group_id],
+                target_role="READ_ONLY",
+            )
+            reader_endpoint = read_only.attr_endpoint
+
         ssm.StringParameter(
             self,
-            "valohai-db-url",
+            "valohai-db-proxy-url",
             allowed_pattern=".*",
-            description="The URL for the Valohai Database",
-            parameter_name="valohai-db-url",
-            string_value=self.rds_instance.db_instance_endpoint_address,
+            description="The URL for the Valohai Database proxy",
+            parameter_name="valohai-db-proxy-url",
+            string_value=self.proxy.endpoint,
+        )
+        ssm.StringParameter(
+            self,
+            "valohai-db-proxy-reader-url",
+            allowed_pattern=".*",
+            description="The read-only URL for the Valohai Database proxy",
+            parameter_name="valohai-db-proxy-reader-url",
+            string_value=reader_endpoint,
         )
@@ -1,8 +1,25 @@
+from typing import Any, Dict, List, Optional, Union
+
 import aws_cdk.aws_ec2 as ec2
 import aws_cdk.aws_elasticache as elasticache
 import aws_cdk.aws_ssm as ssm
 from constructs import Construct
 
+from backend.architecture import instance_type_for
+
+# Celery must never lose broker messages to eviction
+DEFAULT_REDIS_PARAMETERS = {
+    "maxmemory-policy": "noeviction",
+    "tcp-keepalive": "60",
+}
+
+# Under memory pressure the log store may drop expiring log keys instead of
+# rejecting writes from running executions
+LOGS_REDIS_PARAMETERS = {
+    **DEFAULT_REDIS_PARAMETERS,
+    "maxmemory-policy": "volatile-lru",
+}
+
 
 class Queue(Construct):
     def __init__(
@@ -10,15 +27,21 @@ class Queue(Construct):
         scope: Construct,
         id_: str,
         *,
-        vpc: ec2.Vpc,
+        vpc: ec2.IVpc,
         subnet_ids: str,
-        sg_master: ec2.SecurityGroup,
-        sg_workers: ec2.SecurityGroup
+        sg_master: ec2.ISecurityGroup,
+        sg_workers: ec2.ISecurityGroup,
+        node_type: str = "cache.m5.xlarge",
+        architecture: str = "x86_64",
+        engine_version: str = "7.1",
+        replicas: int = 0,
+        parameters: Optional[Dict[str, str]] = None,
+        logs: Optional[Dict[str, Any]] = None,
     ):
         super().__init__(scope, id_)
 
         # Valohai SG Queue
-        sg_redis_queue = ec2.SecurityGroup(
+        self.sg_redis_queue = ec2.SecurityGroup(
             self,
             "valohai-sg-queue",
             security_group_name="valohai-sg-queue",
@@ -28,19 +51,19 @@ class Queue(Construct):
         )
 
         # Allow connections from Roi
-        sg_redis_queue.add_ingress_rule(
+        self.sg_redis_queue.add_ingress_rule(
             ec2.Peer.security_group_id(sg_master.security_group_id),
             ec2.Port.tcp(6379),
             description="Allow access from roi",
         )
         # Allow connections from workers
-        sg_redis_queue.add_ingress_rule(
+        self.sg_redis_queue.add_ingress_rule(
             ec2.Peer.security_group_id(sg_workers.security_group_id),
             ec2.Port.tcp(6379),
             description="Allow access from workers",
         )
 
-        cache_subnet_group = elasticache.CfnSubnetGroup(
+        self.cache_subnet_group = elasticache.CfnSubnetGroup(
             scope=self,
             cache_subnet_group_name="valohai-redis-cache-subnet-group",
             id="valohai_redis_cache_subnet_group",
@@ -48,27 +71,138 @@ class Queue(Construct):
             description="Subnet Group for Redis job queue in Valohai",
         )
 
-        self.redis_cluster = elasticache.CfnCacheCluster(
-            scope=self,
-            id="valohai-queue-redis",
-            cluster_name="valohai-queue-redis",
-            engine="redis",
-            cache_node_type="cache.m5.xlarge",
-            num_cache_nodes=1,
-            engine_version="6.2",
-            snapshot_retention_limit=5,
-            cache_subnet_group_name=cache_subnet_group.cache_subnet_group_name,
-            vpc_security_group_ids=[sg_redis_queue.security_group_id],
+        # CloudWatch reports Redis metrics per cache node
+        self.cache_cluster_ids: List[str] = []
+        self.redis_cluster = self._redis(
+            "valohai-queue-redis",
+            description="The URL for the Valohai Redis Queue",
+            url_parameter_name="valohai-redis-url",
+            reader_url_parameter_name="valohai-redis-reader-url",
+            node_type=instance_type_for(node_type, architecture),
+            engine_version=engine_version,
+            replicas=replicas,
+            parameters={**DEFAULT_REDIS_PARAMETERS, **(parameters or {})},
         )
+        self.broker_cache_cluster_ids = list(self.cache_cluster_ids)
+
+        # Real-time execution logs go to a separate cluster when configured, so
+        # a job flooding logs can't delay job dispatch on the broker
+        self.logs_cluster: Optional[
+            Union[elasticache.CfnCacheCluster, elasticache.CfnReplicationGroup]
+        ] = None
+        if logs is not None:
+            self.logs_cluster = self._redis(
+                "valohai-logs-redis",
+                description="The URL for the Valohai Redis log store",
+                url_parameter_name="valohai-redis-logs-url",
+                reader_url_parameter_name="valohai-redis-logs-reader-url",
+                node_type=instance_type_for(
+                    logs.get("node_type", "cache.r6g.xlarge"), architecture
+                ),
+                engine_version=logs.get("engine_version", engine_version),
+                replicas=logs.get("replicas", 0),
+                parameters={**LOGS_REDIS_PARAMETERS, **logs.get("parameters", {})},
+            )
+        else:
+            ssm.StringParameter(
+                self,
+                "valohai-redis-logs-url",
+                allowed_pattern=".*",
+                description="The URL for the Valohai Redis log store (the queue)",
+                parameter_name="valohai-redis-logs-url",
+                string_value=self._url(self.redis_cluster),
+            )
+
+    def _redis(
+        self,
+        name: str,
+        *,
+        description: str,
+        url_parameter_name: str,
+        reader_url_parameter_name: str,
+        node_type: str,
+        engine_version: str,
+        replicas: int,
+        parameters: Dict[str, str],
+    ) -> Union[elasticache.CfnCacheCluster, elasticache.CfnReplicationGroup]:
+        major_version = engine_version.split(".")[0]
+        parameter_group = elasticache.CfnParameterGroup(
+            self,
+            f"{name}-parameters",
+            cache_parameter_group_family=(
+                "redis6.x" if major_version == "6" else f"redis{major_version}"
+            ),
+            description=f"Parameters for {name}",
+            properties=parameters,
+        )
+
+        redis: Union[elasticache.CfnCacheCluster, elasticache.CfnReplicationGroup]
+        if replicas:
+            redis = elasticache.CfnReplicationGroup(
+                scope=self,
+                id=name,
+                replication_group_id=name,
+                replication_group_description=f"Valohai {name}",
+                engine="redis",
+                engine_version=engine_version,
+                cache_node_type=node_type,
+                cache_parameter_group_name=parameter_group.ref,
+                num_node_groups=1,
+                replicas_per_node_group=replicas,
+                automatic_failover_enabled=True,
+                multi_az_enabled=True,
+                snapshot_retention_limit=5,
+                cache_subnet_group_name=self.cache_subnet_group.cache_subnet_group_name,
+                security_group_ids=[self.sg_redis_queue.security_group_id],
+            )
+            reader_url = redis.attr_reader_end_point_address
+            self.cache_cluster_ids.extend(
+                f"{name}-{node:03}" for node in range(1, replicas + 2)
+            )
+        else:
+            redis = elasticache.CfnCacheCluster(
+                scope=self,
+                id=name,
+                cluster_name=name,
+                engine="redis",
+                cache_node_type=node_type,
+                num_cache_nodes=1,
+                engine_version=engine_version,
+                cache_parameter_group_name=parameter_group.ref,
+                snapshot_retention_limit=5,
+                cache_subnet_group_name=self.cache_subnet_group.cache_subnet_group_name,
+                vpc_security_group_ids=[self.sg_redis_queue.security_group_id],
+            )
+            reader_url = redis.attr_redis_endpoint_address
+            self.cache_cluster_ids.append(name)
 
         # https://github.com/aws/aws-cdk/issues/6935#issuecomment-612637197
-        self.redis_cluster.add_dependency(cache_subnet_group)
+        redis.add_dependency(self.cache_subnet_group)
 
         ssm.StringParameter(
             self,
-            "valohai-redis-url",
+            url_parameter_name,
             allowed_pattern=".*",
-            description="The URL for the Valohai Redis Queue",
-            parameter_name="valohai-redis-url",
-            string_value=self.redis_cluster.attr_redis_endpoint_address,
+            description=description,
+            parameter_name=url_parameter_name,
+            string_value=self._url(redis),
+        )
+
+        ssm.StringParameter(
+            self,
+            reader_url_parameter_name,
+            allowed_pattern=".*",
+            description=f"{description} (read replicas)",
+            parameter_name=reader_url_parameter_name,
+            string_value=reader_url,
         )
+
+        return redis
+
+    @staticmethod
+    def _url(
+        redis: Union[elasticache.CfnCacheCluster, elasticache.CfnReplicationGroup]
+    ) -> str:
+        if isinstance(redis, elasticache.CfnReplicationGroup):
+            return redis.attr_primary_end_point_address
+        return redis.attr_redis_endpoint_address
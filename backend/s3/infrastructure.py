@@ -1,5 +1,10 @@
+from typing import List
+
+import aws_cdk.aws_iam as iam
 import aws_cdk.aws_s3 as s3
+from aws_cdk import Duration
 from aws_cdk import RemovalPolicy
+from aws_cdk import Stack
 from constructs import Construct
 
 
@@ -22,3 +27,56 @@ class Bucket(Construct):
             block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
             removal_policy=RemovalPolicy.RETAIN,
         )
+
+    def allow_cloudfront_reads(self, paths: List[str]) -> None:
+        """
+        Let the CDN read artifacts with origin access control. The distribution
+        is in the stateless stack, so match any distribution in the account
+        instead of referencing it from here.
+        """
+        distribution_arns = Stack.of(self).format_arn(
+            service="cloudfront",
+            region="",
+            resource="distribution",
+            resource_name="*",
+        )
+        self.bucket.add_to_resource_policy(
+            iam.PolicyStatement(
+                sid="AllowCloudFrontArtifactReads",
+                actions=["s3:GetObject"],
+                principals=[iam.ServicePrincipal("cloudfront.amazonaws.com")],
+                resources=[
+                    self.bucket.arn_for_objects(path.lstrip("/")) for path in paths
+                ],
+                conditions={"ArnLike": {"AWS:SourceArn": distribution_arns}},
+            )
+        )
+
+
+class LogsBucket(Construct):
+    def __init__(
+        self,
+        scope: Construct,
+        id_: str,
+        *,
+        bucket_name: str,
+        expiration_days: int = 30,
+    ):
+        super().__init__(scope, id_)
+
+        # Load balancer access logs only support S3 managed encryption
+        self.bucket = s3.Bucket(
+            self,
+            "valohai-logs-bucket",
+            bucket_name=bucket_name,
+            encryption=s3.BucketEncryption.S3_MANAGED,
+            block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+            enforce_ssl=True,
+            lifecycle_rules=[
+                s3.LifecycleRule(
+                    expiration=Duration.days(expiration_days),
+                    abort_incomplete_multipart_upload_after=Duration.days(1),
+                )
+            ],
+            removal_policy=RemovalPolicy.RETAIN,
+        )
@@ -0,0 +1,282 @@
+"""
+Capacity planning for the Roi, database and Redis tiers.
+
+The sizing section of config.yaml either names a profile or describes the
+expected load, and apply_sizing fills in the roi, database and redis sections
+from it. Values set explicitly in those sections always win, and the values
+derived from them follow: a pinned allocated_storage below the gp3 minimum
+drops the derived iops.
+"""
+import math
+from typing import Any, Dict, List, Tuple
+
+from backend.postgres.infrastructure import GP3_PROVISIONED_MIN_STORAGE
+from backend.postgres.infrastructure import instance_memory_mib
+
+# Explanation of a derived value, as (path of the key in its section, reason)
+Reason = Tuple[Tuple[str, ...], str]
+
+PROFILES: Dict[str, Dict[str, Any]] = {
+    "small": {
+        "concurrent_executions": 20,
+        "log_lines_per_second": 200,
+        "active_users": 20,
+        "retained_executions": 100_000,
+    },
+    "medium": {
+        "concurrent_executions": 100,
+        "log_lines_per_second": 1_000,
+        "active_users": 100,
+        "retained_executions": 1_000_000,
+    },
+    "large": {
+        "concurrent_executions": 500,
+        "log_lines_per_second": 10_000,
+        "active_users": 500,
+        "retained_executions": 5_000_000,
+    },
+    "xlarge": {
+        "concurrent_executions": 2_000,
+        "log_lines_per_second": 50_000,
+        "active_users": 2_000,
+        "retained_executions": 20_000_000,
+    },
+}
+
+INSTANCE_SIZES = ["large", "xlarge", "2xlarge", "4xlarge", "8xlarge"]
+VCPUS = {"large": 2, "xlarge": 4, "2xlarge": 8, "4xlarge": 16, "8xlarge": 32}
+
+# Usable memory (GiB) of ElastiCache node types
+REDIS_NODE_MEMORY = {
+    "cache.m5.large": 6.38,
+    "cache.m5.xlarge": 12.93,
+    "cache.m5.2xlarge": 26.04,
+    "cache.m5.4xlarge": 52.26,
+    "cache.r6g.large": 13.07,
+    "cache.r6g.xlarge": 26.32,
+    "cache.r6g.2xlarge": 52.82,
+    "cache.r6g.4xlarge": 105.81,
+}
+
+# Load model. Each Roi vCPU serves about 50 active users or 200 running
+# executions; each execution keeps about 100 KiB of rows and indexes in the
+# database and does about 5 IOPS while it runs. Log lines average 200 bytes
+# and stay in Redis for up to an hour before they are persisted to S3.
+USERS_PER_ROI_VCPU = 50
+EXECUTIONS_PER_ROI_VCPU = 200
+DB_KIB_PER_EXECUTION = 100
+DB_IOPS_PER_EXECUTION = 5
+GP3_BASELINE_IOPS = 3000
+LOG_LINE_BYTES = 200
+LOG_RETENTION_SECONDS = 3600
+# Separate the log store from the broker above this log rate
+LOGS_CLUSTER_LINES_PER_SECOND = 1000
+
+
+def smallest_size(vcpus: float) -> str:
+    for size in INSTANCE_SIZES:
+        if VCPUS[size] >= vcpus:
+            return size
+    return INSTANCE_SIZES[-1]
+
+
+def smallest_redis_node(family: str, memory_gib: float) -> str:
+    # Keep a quarter of the node free for replication and fragmentation
+    nodes = [node for node in REDIS_NODE_MEMORY if node.startswith(f"cache.{family}.")]
+    for node in nodes:
+        if REDIS_NODE_MEMORY[node] * 0.75 >= memory_gib:
+            return node
+    return nodes[-1]
+
+
+def merge(base: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge sections key by key, so an override doesn't drop its siblings."""
+    merged = dict(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def is_pinned(section: Dict[str, Any], path: Tuple[str, ...]) -> bool:
+    for key in path:
+        if not isinstance(section, dict) or key not in section:
+            return False
+        section = section[key]
+    return True
+
+
+def size_roi(
+    load: Dict[str, Any], pinned: Dict[str, Any]
+) -> Tuple[Dict[str, Any], List[Reason]]:
+    user_vcpus = load["active_users"] / USERS_PER_ROI_VCPU
+    execution_vcpus = load["concurrent_executions"] / EXECUTIONS_PER_ROI_VCPU
+    vcpus = max(2, user_vcpus + execution_vcpus)
+    instance_type = f"m5a.{smallest_size(vcpus)}"
+    return {"instance_type": instance_type}, [
+        (
+            ("instance_type",),
+            f"{instance_type}: {math.ceil(vcpus)} vCPUs for "
+            f"{load['active_users']} users and {load['concurrent_executions']} "
+            "concurrent executions",
+        )
+    ]
+
+
+def size_database(
+    load: Dict[str, Any], pinned: Dict[str, Any]
+) -> Tuple[Dict[str, Any], List[Reason]]:
+    data_gib = load["retained_executions"] * DB_KIB_PER_EXECUTION / 1024**2
+    vcpus = max(2, load["concurrent_executions"] / 50 + load["active_users"] / 100)
+    # Most queries touch recent executions, so keep about an eighth in memory
+    memory_gib = max(8, data_gib / 8)
+
+    size = smallest_size(vcpus)
+    # Memory-bound databases move to the r5 family, then up in size
+    family = "m5"
+    if instance_memory_mib(f"{family}.{size}") / 1024 < memory_gib:
+        family = "r5"
+        larger_sizes = INSTANCE_SIZES[INSTANCE_SIZES.index(size) :]
+        size = next(
+            (
+                s
+                for s in larger_sizes
+                if instance_memory_mib(f"r5.{s}") / 1024 >= memory_gib
+            ),
+            larger_sizes[-1],
+        )
+    instance_type = f"{family}.{size}"
+
+    # Leave room for WAL and bloat, storage autoscaling handles growth
+    allocated_storage = max(20, math.ceil(data_gib * 1.25))
+    iops = load["concurrent_executions"] * DB_IOPS_PER_EXECUTION
+    needs_iops = iops > GP3_BASELINE_IOPS * 0.8
+    # Provisioned IOPS and throughput, derived or pinned, need a minimum
+    # storage, but a pinned allocated_storage wins
+    if needs_iops or pinned.get("iops") or pinned.get("storage_throughput"):
+        allocated_storage = max(allocated_storage, GP3_PROVISIONED_MIN_STORAGE)
+    allocated_storage = pinned.get("allocated_storage", allocated_storage)
+
+    settings: Dict[str, Any] = {
+        "instance_type": instance_type,
+        "allocated_storage": allocated_storage,
+        "max_allocated_storage": allocated_storage * 4,
+    }
+    reasons: List[Reason] = [
+        (
+            ("instance_type",),
+            f"{instance_type}: {math.ceil(vcpus)} vCPUs and "
+            f"{math.ceil(memory_gib)} GiB memory for {data_gib:.0f} GiB of data",
+        ),
+        (("allocated_storage",), f"{allocated_storage} GB"),
+        (
+            ("max_allocated_storage",),
+            f"{allocated_storage * 4} GB of storage autoscaling for growth",
+        ),
+    ]
+    if needs_iops:
+        if allocated_storage >= GP3_PROVISIONED_MIN_STORAGE:
+            settings["iops"] = max(12000, math.ceil(iops / 1000) * 1000)
+            reasons.append(
+                (
+                    ("iops",),
+                    f"{settings['iops']}: {iops} IOPS at peak is close to the "
+                    f"gp3 baseline of {GP3_BASELINE_IOPS}",
+                )
+            )
+        else:
+            reasons.append(
+                (
+                    ("iops",),
+                    f"not provisioned: {iops} IOPS at peak is close to the gp3 "
+                    f"baseline of {GP3_BASELINE_IOPS}, but provisioned IOPS need "
+                    f"{GP3_PROVISIONED_MIN_STORAGE} GB of allocated_storage",
+                )
+            )
+    return settings, reasons
+
+
+def size_redis(
+    load: Dict[str, Any], pinned: Dict[str, Any]
+) -> Tuple[Dict[str, Any], List[Reason]]:
+    log_bytes = load["log_lines_per_second"] * LOG_LINE_BYTES * LOG_RETENTION_SECONDS
+    log_gib = log_bytes / 1024**3
+    # Broker messages are small, a replica keeps dispatch running on failover
+    replicas = 1 if load["concurrent_executions"] >= 100 else 0
+    settings: Dict[str, Any] = {"replicas": replicas}
+    availability = "Multi-AZ failover" if replicas else "single node"
+    reasons: List[Reason] = [
+        (
+            ("replicas",),
+            f"{replicas}: {availability} for "
+            f"{load['concurrent_executions']} concurrent executions",
+        )
+    ]
+
+    if load["log_lines_per_second"] > LOGS_CLUSTER_LINES_PER_SECOND:
+        settings["node_type"] = "cache.m5.large"
+        logs_node_type = smallest_redis_node("r6g", log_gib)
+        # The logs cluster follows the availability of the broker
+        logs_replicas = pinned.get("replicas", replicas)
+        settings["logs"] = {"node_type": logs_node_type, "replicas": logs_replicas}
+        reasons.append(
+            (
+                ("logs", "node_type"),
+                f"{logs_node_type}: {log_gib:.1f} GiB of logs at "
+                f"{load['log_lines_per_second']} lines/s kept in a separate cluster",
+            )
+        )
+        reasons.append((("logs", "replicas"), f"{logs_replicas}: same as the broker"))
+        reasons.append((("node_type",), "cache.m5.large: broker only"))
+    else:
+        settings["node_type"] = smallest_redis_node("m5", log_gib + 1)
+        reasons.append(
+            (
+                ("node_type",),
+                f"{settings['node_type']}: broker and {log_gib:.1f} GiB of logs "
+                f"at {load['log_lines_per_second']} lines/s",
+            )
+        )
+    return settings, reasons
+
+
+def apply_sizing(config: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Return the config with the roi, database and redis sections sized from
+    its sizing section, and an explanation for every derived value.
+    """
+    sizing = config.get("sizing")
+    if sizing is None:
+        return config, []
+
+    profile = sizing.get("profile")
+    if profile is not None and profile not in PROFILES:
+        raise ValueError(
+            f"Unknown sizing profile {profile}, use one of {', '.join(PROFILES)}"
+        )
+    load = {
+        **PROFILES[profile or "medium"],
+        **{key: value for key, value in sizing.items() if key != "profile"},
+    }
+    unknown = set(load) - set(PROFILES["medium"])
+    if unknown:
+        raise ValueError(f"Unknown sizing parameters: {sorted(unknown)}")
+
+    sized = dict(config)
+    explanations: List[str] = []
+    for section, size in (
+        ("roi", size_roi),
+        ("database", size_database),
+        ("redis", size_redis),
+    ):
+        pinned = config.get(section) or {}
+        settings, reasons = size(load, pinned)
+        sized[section] = merge(settings, pinned)
+        for path, reason in reasons:
+            explanation = f"{section}.{'.'.join(path)} = {reason}"
+            if is_pinned(pinned, path):
+                explanation += " (overridden by config.yaml)"
+            explanations.append(explanation)
+    return sized, explanations
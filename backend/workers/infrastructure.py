@@ -0,0 +1,286 @@
+from typing import Any, Dict, List, Optional
+
+import aws_cdk.aws_autoscaling as autoscaling
+import aws_cdk.aws_ec2 as ec2
+import aws_cdk.aws_iam as iam
+from aws_cdk import Stack
+from aws_cdk import Tags
+from constructs import Construct
+
+# Instance families with Elastic Fabric Adapter support. Within a family only
+# the largest sizes have EFA, EC2 rejects launches on the others.
+EFA_FAMILIES = {
+    "c5n",
+    "c6gn",
+    "c6in",
+    "c7g",
+    "c7gn",
+    "c7i",
+    "dl1",
+    "g4dn",
+    "g5",
+    "g6",
+    "hpc6a",
+    "hpc6id",
+    "hpc7a",
+    "hpc7g",
+    "i4i",
+    "inf1",
+    "inf2",
+    "m5dn",
+    "m5n",
+    "m6i",
+    "m6in",
+    "m7i",
+    "p3dn",
+    "p4d",
+    "p4de",
+    "p5",
+    "r5dn",
+    "r5n",
+    "r6i",
+    "r6in",
+    "r7i",
+    "trn1",
+    "trn1n",
+}
+
+SPOT_ALLOCATION_STRATEGIES = {
+    "lowest-price": autoscaling.SpotAllocationStrategy.LOWEST_PRICE,
+    "capacity-optimized": autoscaling.SpotAllocationStrategy.CAPACITY_OPTIMIZED,
+    "capacity-optimized-prioritized": autoscaling.SpotAllocationStrategy.CAPACITY_OPTIMIZED_PRIORITIZED,
+    "price-capacity-optimized": autoscaling.SpotAllocationStrategy.PRICE_CAPACITY_OPTIMIZED,
+}
+
+
+class Workers(Construct):
+    def __init__(
+        self,
+        scope: Construct,
+        id_: str,
+        *,
+        vpc: ec2.IVpc,
+        subnets: ec2.SubnetSelection,
+        security_group: ec2.ISecurityGroup,
+        iam_role: iam.Role,
+        queues: List[Dict[str, Any]],
+        ami_parameter: Optional[str] = None,
+    ):
+        super().__init__(scope, id_)
+
+        self.ami_parameter = ami_parameter
+
+        with open(
+            "backend/workers/worker_user_data.sh", encoding="UTF-8"
+        ) as user_data_file:
+            self.worker_user_data = user_data_file.read()
+
+        self.launch_templates: Dict[str, ec2.LaunchTemplate] = {}
+        self.auto_scaling_groups: Dict[str, autoscaling.AutoScalingGroup] = {}
+
+        # Multi-node training (NCCL, Horovod, EFA) needs workers to reach each
+        # other on any port
+        if any(queue.get("placement_group") or queue.get("efa") for queue in queues):
+            security_group.add_ingress_rule(
+                ec2.Peer.security_group_id(security_group.security_group_id),
+                ec2.Port.all_traffic(),
+                "Allow traffic between workers for distributed training",
+            )
+            # EFA also needs an egress rule to the group itself, which the
+            # all-outbound security group doesn't let CDK add
+            ec2.CfnSecurityGroupEgress(
+                self,
+                "valohai-sg-workers-self-egress",
+                group_id=security_group.security_group_id,
+                ip_protocol="-1",
+                destination_security_group_id=security_group.security_group_id,
+                description="Allow traffic between workers for distributed training",
+            )
+
+        for queue in queues:
+            name = queue["name"]
+            launch_template = self._launch_template(
+                queue, security_group=security_group, iam_role=iam_role
+            )
+            self.launch_templates[name] = launch_template
+
+            queue_subnets = subnets
+            if queue.get("placement_group"):
+                # A cluster placement group lives in a single availability zone
+                subnet_id = queue.get("subnet_id")
+                queue_subnets = ec2.SubnetSelection(
+                    subnets=[
+                        subnet
+                        for subnet in subnets.subnets or []
+                        if subnet_id in (None, subnet.subnet_id)
+                    ][:1]
+                )
+            self.auto_scaling_groups[name] = self._auto_scaling_group(
+                queue, vpc=vpc, subnets=queue_subnets, launch_template=launch_template
+            )
+
+    def _launch_template(
+        self,
+        queue: Dict[str, Any],
+        *,
+        security_group: ec2.ISecurityGroup,
+        iam_role: iam.Role,
+    ) -> ec2.LaunchTemplate:
+        name = queue["name"]
+
+        if "ami_id" in queue:
+            machine_image = ec2.MachineImage.generic_linux(
+                {Stack.of(self).region: queue["ami_id"]}
+            )
+        elif self.ami_parameter:
+            # Resolved on every launch, so a new baked AMI applies without a deploy
+            machine_image = ec2.MachineImage.generic_linux(
+                {Stack.of(self).region: f"resolve:ssm:{self.ami_parameter}"}
+            )
+        else:
+            # Workers need Docker, the AWS CLI and the Valohai agent, which
+            # stock images don't have
+            raise ValueError(
+                f"Worker queue {name}: set ami_id to an AMI with the Valohai "
+                f"agent installed, or enable worker_image to build one"
+            )
+
+        user_data = ec2.UserData.for_linux()
+        user_data.add_commands(f"export VALOHAI_QUEUE={name}", self.worker_user_data)
+
+        launch_template = ec2.LaunchTemplate(
+            self,
+            f"valohai-lt-{name}",
+            launch_template_name=f"valohai-lt-{name}",
+            machine_image=machine_image,
+            instance_type=ec2.InstanceType(queue["instance_types"][0]),
+            security_group=security_group,
+            role=iam_role,
+            block_devices=[
+                ec2.BlockDevice(
+                    device_name="/dev/sda1",
+                    volume=ec2.BlockDeviceVolume.ebs(
+                        queue.get("volume_size", 100),
+                        volume_type=ec2.EbsDeviceVolumeType.GP3,
+                        encrypted=True,
+                    ),
+                )
+            ],
+            require_imdsv2=True,
+            # Allow containers running on the worker to reach the metadata service
+            http_put_response_hop_limit=2,
+            user_data=user_data,
+        )
+        cfn_launch_template = launch_template.node.default_child
+        assert isinstance(cfn_launch_template, ec2.CfnLaunchTemplate)
+
+        if queue.get("placement_group"):
+            placement_group = ec2.CfnPlacementGroup(
+                self,
+                f"valohai-pg-{name}",
+                strategy="cluster",
+            )
+            # This CDK version can't set a placement group on launch templates
+            cfn_launch_template.add_property_override(
+                "LaunchTemplateData.Placement.GroupName", placement_group.ref
+            )
+
+        if queue.get("efa"):
+            families = {
+                instance_type.split(".")[0] for instance_type in queue["instance_types"]
+            }
+            if not families <= EFA_FAMILIES:
+                raise ValueError(
+                    f"Worker queue {name}: {', '.join(sorted(families - EFA_FAMILIES))} "
+                    f"instances don't support EFA"
+                )
+            # EFA is an interface type, so the security group moves from the
+            # launch template onto the network interface
+            cfn_launch_template.add_property_deletion_override(
+                "LaunchTemplateData.SecurityGroupIds"
+            )
+            cfn_launch_template.add_property_override(
+                "LaunchTemplateData.NetworkInterfaces",
+                [
+                    {
+                        "DeviceIndex": 0,
+                        "InterfaceType": "efa",
+                        "Groups": [security_group.security_group_id],
+                        "DeleteOnTermination": True,
+                    }
+                ],
+            )
+
+        return launch_template
+
+    def _auto_scaling_group(
+        self,
+        queue: Dict[str, Any],
+        *,
+        vpc: ec2.IVpc,
+        subnets: ec2.SubnetSelection,
+        launch_template: ec2.LaunchTemplate,
+    ) -> autoscaling.AutoScalingGroup:
+        name = queue["name"]
+        instance_types = queue["instance_types"]
+        warm_pool_size = queue.get("warm_pool_size", 0)
+        on_demand_base_capacity = queue.get("on_demand_base_capacity", 0)
+        on_demand_percentage = queue.get("on_demand_percentage", 0)
+        uses_spot = on_demand_percentage < 100
+
+        # EC2 doesn't allow warm pools on groups with a mixed instances policy
+        if warm_pool_size and (len(instance_types) > 1 or uses_spot):
+            raise ValueError(
+                f"Worker queue {name}: warm pools require a single instance type "
+                f"with on_demand_percentage set to 100"
+            )
+
+        mixed_instances_policy = None
+        if not warm_pool_size:
+            mixed_instances_policy = autoscaling.MixedInstancesPolicy(
+                launch_template=launch_template,
+                launch_template_overrides=[
+                    autoscaling.LaunchTemplateOverrides(
+                        instance_type=ec2.InstanceType(instance_type)
+                    )
+                    for instance_type in instance_types
+                ],
+                instances_distribution=autoscaling.InstancesDistribution(
+                    on_demand_base_capacity=on_demand_base_capacity,
+                    on_demand_percentage_above_base_capacity=on_demand_percentage,
+                    spot_allocation_strategy=SPOT_ALLOCATION_STRATEGIES[
+                        queue.get(
+                            "spot_allocation_strategy", "price-capacity-optimized"
+                        )
+                    ],
+                ),
+            )
+
+        auto_scaling_group = autoscaling.AutoScalingGroup(
+            self,
+            f"valohai-asg-{name}",
+            auto_scaling_group_name=f"valohai-workers-{name}",
+            vpc=vpc,
+            vpc_subnets=subnets,
+            launch_template=None if mixed_instances_policy else launch_template,
+            mixed_instances_policy=mixed_instances_policy,
+            min_capacity=queue.get("min_size", 0),
+            max_capacity=queue.get("max_size", 10),
+            desired_capacity=queue.get("desired_size"),
+            capacity_rebalance=uses_spot and not warm_pool_size,
+            group_metrics=[autoscaling.GroupMetrics.all()],
+        )
+
+        if warm_pool_size:
+            auto_scaling_group.add_warm_pool(
+                min_size=warm_pool_size,
+                max_group_prepared_capacity=queue.get("warm_pool_max_prepared"),
+                pool_state=autoscaling.PoolState.STOPPED,
+                reuse_on_scale_in=True,
+            )
+
+        # Roi is only allowed to manage resources tagged with Valohai=1
+        Tags.of(auto_scaling_group).add("Valohai", "1")
+        Tags.of(auto_scaling_group).add("valohai-queue", name)
+
+        return auto_scaling_group
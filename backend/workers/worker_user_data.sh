@@ -0,0 +1,30 @@
+# Runs once on first boot. Instances launched into a warm pool run this before
+# they are stopped into the pool, and peon starts when they resume.
+
+set -e
+
+IMDS=http://169.254.169.254/latest
+TOKEN=`curl -s -X PUT "$IMDS/api/token" -H "X-aws-ec2-metadata-token-ttl-seconds: 21600"`
+export AWS_REGION=`curl -s -H "X-aws-ec2-metadata-token: $TOKEN" $IMDS/meta-data/placement/region`
+export REDIS_URL=`aws ssm get-parameter --region $AWS_REGION --name valohai-redis-url --query Parameter.Value --output text`
+# Points to the queue cluster unless redis.logs is set
+export REDIS_LOGS_URL=`aws ssm get-parameter --region $AWS_REGION --name valohai-redis-logs-url --query Parameter.Value --output text`
+
+mkdir -p /etc/valohai
+cat > /etc/valohai/worker.env <<EOT
+QUEUES=$VALOHAI_QUEUE
+REDIS_URL=redis://$REDIS_URL:6379
+REDIS_LOGS_URL=redis://$REDIS_LOGS_URL:6379
+EOT
+
+# Warm pool instances must not take jobs before they are stopped into the pool,
+# so only enable peon for the next boot. The state is InService otherwise.
+LIFECYCLE_STATE=`curl -sf -H "X-aws-ec2-metadata-token: $TOKEN" $IMDS/meta-data/autoscaling/target-lifecycle-state || true`
+case "$LIFECYCLE_STATE" in
+  Warmed:*)
+    systemctl enable peon
+    ;;
+  *)
+    systemctl enable --now peon
+    ;;
+esac
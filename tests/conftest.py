@@ -0,0 +1,15 @@
+import os
+from typing import Iterator
+
+import pytest
+
+from tests.synth import ROOT
+
+
+@pytest.fixture(autouse=True, scope="session")
+def repo_root() -> Iterator[None]:
+    # Constructs read their scripts relative to the repository root
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    yield
+    os.chdir(cwd)
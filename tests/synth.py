@@ -0,0 +1,159 @@
+"""
+Offline synth of the Valohai stacks from config.yaml for the tests.
+
+The VPC and the Roi AMI come from the offline section, so the tests need no
+AWS credentials and don't depend on cdk.context.json.
+"""
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import aws_cdk as cdk
+import aws_cdk.cx_api as cx_api
+import yaml
+from aws_cdk.assertions import Annotations
+from aws_cdk.assertions import Match
+from aws_cdk.assertions import Template
+
+from backend.component import Valohai
+from backend.component import ValohaiStateful
+from backend.guardrails import RULES
+from backend.guardrails import synth as synth_app
+from backend.sizing import apply_sizing
+from backend.sizing import merge
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# The subnets of config.yaml
+OFFLINE = {
+    "roi_ami_id": "ami-0680518a203cc1dc8",
+    "vpc_cidr_block": "10.0.0.0/16",
+    "subnets": {
+        "subnet-09fa71506c5274edf": {
+            "availability_zone": "us-east-1a",
+            "route_table_id": "rtb-0a08d593d9b25d59e",
+        },
+        "subnet-0ef2e899c53ce8e3f": {
+            "availability_zone": "us-east-1b",
+            "route_table_id": "rtb-0a08d593d9b25d59e",
+        },
+        "subnet-095202b0a4f855773": {
+            "availability_zone": "us-east-1a",
+            "route_table_id": "rtb-0ed07290ee7e73075",
+        },
+        "subnet-0876140165953bf66": {
+            "availability_zone": "us-east-1b",
+            "route_table_id": "rtb-08c364d5ce3988e31",
+        },
+    },
+}
+
+WORKER_AMI_ID = "ami-0123456789abcdef0"
+
+# Every opt-in section enabled at once
+ALL_FEATURES: Dict[str, Any] = {
+    "roi": {
+        "autoscaling": {"min_size": 2, "max_size": 6},
+        "background_workers": {},
+    },
+    "database": {"instance_type": "r6i.xlarge", "aurora": {"readers": 1}, "proxy": {}},
+    "redis": {"replicas": 1, "logs": {"replicas": 1}},
+    "worker_queues": [
+        {
+            "name": "cpu",
+            "instance_types": ["m5.xlarge", "m5a.xlarge"],
+            "ami_id": WORKER_AMI_ID,
+        },
+        {
+            "name": "gpu",
+            "instance_types": ["p3.2xlarge"],
+            "on_demand_percentage": 100,
+            "warm_pool_size": 1,
+        },
+        {
+            "name": "training",
+            "instance_types": ["p4d.24xlarge"],
+            "on_demand_percentage": 100,
+            "placement_group": True,
+            "efa": True,
+            "ami_id": WORKER_AMI_ID,
+        },
+    ],
+    "worker_image": {"agent_installer_url": "https://example.com/install-peon.sh"},
+    "cdn": {
+        "artifact_paths": ["/data/*"],
+        "artifact_public_key": "-----BEGIN PUBLIC KEY-----\n...\n-----END PUBLIC KEY-----\n",
+    },
+    "vpc_endpoints": {},
+    "ecr_cache": {},
+    "fsx": {},
+    "interruptions": {},
+    "access_logs": {},
+}
+
+
+@dataclass
+class Synthesized:
+    stateful: cdk.Stack
+    stateless: cdk.Stack
+    seconds: float
+    guardrails: List[Tuple[str, str]]
+
+    @property
+    def templates(self) -> List[Template]:
+        return [Template.from_stack(self.stateful), Template.from_stack(self.stateless)]
+
+    def errors(self) -> List[Any]:
+        return [
+            error
+            for stack in (self.stateful, self.stateless)
+            for error in Annotations.from_stack(stack).find_error(
+                "*", Match.any_value()
+            )
+        ]
+
+
+def load_config(overrides: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    with open(ROOT / "config.yaml", encoding="UTF-8") as config_file:
+        config: Dict[str, Any] = yaml.safe_load(config_file)
+    config.pop("environments", None)
+    # Overrides merge like environments in app.py
+    return merge({**config, "offline": OFFLINE}, overrides or {})
+
+
+def synth(overrides: Optional[Dict[str, Any]] = None) -> Synthesized:
+    """Synthesize both stacks the way app.py does for a single environment."""
+    config, _ = apply_sizing(load_config(overrides))
+    env = cdk.Environment(
+        account=str(config["aws_account_id"]), region=config["aws_region"]
+    )
+
+    started = time.monotonic()
+    app = cdk.App()
+    stateful = ValohaiStateful(app, "ValohaiTestStateful", env=env, config=config)
+    stateless = Valohai(app, "ValohaiTest", env=env, config=config, stateful=stateful)
+    assembly = synth_app(app)
+    seconds = time.monotonic() - started
+    return Synthesized(
+        stateful,
+        stateless,
+        seconds,
+        guardrail_messages(assembly, stateful.stack_name, stateless.stack_name),
+    )
+
+
+def guardrail_messages(
+    assembly: cx_api.CloudAssembly, *stack_names: str
+) -> List[Tuple[str, str]]:
+    """Return the (severity, message) of the guardrail annotations of stacks."""
+    messages = [
+        (message.entry.type.rsplit(":", 1)[-1], message.entry.data)
+        for stack_name in stack_names
+        for message in assembly.get_stack_by_name(stack_name).messages
+    ]
+    return [
+        (severity, data)
+        for severity, data in messages
+        if isinstance(data, str) and data[1:].split("]")[0] in RULES
+    ]
@@ -0,0 +1,118 @@
+from typing import Any, Dict, List, Tuple
+
+import aws_cdk as cdk
+import aws_cdk.aws_ec2 as ec2
+import pytest
+from aws_cdk.assertions import Annotations
+from aws_cdk.assertions import Match
+
+from backend.guardrails import PerformanceGuardrails
+from backend.guardrails import gp2_block_devices
+from backend.guardrails import is_burstable
+from backend.guardrails import synth as synth_app
+from tests.synth import guardrail_messages
+from tests.synth import synth
+
+
+def check_volume(
+    volume_type: str, override: Dict[str, Any], **guardrails: Any
+) -> List[Tuple[str, str]]:
+    app = cdk.App()
+    stack = cdk.Stack(app, "Guarded")
+    cdk.Aspects.of(stack).add(PerformanceGuardrails(**guardrails))
+    volume = ec2.CfnVolume(
+        stack,
+        "volume",
+        availability_zone="us-east-1a",
+        size=100,
+        volume_type=volume_type,
+    )
+    for key, value in override.items():
+        volume.add_property_override(key, value)
+    return guardrail_messages(synth_app(app), "Guarded")
+
+
+@pytest.mark.parametrize(
+    "instance_type, burstable",
+    [
+        ("t3.large", True),
+        ("db.t4g.medium", True),
+        ("cache.t3.micro", True),
+        ("m5.xlarge", False),
+        ("db.r6g.large", False),
+        ("trn1.32xlarge", False),
+        ("trn2.48xlarge", False),
+        ({"Ref": "InstanceType"}, False),
+    ],
+)
+def test_is_burstable(instance_type: Any, burstable: bool) -> None:
+    assert is_burstable(instance_type) == burstable
+
+
+@pytest.mark.parametrize(
+    "mappings, gp2",
+    [
+        ([{"DeviceName": "/dev/sda1", "Ebs": {"VolumeType": "gp3"}}], False),
+        ([{"DeviceName": "/dev/sda1", "Ebs": {"VolumeType": "gp2"}}], True),
+        ([{"DeviceName": "/dev/sda1", "Ebs": {"VolumeSize": 100}}], True),
+        ([{"DeviceName": "/dev/sdb", "VirtualName": "ephemeral0"}], False),
+        (None, False),
+    ],
+)
+def test_gp2_block_devices(mappings: Any, gp2: bool) -> None:
+    assert gp2_block_devices(mappings) == gp2
+
+
+def test_property_overrides_are_checked() -> None:
+    messages = check_volume("gp3", {"VolumeType": "gp2"})
+
+    assert [severity for severity, _ in messages] == ["error"]
+    assert messages[0][1].startswith("[gp2-volume]")
+
+
+def test_violations_are_annotated_on_the_resource() -> None:
+    app = cdk.App()
+    stack = cdk.Stack(app, "Guarded")
+    cdk.Aspects.of(stack).add(PerformanceGuardrails())
+    ec2.CfnVolume(stack, "volume", availability_zone="us-east-1a", size=100)
+
+    synth_app(app)
+
+    errors = Annotations.from_stack(stack).find_error("*", Match.any_value())
+    assert [error.id for error in errors] == ["/Guarded/volume"]
+
+
+def test_overridden_gp2_volume_passes() -> None:
+    assert check_volume("gp2", {"VolumeType": "gp3"}) == []
+
+
+def test_rules_can_be_turned_off_or_suppressed() -> None:
+    assert check_volume("gp2", {}, rules={"gp2-volume": "warning"})[0][0] == "warning"
+    assert check_volume("gp2", {}, rules={"gp2-volume": "off"}) == []
+    assert check_volume("gp2", {}, suppressions={"gp2-volume": ["volume"]}) == []
+
+
+def test_unknown_rules_fail() -> None:
+    with pytest.raises(ValueError, match="Unknown guardrail rules"):
+        PerformanceGuardrails(rules={"slow-disk": "error"})
+    with pytest.raises(ValueError, match="Unknown severity fatal"):
+        PerformanceGuardrails(rules={"gp2-volume": "fatal"})
+
+
+def test_stock_config_only_warns() -> None:
+    synthesized = synth()
+
+    assert synthesized.errors() == []
+    assert {message.split("]")[0] for _, message in synthesized.guardrails} == {
+        "[single-node-redis",
+        "[http1-listener",
+    }
+
+
+def test_burstable_roi_warns() -> None:
+    synthesized = synth({"roi": {"instance_type": "t3.xlarge"}})
+
+    assert any(
+        severity == "warning" and "[burstable-instance]" in message
+        for severity, message in synthesized.guardrails
+    )
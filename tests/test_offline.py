@@ -0,0 +1,90 @@
+import json
+from pathlib import Path
+from typing import Dict
+
+import aws_cdk as cdk
+import pytest
+
+from backend.component import offline_vpc
+
+SUBNETS: Dict[str, Dict[str, str]] = {
+    "subnet-a1": {"availability_zone": "us-east-1a", "route_table_id": "rtb-public"},
+    "subnet-b1": {"availability_zone": "us-east-1b", "route_table_id": "rtb-public"},
+    "subnet-a2": {"availability_zone": "us-east-1a", "route_table_id": "rtb-a"},
+    "subnet-a3": {"availability_zone": "us-east-1a", "route_table_id": "rtb-a"},
+    "subnet-b2": {"availability_zone": "us-east-1b", "route_table_id": "rtb-b"},
+    "subnet-b3": {"availability_zone": "us-east-1b", "route_table_id": "rtb-b"},
+}
+
+
+def stack() -> cdk.Stack:
+    return cdk.Stack(
+        cdk.App(),
+        "Offline",
+        env=cdk.Environment(account="123456789012", region="us-east-1"),
+    )
+
+
+def test_subnets_keep_their_availability_zone() -> None:
+    vpc = offline_vpc(
+        stack(),
+        "vpc-1",
+        public_subnet_ids=["subnet-a1", "subnet-b1"],
+        private_subnet_ids=["subnet-a2", "subnet-a3", "subnet-b2", "subnet-b3"],
+        vpc_cidr_block="10.0.0.0/16",
+        subnets=SUBNETS,
+    )
+
+    for subnet in [*vpc.public_subnets, *vpc.private_subnets]:
+        assert subnet.availability_zone == (
+            SUBNETS[subnet.subnet_id]["availability_zone"]
+        )
+        assert subnet.route_table.route_table_id == (
+            SUBNETS[subnet.subnet_id]["route_table_id"]
+        )
+    assert vpc.availability_zones == ["us-east-1a", "us-east-1b"]
+
+
+def test_shared_subnets_are_listed_once() -> None:
+    vpc = offline_vpc(
+        stack(),
+        "vpc-1",
+        public_subnet_ids=["subnet-a1", "subnet-b1"],
+        private_subnet_ids=["subnet-a2", "subnet-b2", "subnet-a2", "subnet-b2"],
+        vpc_cidr_block="10.0.0.0/16",
+        subnets=SUBNETS,
+    )
+
+    assert [subnet.subnet_id for subnet in vpc.private_subnets] == [
+        "subnet-a2",
+        "subnet-b2",
+    ]
+
+
+def test_uneven_availability_zones_fail() -> None:
+    with pytest.raises(ValueError, match="same number of subnets in every AZ"):
+        offline_vpc(
+            stack(),
+            "vpc-1",
+            public_subnet_ids=["subnet-a1", "subnet-b1"],
+            private_subnet_ids=["subnet-a2", "subnet-a3", "subnet-b2"],
+            vpc_cidr_block="10.0.0.0/16",
+            subnets=SUBNETS,
+        )
+
+
+def test_offline_synth_needs_no_context_lookups() -> None:
+    scope = stack()
+    offline_vpc(
+        scope,
+        "vpc-1",
+        public_subnet_ids=["subnet-a1", "subnet-b1"],
+        private_subnet_ids=["subnet-a2", "subnet-b2"],
+        vpc_cidr_block="10.0.0.0/16",
+        subnets=SUBNETS,
+    )
+
+    app = cdk.Stage.of(scope)
+    assert app is not None
+    manifest = Path(app.synth().directory) / "manifest.json"
+    assert "missing" not in json.loads(manifest.read_text())
@@ -0,0 +1,328 @@
+import json
+import subprocess
+import threading
+from typing import Any, Dict, List, Tuple
+from unittest import mock
+
+import pytest
+
+from backend.compute import roi_bootstrap
+
+IDENTITY = {"region": "eu-west-1", "accountId": "123456789012"}
+
+
+class StubAws:
+    """Stands in for the AWS CLI, recording every call."""
+
+    def __init__(
+        self,
+        parameters: Dict[str, str],
+        secrets: Dict[str, str],
+        concurrent_secrets: int = 1,
+    ):
+        self.parameters = parameters
+        self.secrets = secrets
+        self.calls: List[Tuple[str, ...]] = []
+        self.lock = threading.Lock()
+        # Secret fetches block until all of them are in flight, so fetching
+        # them one at a time breaks the barrier
+        self.barrier = threading.Barrier(concurrent_secrets, timeout=5)
+
+    def __call__(self, *args: str) -> Any:
+        with self.lock:
+            self.calls.append(args)
+        if args[:2] == ("ssm", "get-parameters"):
+            names = args[args.index("--names") + 1 :]
+            return {
+                "Parameters": [
+                    {"Name": name, "Value": self.parameters[name]}
+                    for name in names
+                    if name in self.parameters
+                ],
+                "InvalidParameters": [
+                    name for name in names if name not in self.parameters
+                ],
+            }
+        if args[:2] == ("secretsmanager", "get-secret-value"):
+            self.barrier.wait()
+            return {"SecretString": self.secrets[args[args.index("--secret-id") + 1]]}
+        raise AssertionError(f"Unexpected AWS call {args}")
+
+    def service_calls(self, service: str) -> List[Tuple[str, ...]]:
+        return [call for call in self.calls if call[0] == service]
+
+
+def test_fetch_parameters_batches_get_parameters() -> None:
+    aws = StubAws(
+        {"valohai-db-url": "db.internal", "valohai-redis-url": "redis.internal"}, {}
+    )
+
+    values = roi_bootstrap.fetch_parameters(
+        aws,
+        {
+            "db_url": "valohai-db-url",
+            "db_reader_url": "valohai-db-url",
+            "redis_url": "valohai-redis-url",
+        },
+    )
+
+    assert values == {
+        "db_url": "db.internal",
+        "db_reader_url": "db.internal",
+        "redis_url": "redis.internal",
+    }
+    assert aws.calls == [
+        (
+            "ssm",
+            "get-parameters",
+            "--with-decryption",
+            "--names",
+            "valohai-db-url",
+            "valohai-redis-url",
+        )
+    ]
+
+
+def test_fetch_parameters_without_names_skips_the_call() -> None:
+    aws = StubAws({}, {})
+
+    assert roi_bootstrap.fetch_parameters(aws, {}) == {}
+    assert aws.calls == []
+
+
+def test_fetch_parameters_fails_on_missing_parameters() -> None:
+    aws = StubAws({"valohai-db-url": "db.internal"}, {})
+
+    with pytest.raises(RuntimeError, match="Missing SSM parameters.*valohai-redis-url"):
+        roi_bootstrap.fetch_parameters(
+            aws, {"db_url": "valohai-db-url", "redis_url": "valohai-redis-url"}
+        )
+
+
+def test_fetch_secrets_runs_concurrently() -> None:
+    secrets = {
+        "db": json.dumps({"username": "roi", "password": "hunter2"}),
+        "secret_key": "not-json",
+        "repo_key": "also-not-json",
+    }
+    aws = StubAws({}, secrets, concurrent_secrets=len(secrets))
+
+    values = roi_bootstrap.fetch_secrets(aws, {key: key for key in secrets})
+
+    assert values == {
+        "db": {"username": "roi", "password": "hunter2"},
+        "secret_key": "not-json",
+        "repo_key": "also-not-json",
+    }
+    assert len(aws.service_calls("secretsmanager")) == len(secrets)
+
+
+def test_fetch_values_adds_identity() -> None:
+    aws = StubAws(
+        {"valohai-redis-url": "redis.internal"}, {"db": json.dumps({"password": "p"})}
+    )
+    plan = {"parameters": {"redis_url": "valohai-redis-url"}, "secrets": {"db": "db"}}
+
+    values = roi_bootstrap.fetch_values(aws, plan, IDENTITY)
+
+    assert values == {
+        "redis_url": "redis.internal",
+        "db": {"password": "p"},
+        "aws_region": "eu-west-1",
+        "aws_account": "123456789012",
+    }
+    assert len(aws.service_calls("ssm")) == 1
+
+
+def test_render_roi_config_replaces_and_appends() -> None:
+    current = "DEBUG=0\nDATABASE_URL=old\n"
+
+    rendered = roi_bootstrap.render_roi_config(
+        current,
+        {"DATABASE_URL": "psql://{db_url}", "REDIS_URL": "redis://{redis_url}"},
+        {"db_url": "db.internal", "redis_url": "redis.internal"},
+    )
+
+    assert rendered == (
+        "DEBUG=0\nDATABASE_URL=psql://db.internal\nREDIS_URL=redis://redis.internal\n"
+    )
+
+
+class StubParameterStore:
+    """SSM parameters with the error output of the AWS CLI."""
+
+    def __init__(self, parameters: Dict[str, str]):
+        self.parameters = parameters
+
+    def __call__(self, *args: str) -> Any:
+        name = args[args.index("--name") + 1]
+        if args[:2] == ("ssm", "get-parameter"):
+            if name not in self.parameters:
+                raise subprocess.CalledProcessError(
+                    254, args, stderr="An error occurred (ParameterNotFound)"
+                )
+            return {"Parameter": {"Name": name, "Value": self.parameters[name]}}
+        if args[:2] == ("ssm", "put-parameter"):
+            if name in self.parameters and "--overwrite" not in args:
+                raise subprocess.CalledProcessError(
+                    254, args, stderr="An error occurred (ParameterAlreadyExists)"
+                )
+            self.parameters[name] = args[args.index("--value") + 1]
+            return {"Version": 1}
+        if args[:2] == ("ssm", "delete-parameter"):
+            del self.parameters[name]
+            return None
+        raise AssertionError(f"Unexpected AWS call {args}")
+
+
+def test_migrate_once_leader_migrates() -> None:
+    store = StubParameterStore({})
+    migrations: List[str] = []
+
+    migrated = roi_bootstrap.migrate_once(
+        store, "valohai-roi-migrations-3f2a1b4c5d6e", lambda: migrations.append("run")
+    )
+
+    assert migrated
+    assert migrations == ["run"]
+    assert store.parameters == {"valohai-roi-migrations-3f2a1b4c5d6e": "done"}
+
+
+def test_migrate_once_waits_for_the_leader() -> None:
+    store = StubParameterStore({"valohai-roi-migrations-3f2a1b4c5d6e": "running"})
+
+    def leader_finishes(seconds: float) -> None:
+        store.parameters["valohai-roi-migrations-3f2a1b4c5d6e"] = "done"
+
+    with mock.patch("time.sleep", leader_finishes):
+        migrated = roi_bootstrap.migrate_once(
+            store,
+            "valohai-roi-migrations-3f2a1b4c5d6e",
+            lambda: pytest.fail("migrated"),
+        )
+
+    assert not migrated
+
+
+def test_migrate_once_releases_the_lock_on_failure() -> None:
+    store = StubParameterStore({})
+
+    def migrate() -> None:
+        raise subprocess.CalledProcessError(1, ["docker", "run"])
+
+    with pytest.raises(subprocess.CalledProcessError):
+        roi_bootstrap.migrate_once(
+            store, "valohai-roi-migrations-3f2a1b4c5d6e", migrate
+        )
+
+    assert store.parameters == {}
+
+
+def test_migrate_once_times_out() -> None:
+    store = StubParameterStore({"valohai-roi-migrations-3f2a1b4c5d6e": "running"})
+
+    with pytest.raises(RuntimeError, match="Timed out"):
+        roi_bootstrap.migrate_once(
+            store,
+            "valohai-roi-migrations-3f2a1b4c5d6e",
+            lambda: pytest.fail("migrated"),
+            timeout=0.05,
+            interval=0.01,
+        )
+
+
+def test_cached_image_uses_the_docker_hub_prefix() -> None:
+    registry = "123456789012.dkr.ecr.eu-west-1.amazonaws.com"
+
+    assert roi_bootstrap.cached_image(registry) == (
+        f"{registry}/docker-hub/valohai/roi:latest"
+    )
+
+
+def test_image_id_pulls_a_missing_image() -> None:
+    commands: List[Tuple[str, ...]] = []
+    image = "valohai/roi:latest"
+
+    def run(args: List[str], **kwargs: Any) -> subprocess.CompletedProcess[str]:
+        commands.append(tuple(args))
+        if args[:3] == ["docker", "image", "inspect"]:
+            if ("docker", "pull", image) not in commands:
+                raise subprocess.CalledProcessError(1, args)
+            return subprocess.CompletedProcess(
+                args, 0, stdout="sha256:3f2a1b4c5d6e7f80\n"
+            )
+        return subprocess.CompletedProcess(args, 0)
+
+    with mock.patch.object(subprocess, "run", run):
+        assert roi_bootstrap.image_id(image) == "3f2a1b4c5d6e"
+
+    assert [command[:3] for command in commands] == [
+        ("docker", "image", "inspect"),
+        ("docker", "pull", image),
+        ("docker", "image", "inspect"),
+    ]
+
+
+def describe_instances(*mappings: Tuple[str, str]) -> Dict[str, Any]:
+    return {
+        "Reservations": [
+            {
+                "Instances": [
+                    {
+                        "BlockDeviceMappings": [
+                            {"DeviceName": name, "Ebs": {"VolumeId": volume_id}}
+                            for name, volume_id in mappings
+                        ]
+                    }
+                ]
+            }
+        ]
+    }
+
+
+def test_find_device_uses_the_device_name(tmp_path: Any) -> None:
+    device = tmp_path / "xvdb"
+    device.touch()
+
+    def no_aws(*args: str) -> Any:
+        pytest.fail("called AWS")
+
+    assert roi_bootstrap.find_device(no_aws, "i-1", str(device)) == str(device)
+
+
+def test_find_device_matches_the_nvme_serial(tmp_path: Any) -> None:
+    # Instance store disks show up as other NVMe devices
+    (tmp_path / "nvme1n1").touch()
+    (tmp_path / "nvme2n1").touch()
+    (tmp_path / "ebs-vol0123456789abcdef0").symlink_to(tmp_path / "nvme2n1")
+    calls: List[Tuple[str, ...]] = []
+
+    def aws(*args: str) -> Any:
+        calls.append(args)
+        return describe_instances(
+            ("/dev/xvda", "vol-0fedcba9876543210"),
+            ("/dev/xvdb", "vol-0123456789abcdef0"),
+        )
+
+    with mock.patch.object(
+        roi_bootstrap, "EBS_DEVICE_LINK", str(tmp_path / "ebs-{serial}")
+    ):
+        device = roi_bootstrap.find_device(aws, "i-1", "/dev/xvdb")
+
+    assert device == str(tmp_path / "nvme2n1")
+    assert calls == [("ec2", "describe-instances", "--instance-ids", "i-1")]
+
+
+def test_find_device_fails_without_the_volume(tmp_path: Any) -> None:
+    def aws(*args: str) -> Any:
+        return describe_instances(("/dev/xvdb", "vol-0123456789abcdef0"))
+
+    with mock.patch.object(
+        roi_bootstrap, "EBS_DEVICE_LINK", str(tmp_path / "ebs-{serial}")
+    ):
+        with pytest.raises(RuntimeError, match="No device for vol-0123456789abcdef0"):
+            roi_bootstrap.find_device(
+                aws, "i-1", "/dev/xvdb", timeout=0.05, interval=0.01
+            )
+        with pytest.raises(RuntimeError, match="No EBS volume is attached"):
+            roi_bootstrap.find_device(aws, "i-1", "/dev/xvdc")
@@ -0,0 +1,126 @@
+from typing import Any, Dict
+
+import pytest
+
+from backend.sizing import apply_sizing
+from backend.sizing import merge
+from tests.synth import load_config
+from tests.synth import synth
+
+
+def sized(sizing: Dict[str, Any], **sections: Any) -> Dict[str, Any]:
+    config, _ = apply_sizing({"sizing": sizing, **sections})
+    return config
+
+
+def test_without_sizing_config_is_unchanged() -> None:
+    config = {"database": {"instance_type": "m5.xlarge"}}
+
+    assert apply_sizing(config) == (config, [])
+
+
+def test_unknown_profile_fails() -> None:
+    with pytest.raises(ValueError, match="Unknown sizing profile huge"):
+        apply_sizing({"sizing": {"profile": "huge"}})
+
+
+def test_unknown_parameter_fails() -> None:
+    with pytest.raises(ValueError, match="Unknown sizing parameters"):
+        apply_sizing({"sizing": {"users": 10}})
+
+
+def test_small_profile() -> None:
+    config = sized({"profile": "small"})
+
+    assert config["roi"] == {"instance_type": "m5a.large"}
+    assert config["database"] == {
+        "instance_type": "m5.large",
+        "allocated_storage": 20,
+        "max_allocated_storage": 80,
+    }
+    assert config["redis"] == {"replicas": 0, "node_type": "cache.m5.large"}
+
+
+def test_large_profile_provisions_iops_and_a_logs_cluster() -> None:
+    config = sized({"profile": "large"})
+
+    assert config["database"]["iops"] == 12000
+    assert config["database"]["allocated_storage"] == 597
+    assert config["redis"]["node_type"] == "cache.m5.large"
+    assert config["redis"]["logs"] == {"node_type": "cache.r6g.large", "replicas": 1}
+
+
+def test_load_parameters_adjust_the_profile() -> None:
+    small = sized({"profile": "small"})
+    busy = sized({"profile": "small", "active_users": 400})
+
+    assert small["roi"]["instance_type"] == "m5a.large"
+    assert busy["roi"]["instance_type"] == "m5a.4xlarge"
+
+
+def test_pinned_values_win() -> None:
+    config = sized(
+        {"profile": "large"},
+        database={"instance_type": "r6i.2xlarge"},
+        redis={"logs": {"node_type": "cache.r6g.4xlarge"}},
+    )
+
+    assert config["database"]["instance_type"] == "r6i.2xlarge"
+    assert config["redis"]["logs"] == {"node_type": "cache.r6g.4xlarge", "replicas": 1}
+
+
+def test_pinned_storage_below_the_gp3_minimum_drops_iops() -> None:
+    config, explanations = apply_sizing(
+        {"sizing": {"profile": "xlarge"}, "database": {"allocated_storage": 20}}
+    )
+
+    assert "iops" not in config["database"]
+    assert config["database"]["allocated_storage"] == 20
+    assert config["database"]["max_allocated_storage"] == 80
+    assert any(e.startswith("database.iops = not provisioned") for e in explanations)
+
+
+def test_pinned_iops_get_the_gp3_minimum_storage() -> None:
+    config = sized({"profile": "small"}, database={"iops": 12000})
+
+    assert config["database"]["iops"] == 12000
+    assert config["database"]["allocated_storage"] == 400
+
+
+def test_logs_cluster_follows_pinned_replicas() -> None:
+    config = sized({"profile": "large"}, redis={"replicas": 0})
+
+    assert config["redis"]["replicas"] == 0
+    assert config["redis"]["logs"]["replicas"] == 0
+
+
+def test_explanations_mark_nested_overrides() -> None:
+    _, explanations = apply_sizing(
+        {
+            "sizing": {"profile": "large"},
+            "redis": {"logs": {"node_type": "cache.r6g.4xlarge"}},
+        }
+    )
+
+    overridden = [e for e in explanations if e.endswith("(overridden by config.yaml)")]
+    assert [e.split(" ", 1)[0] for e in overridden] == ["redis.logs.node_type"]
+
+
+def test_merge_is_deep() -> None:
+    base = {"database": {"instance_type": "m5.xlarge", "allocated_storage": 20}}
+
+    merged = merge(base, {"database": {"instance_type": "r6i.xlarge"}, "fsx": {}})
+
+    assert merged == {
+        "database": {"instance_type": "r6i.xlarge", "allocated_storage": 20},
+        "fsx": {},
+    }
+    assert base["database"]["instance_type"] == "m5.xlarge"
+
+
+@pytest.mark.parametrize("profile", ["small", "medium", "large", "xlarge"])
+def test_profiles_synthesize_with_the_stock_config(profile: str) -> None:
+    stock = load_config({})
+    assert stock["database"]["allocated_storage"] == 20
+
+    assert synth({"sizing": {"profile": profile}}).errors() == []
@@ -0,0 +1,34 @@
+"""
+Snapshots of the templates synthesized from the stock config.yaml.
+
+Review the diff of tests/snapshots when a change is intended, and update them
+with: UPDATE_SNAPSHOTS=1 python -m pytest tests/test_snapshot.py
+"""
+import json
+import os
+from typing import Any, Mapping
+
+import pytest
+
+from tests.synth import ROOT
+from tests.synth import synth
+
+SNAPSHOTS = ROOT / "tests" / "snapshots"
+
+
+def dump(template: Mapping[str, Any]) -> str:
+    return json.dumps(template, indent=2, sort_keys=True) + "\n"
+
+
+@pytest.mark.parametrize("stack", ["stateful", "stateless"])
+def test_snapshot(stack: str) -> None:
+    stateful, stateless = synth().templates
+    template = dump({"stateful": stateful, "stateless": stateless}[stack].to_json())
+    snapshot = SNAPSHOTS / f"{stack}.json"
+
+    if os.environ.get("UPDATE_SNAPSHOTS"):
+        SNAPSHOTS.mkdir(exist_ok=True)
+        snapshot.write_text(template, encoding="UTF-8")
+
+    assert snapshot.exists(), f"Missing {snapshot}, run with UPDATE_SNAPSHOTS=1"
+    assert template == snapshot.read_text(encoding="UTF-8")
@@ -0,0 +1,369 @@
+from typing import Any, Dict, Iterator, List, Tuple
+
+import pytest
+from aws_cdk.assertions import Match
+
+from tests.synth import ALL_FEATURES
+from tests.synth import WORKER_AMI_ID
+from tests.synth import synth
+
+STATEFUL = 0
+STATELESS = 1
+
+# Resources each opt-in section must add, as (stack, type, properties)
+Expectation = Tuple[int, str, Dict[str, Any]]
+FEATURES: Dict[str, Tuple[Dict[str, Any], List[Expectation]]] = {
+    "roi-autoscaling": (
+        {"roi": {"autoscaling": {}, "background_workers": {}}},
+        [
+            (
+                STATELESS,
+                "AWS::AutoScaling::AutoScalingGroup",
+                {"AutoScalingGroupName": "valohai-roi", "MinSize": "1"},
+            )
+        ],
+    ),
+    "roi-background-workers": (
+        {"roi": {"background_workers": {}}},
+        [
+            (
+                STATELESS,
+                "AWS::AutoScaling::AutoScalingGroup",
+                {"AutoScalingGroupName": "valohai-roi-workers"},
+            )
+        ],
+    ),
+    "aurora": (
+        {"database": {"instance_type": "r6i.xlarge", "aurora": {"readers": 1}}},
+        [
+            (STATEFUL, "AWS::RDS::DBCluster", {"Engine": "aurora-postgresql"}),
+            (STATEFUL, "AWS::RDS::DBInstance", {"DBInstanceClass": "db.r6i.xlarge"}),
+        ],
+    ),
+    "database-proxy": (
+        {"database": {"proxy": {}}},
+        [(STATEFUL, "AWS::RDS::DBProxy", {"DBProxyName": "valohai-db-proxy"})],
+    ),
+    "redis-replicas": (
+        {"redis": {"replicas": 1, "logs": {}}},
+        [
+            (
+                STATEFUL,
+                "AWS::ElastiCache::ReplicationGroup",
+                {"MultiAZEnabled": True, "ReplicasPerNodeGroup": 1},
+            ),
+            (
+                STATEFUL,
+                "AWS::ElastiCache::CacheCluster",
+                {"ClusterName": "valohai-logs-redis"},
+            ),
+        ],
+    ),
+    "worker-queues": (
+        {
+            "worker_queues": [
+                {
+                    "name": "training",
+                    "instance_types": ["p4d.24xlarge"],
+                    "placement_group": True,
+                    "efa": True,
+                    "ami_id": WORKER_AMI_ID,
+                }
+            ]
+        },
+        [
+            (
+                STATELESS,
+                "AWS::AutoScaling::AutoScalingGroup",
+                {"AutoScalingGroupName": "valohai-workers-training"},
+            ),
+            (STATELESS, "AWS::EC2::PlacementGroup", {"Strategy": "cluster"}),
+        ],
+    ),
+    "worker-image": (
+        {"worker_image": {"agent_installer_url": "https://example.com/install.sh"}},
+        [
+            (STATELESS, "AWS::ImageBuilder::ImagePipeline", {"Name": "valohai-worker"}),
+            (STATELESS, "AWS::ImageBuilder::Image", {}),
+        ],
+    ),
+    "cdn": (
+        {"cdn": ALL_FEATURES["cdn"]},
+        [
+            (STATELESS, "AWS::CloudFront::Distribution", {}),
+            (STATELESS, "AWS::CloudFront::OriginAccessControl", {}),
+            (
+                STATEFUL,
+                "AWS::S3::BucketPolicy",
+                {
+                    "PolicyDocument": {
+                        "Statement": Match.array_with(
+                            [Match.object_like({"Sid": "AllowCloudFrontArtifactReads"})]
+                        )
+                    }
+                },
+            ),
+        ],
+    ),
+    "vpc-endpoints": (
+        {"vpc_endpoints": {}},
+        [
+            (STATELESS, "AWS::EC2::VPCEndpoint", {"VpcEndpointType": "Gateway"}),
+            (
+                STATELESS,
+                "AWS::EC2::SecurityGroup",
+                {
+                    "GroupName": "valohai-sg-endpoints",
+                    "SecurityGroupIngress": [
+                        Match.object_like({"CidrIp": "10.0.0.0/16", "ToPort": 443})
+                    ],
+                },
+            ),
+        ],
+    ),
+    "vpc-endpoints-s3-allowed-buckets": (
+        {"vpc_endpoints": {"s3_allowed_buckets": ["datasets"]}},
+        [
+            (
+                STATELESS,
+                "AWS::EC2::VPCEndpoint",
+                {
+                    "VpcEndpointType": "Gateway",
+                    "PolicyDocument": {
+                        "Statement": [
+                            Match.object_like(
+                                {
+                                    "Resource": Match.array_with(
+                                        [
+                                            "arn:aws:s3:::ec2imagebuilder-*",
+                                            "arn:aws:s3:::datasets/*",
+                                        ]
+                                    )
+                                }
+                            )
+                        ]
+                    },
+                },
+            )
+        ],
+    ),
+    "ecr-cache": (
+        {"ecr_cache": {}},
+        [(STATELESS, "AWS::ECR::PullThroughCacheRule", {})],
+    ),
+    "fsx": (
+        {"fsx": {}},
+        [(STATEFUL, "AWS::FSx::FileSystem", {"FileSystemType": "LUSTRE"})],
+    ),
+    "interruptions": (
+        {"interruptions": {}},
+        [(STATELESS, "AWS::SQS::Queue", {"QueueName": "valohai-interruptions"})],
+    ),
+    "interruptions-drain": (
+        {
+            "interruptions": {"drain_timeout": 300},
+            "worker_queues": [
+                {
+                    "name": "cpu",
+                    "instance_types": ["m5.xlarge"],
+                    "ami_id": WORKER_AMI_ID,
+                }
+            ],
+        },
+        [
+            (
+                STATELESS,
+                "AWS::AutoScaling::LifecycleHook",
+                {"LifecycleHookName": "valohai-drain-cpu", "HeartbeatTimeout": 300},
+            ),
+            (
+                STATELESS,
+                "AWS::Events::Rule",
+                {
+                    "EventPattern": {
+                        "source": ["aws.autoscaling"],
+                        "detail-type": ["EC2 Instance-terminate Lifecycle Action"],
+                        "detail": {
+                            "AutoScalingGroupName": [{"prefix": "valohai-workers-"}]
+                        },
+                    }
+                },
+            ),
+        ],
+    ),
+    "access-logs": (
+        {"access_logs": {}},
+        [
+            (STATELESS, "AWS::Athena::WorkGroup", {"Name": "valohai-logs"}),
+            (STATEFUL, "AWS::S3::Bucket", {"BucketName": "valohai-logs-450886142693"}),
+        ],
+    ),
+    "arm64": (
+        {"architecture": "arm64"},
+        [
+            (STATEFUL, "AWS::RDS::DBInstance", {"DBInstanceClass": "db.m7g.xlarge"}),
+            (STATELESS, "AWS::EC2::Instance", {"InstanceType": "m7g.xlarge"}),
+        ],
+    ),
+}
+
+
+def test_default_config() -> None:
+    synthesized = synth()
+    stateful, stateless = synthesized.templates
+
+    assert synthesized.errors() == []
+    stateful.resource_count_is("AWS::RDS::DBInstance", 1)
+    stateful.resource_count_is("AWS::ElastiCache::CacheCluster", 1)
+    stateful.has_resource_properties(
+        "AWS::S3::Bucket", {"BucketName": "valohai-data-450886142693"}
+    )
+    stateless.resource_count_is("AWS::EC2::Instance", 1)
+    stateless.has_resource_properties(
+        "AWS::ElasticLoadBalancingV2::LoadBalancer", {"Name": "valohai-roi-lb"}
+    )
+    stateless.has_resource_properties(
+        "AWS::CloudWatch::Dashboard", {"DashboardName": "valohai-performance"}
+    )
+
+
+@pytest.mark.parametrize("feature", FEATURES)
+def test_feature(feature: str) -> None:
+    overrides, expectations = FEATURES[feature]
+    synthesized = synth(overrides)
+    templates = synthesized.templates
+
+    assert synthesized.errors() == []
+    for stack, resource_type, properties in expectations:
+        templates[stack].has_resource_properties(resource_type, properties)
+
+
+def test_all_features() -> None:
+    synthesized = synth(ALL_FEATURES)
+
+    assert synthesized.errors() == []
+
+
+@pytest.mark.parametrize(
+    "aurora, error",
+    [
+        ({}, "Aurora doesn't support m5.xlarge"),
+        ({"min_capacity": 0.5}, "min_capacity needs max_capacity"),
+    ],
+)
+def test_invalid_aurora(aurora: Dict[str, Any], error: str) -> None:
+    with pytest.raises(ValueError, match=error):
+        synth({"database": {"aurora": aurora}})
+
+
+def test_aurora_serverless() -> None:
+    stateful, _ = synth(
+        {"database": {"aurora": {"min_capacity": 0.5, "max_capacity": 16}}}
+    ).templates
+
+    stateful.has_resource_properties(
+        "AWS::RDS::DBCluster",
+        {"ServerlessV2ScalingConfiguration": {"MinCapacity": 0.5, "MaxCapacity": 16}},
+    )
+
+
+def test_roi_autoscaling_needs_background_workers() -> None:
+    with pytest.raises(ValueError, match="needs roi.background_workers"):
+        synth({"roi": {"autoscaling": {}}})
+
+
+def test_background_workers_need_an_instance() -> None:
+    with pytest.raises(ValueError, match="min_size must be at least 1"):
+        synth({"roi": {"background_workers": {"min_size": 0}}})
+
+
+def test_background_workers_scale_in_after_idle_minutes() -> None:
+    _, stateless = synth(
+        {"roi": {"background_workers": {"scale_in_minutes": 30}}}
+    ).templates
+
+    stateless.has_resource_properties(
+        "AWS::CloudWatch::Alarm",
+        {
+            "MetricName": "CeleryQueueDepth",
+            "ComparisonOperator": "LessThanOrEqualToThreshold",
+            "Threshold": 0,
+            "EvaluationPeriods": 30,
+        },
+    )
+
+
+def test_evictions_alarm_only_on_the_broker() -> None:
+    _, stateless = synth({"redis": {"logs": {}}}).templates
+
+    alarms = stateless.find_resources("AWS::CloudWatch::Alarm")
+    names = [alarm["Properties"]["AlarmName"] for alarm in alarms.values()]
+    assert [name for name in names if "evictions" in name] == [
+        "valohai-redis-evictions-valohai-queue-redis"
+    ]
+    assert "valohai-redis-memory-valohai-logs-redis" in names
+
+
+@pytest.mark.parametrize("docker_hub", [True, False])
+def test_roi_pulls_through_the_ecr_cache(docker_hub: bool) -> None:
+    ecr_cache = {"docker_hub_credential_arn": "arn:secret"} if docker_hub else {}
+    _, stateless = synth({"ecr_cache": ecr_cache}).templates
+
+    instances = stateless.find_resources("AWS::EC2::Instance")
+    user_data = str(
+        [instance["Properties"]["UserData"] for instance in instances.values()]
+    )
+    assert ('"image_registry": ' in user_data) == docker_hub
+
+
+def test_interruptions_dont_hold_scale_in_by_default() -> None:
+    _, stateless = synth(
+        {
+            "interruptions": {},
+            "worker_queues": [
+                {
+                    "name": "cpu",
+                    "instance_types": ["m5.xlarge"],
+                    "ami_id": WORKER_AMI_ID,
+                }
+            ],
+        }
+    ).templates
+
+    stateless.resource_count_is("AWS::AutoScaling::LifecycleHook", 0)
+    assert "autoscaling:CompleteLifecycleAction" not in str(stateless.to_json())
+
+
+def test_stateful_stack_doesnt_reference_the_stateless_stack() -> None:
+    stateful, _ = synth(ALL_FEATURES).templates
+
+    assert "Fn::ImportValue" not in str(stateful.to_json())
+
+
+def ebs_volume_types(value: Any) -> Iterator[str]:
+    """Yield the type of every EBS volume, where EC2 defaults a missing one to gp2."""
+    if isinstance(value, dict):
+        if isinstance(value.get("Ebs"), dict):
+            yield value["Ebs"].get("VolumeType", "gp2")
+        for child in value.values():
+            yield from ebs_volume_types(child)
+    elif isinstance(value, list):
+        for child in value:
+            yield from ebs_volume_types(child)
+
+
+@pytest.mark.parametrize("config", ["stock", "all-features"])
+def test_no_gp2_volumes(config: str) -> None:
+    templates = synth(ALL_FEATURES if config == "all-features" else {}).templates
+
+    for template in templates:
+        resources = template.to_json()["Resources"]
+        assert "gp2" not in set(ebs_volume_types(resources))
+        for resource in resources.values():
+            properties = resource.get("Properties", {})
+            if resource["Type"] == "AWS::EC2::Volume":
+                assert properties.get("VolumeType", "gp2") != "gp2"
+            # Aurora cluster instances have no storage of their own
+            if resource["Type"] == "AWS::RDS::DBInstance":
+                if "DBClusterIdentifier" not in properties:
+                    assert properties.get("StorageType") == "gp3"
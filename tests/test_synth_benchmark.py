@@ -0,0 +1,50 @@
+"""
+Synth time and template size for growing configs.
+
+CloudFormation rejects stacks with more than 500 resources or templates over
+1 MB, so the budgets keep a margin below both. Run with -s to print the
+measurements, and set VALOHAI_SYNTH_BUDGET (seconds) on slow machines.
+"""
+import json
+import os
+from typing import Any, Dict
+
+import pytest
+
+from tests.synth import ALL_FEATURES
+from tests.synth import synth
+
+CONFIGS: Dict[str, Dict[str, Any]] = {
+    "stock": {},
+    "autoscaling": {
+        "roi": {"autoscaling": {}, "background_workers": {}},
+        "redis": {"replicas": 1},
+        "interruptions": {},
+    },
+    "all-features": ALL_FEATURES,
+}
+
+SYNTH_BUDGET = float(os.environ.get("VALOHAI_SYNTH_BUDGET", "20"))
+MAX_RESOURCES = 400
+MAX_TEMPLATE_BYTES = 500_000
+ROUNDS = 3
+
+
+@pytest.mark.parametrize("config", CONFIGS)
+def test_synth_benchmark(config: str) -> None:
+    # The first synth also warms up the jsii runtime, so keep the fastest
+    runs = [synth(CONFIGS[config]) for _ in range(ROUNDS)]
+    seconds = min(run.seconds for run in runs)
+    templates = [template.to_json() for template in runs[0].templates]
+
+    resources = [len(template["Resources"]) for template in templates]
+    sizes = [len(json.dumps(template)) for template in templates]
+    print(
+        f"\n{config}: synth {seconds:.2f}s, "
+        f"stateful {resources[0]} resources {sizes[0]} bytes, "
+        f"stateless {resources[1]} resources {sizes[1]} bytes"
+    )
+
+    assert seconds < SYNTH_BUDGET
+    assert max(resources) < MAX_RESOURCES
+    assert max(sizes) < MAX_TEMPLATE_BYTES